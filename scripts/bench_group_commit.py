@@ -0,0 +1,69 @@
+"""
+Benchmark de escritura de mensajes: N escritores concurrentes contra POST /chat/{id}/messages.
+
+Ejecutar contra la API levantada dos veces, con CHAT_WRITE_BEHIND=0 y =1, y comparar:
+
+    python scripts/bench_group_commit.py --url http://localhost:8000 \\
+        --api-secret $API_SECRET_KEY --client-key <clave del cliente> --writers 500 --messages 20
+
+Con --conversations 1 todos los escritores compiten por la misma conversación (contención
+sobre su fila, ver src/core/activity.py).
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+
+async def writer(client: httpx.AsyncClient, conversation_id: int, messages: int, latencies: list, errors: list):
+    for i in range(messages):
+        start = time.perf_counter()
+        response = await client.post(
+            f"/chat/{conversation_id}/messages",
+            json={"role": "user", "content": f"mensaje de prueba {i}"},
+        )
+        latencies.append(time.perf_counter() - start)
+        if response.status_code != 201:
+            errors.append(response.status_code)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark de group commit de mensajes")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--api-secret", required=True, help="API_SECRET_KEY (Bearer)")
+    parser.add_argument("--client-key", required=True, help="X-API-Key de un Client")
+    parser.add_argument("--writers", type=int, default=500, help="Escritores concurrentes")
+    parser.add_argument("--messages", type=int, default=20, help="Mensajes por escritor")
+    parser.add_argument("--conversations", type=int, default=50, help="Conversaciones entre las que repartir")
+    args = parser.parse_args()
+
+    headers = {"Authorization": f"Bearer {args.api_secret}", "X-API-Key": args.client_key}
+    limits = httpx.Limits(max_connections=args.writers)
+    async with httpx.AsyncClient(base_url=args.url, headers=headers, limits=limits, timeout=120) as client:
+        conversation_ids = []
+        for i in range(args.conversations):
+            response = await client.post("/chat/conversations", json={"title": f"bench {i}"})
+            response.raise_for_status()
+            conversation_ids.append(response.json()["id"])
+
+        latencies, errors = [], []
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            writer(client, conversation_ids[i % len(conversation_ids)], args.messages, latencies, errors)
+            for i in range(args.writers)
+        ))
+        elapsed = time.perf_counter() - start
+
+    total = args.writers * args.messages
+    latencies.sort()
+    print(f"📊 {total} mensajes, {args.writers} escritores: {elapsed:.2f}s → {total / elapsed:.0f} msg/s")
+    print(f"   Latencia p50={statistics.median(latencies) * 1000:.1f}ms "
+          f"p99={latencies[int(len(latencies) * 0.99) - 1] * 1000:.1f}ms")
+    if errors:
+        print(f"❌ {len(errors)} errores (códigos: {sorted(set(errors))})")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
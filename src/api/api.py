@@ -2,12 +2,29 @@
 Cerebro Digital API - Main Application
 
 API REST para gestionar tu ecosistema de datos personal.
-Diseñado para ser consumido por humanos y por IAs (futuro MCP Server).
+Diseñado para ser consumido por humanos y por IAs (los agentes usan el servidor MCP, src/mcp).
 """
-from fastapi import FastAPI
+import os
 
-from src.core.database import init_db
-from src.api.routers import tasks, events, reminders, auth, chat
+import anyio.to_thread
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from sqlalchemy.exc import TimeoutError as SQLAlchemyTimeoutError
+
+from src.core.database import (
+    init_db, replica_router, connections_per_worker, reserve_dedicated_connections, DB_POOL_MODE, REPLICA_HEALTH_INTERVAL,
+    is_sqlite, optimize_sqlite, SQLITE_OPTIMIZE_INTERVAL,
+)
+from src.core.jobs import start_periodic_job, stop_jobs
+from src.core.outbox import change_notifier, prune_outbox, OUTBOX_PRUNE_INTERVAL
+from src.core.retention import run_retention, compact_archiving, RETENTION_INTERVAL, ARCHIVE_COMPACTION_INTERVAL
+from src.core.group_commit import group_committer
+from src.core.activity import activity_tracker, flush_activity, recover_activity, CONVERSATION_ACTIVITY_FLUSH_SECONDS
+from src.core.usage import aggregate_usage, USAGE_ROLLUP_INTERVAL
+from src.api.routers import tasks, events, reminders, auth, chat, sync, changes, agenda, transfer, stats
+from src.api.negotiation import ContentNegotiationMiddleware, register_datetime_fields
+from src.api.limits import FairAdmissionMiddleware, configure_admission
+from src.api.idempotency import IdempotencyMiddleware, prune_idempotency_records, IDEMPOTENCY_PRUNE_INTERVAL
 
 app = FastAPI(
     title="Cerebro Digital API",
@@ -29,11 +46,89 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Admisión: límite de concurrencia adaptativo, prioridades y cola justa por llamante (503 al saturarse)
+app.add_middleware(FairAdmissionMiddleware)
+
+# Idempotency-Key en POST/PATCH (dentro de la negociación: guarda y compara JSON)
+app.add_middleware(IdempotencyMiddleware)
+
+# MessagePack (Accept / Content-Type: application/msgpack) y compresión zstd/gzip
+app.add_middleware(ContentNegotiationMiddleware)
+
+# Read-your-writes: tras una escritura correcta, el llamante lee del primario durante unos segundos
+@app.middleware("http")
+async def track_primary_writes(request: Request, call_next):
+    response = await call_next(request)
+    if request.method not in ("GET", "HEAD", "OPTIONS") and response.status_code < 400:
+        replica_router.mark_write(replica_router.principal_key(
+            request.headers.get("x-api-key"), request.headers.get("x-client-id")
+        ))
+    return response
+
+@app.exception_handler(SQLAlchemyTimeoutError)
+async def pool_timeout_handler(request: Request, exc: SQLAlchemyTimeoutError):
+    """Pool agotado (pool_timeout): sobrecarga transitoria, no un error interno."""
+    return JSONResponse(
+        {"detail": "Database pool exhausted, retry later"},
+        status_code=503,
+        headers={"Retry-After": "1"},
+    )
+
 # Event handlers
+@app.on_event("startup")
+async def configure_concurrency():
+    """
+    Alinea la admisión y el threadpool de anyio (40 hilos por defecto) con las conexiones del
+    pool del worker, descontando antes la del LISTEN del outbox (vive fuera del pool).
+    Cada petición usa una sola conexión y los endpoints síncronos ocupan un hilo mientras la
+    usan: con más hilos o peticiones admitidas que conexiones, las sobrantes sólo esperarían
+    bloqueadas en el pool hasta pool_timeout. Va antes que on_startup, que crea el engine.
+    """
+    reserve_dedicated_connections(change_notifier.dedicated_connections())
+    configure_admission(connections_per_worker())
+    default_threads = connections_per_worker() if DB_POOL_MODE != "pgbouncer" else 40
+    threads = int(os.getenv("THREADPOOL_SIZE", default_threads))
+    anyio.to_thread.current_default_thread_limiter().total_tokens = max(1, threads)
+
 @app.on_event("startup")
 def on_startup():
     """Inicializa la base de datos al arrancar la aplicación"""
     init_db()
+    # MessagePack: campos de fecha según los modelos de respuesta
+    register_datetime_fields(app.openapi())
+    if replica_router.replicas:
+        # Salud de las réplicas fuera del camino de las peticiones (primera comprobación ya)
+        replica_router.check_replicas()
+        start_periodic_job("replica-health", REPLICA_HEALTH_INTERVAL, replica_router.check_replicas)
+    # Change data capture: aviso de nuevos cambios y poda del outbox confirmado
+    change_notifier.start()
+    start_periodic_job("outbox-prune", OUTBOX_PRUNE_INTERVAL, prune_outbox)
+    # Retención: archivado y borrado por lotes de conversaciones
+    start_periodic_job("retention", RETENTION_INTERVAL, run_retention)
+    # Compactación de las conversaciones archivadas, fuera de las peticiones
+    start_periodic_job("archive-compaction", ARCHIVE_COMPACTION_INTERVAL, compact_archiving)
+    start_periodic_job("idempotency-prune", IDEMPOTENCY_PRUNE_INTERVAL, prune_idempotency_records)
+    # Última actividad de las conversaciones, agrupada fuera del camino de escritura
+    # (primero, la que un worker caído no llegó a volcar)
+    recover_activity()
+    start_periodic_job("conversation-activity", CONVERSATION_ACTIVITY_FLUSH_SECONDS, flush_activity)
+    # Rollups de uso por cliente y modelo (GET /stats/usage)
+    start_periodic_job("usage-rollup", USAGE_ROLLUP_INTERVAL, aggregate_usage)
+    if is_sqlite():
+        # Modo embebido: estadísticas del planificador y checkpoint del WAL
+        start_periodic_job("sqlite-optimize", SQLITE_OPTIMIZE_INTERVAL, optimize_sqlite)
+
+@app.on_event("shutdown")
+def on_shutdown():
+    """Detiene los hilos en segundo plano"""
+    change_notifier.stop()
+    stop_jobs()
+    # Confirmar los mensajes que aún esperan su group commit
+    group_committer.stop()
+    # Y su actividad pendiente (tras el group commit, que aún puede anotar)
+    activity_tracker.flush()
+    if is_sqlite():
+        optimize_sqlite()
 
 
 # Health check endpoint
@@ -48,4 +143,9 @@ app.include_router(tasks.router)
 app.include_router(events.router)
 app.include_router(reminders.router)
 app.include_router(auth.router)
-app.include_router(chat.router)
\ No newline at end of file
+app.include_router(chat.router)
+app.include_router(sync.router)
+app.include_router(changes.router)
+app.include_router(agenda.router)
+app.include_router(transfer.router)
+app.include_router(stats.router)
\ No newline at end of file
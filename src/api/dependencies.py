@@ -1,15 +1,78 @@
 
-from fastapi import Header, HTTPException, Depends, status
+from fastapi import Header, HTTPException, Depends, Request, status
+from sqlalchemy import bindparam
+from sqlalchemy.engine import Engine
 from sqlmodel import Session, select
 from typing import Optional
 
-from src.core.database import get_session
+from src.core.database import get_engine, replica_router, checkout_timed, fetch_first_pipelined
 from src.core.models import Client, InferenceClient
+from src.api.limits import limit_caller
+
+# Auth lookups (fixed statements: compiled once, prepared on the server after a few uses)
+CLIENT_BY_KEY = select(Client).where(Client.client_key == bindparam("api_key"))
+SERVICE_BY_KEY = select(InferenceClient).where(InferenceClient.api_key == bindparam("api_key"))
+CLIENT_BY_ID = select(Client).where(Client.id == bindparam("client_id"))
+
+def _request_session(request: Request, engine: Engine):
+    """
+    Una sola sesión (y conexión) por engine y petición: la autenticación y el endpoint la
+    comparten. Si los dos usan el primario, la petición ocupa una conexión del pool, no dos.
+    La cierra la dependencia que la creó.
+    """
+    sessions = request.scope.setdefault("db_sessions", {})
+    session = sessions.get(engine)
+    if session is not None:
+        yield session
+        return
+    with Session(engine) as session:
+        sessions[engine] = session
+        try:
+            yield checkout_timed(session)
+        finally:
+            sessions.pop(engine, None)
+
+def _read_engine(request: Request) -> Engine:
+    """Engine de lectura de la petición (elegido una vez: la autenticación y el endpoint coinciden)."""
+    engine = request.scope.get("db_read_engine")
+    if engine is None:
+        key = replica_router.principal_key(
+            request.headers.get("x-api-key"), request.headers.get("x-client-id")
+        )
+        force_primary = request.headers.get("x-read-consistency", "").lower() == "strong"
+        engine = request.scope["db_read_engine"] = replica_router.read_engine(key, force_primary)
+    return engine
+
+def get_session(request: Request):
+    """Sesión del primario para los endpoints (compartida con la autenticación)."""
+    yield from _request_session(request, get_engine())
+
+def get_read_session(request: Request):
+    """
+    Sesión para endpoints de solo lectura.
+
+    Usa una réplica sana si hay réplicas configuradas (REPLICA_DATABASE_URLS), salvo que:
+    - El llamante haya escrito hace menos de REPLICA_STICKY_SECONDS (read-your-writes).
+    - La petición envíe `X-Read-Consistency: strong`.
+    En cualquier otro caso, o si no hay réplicas disponibles, lee del primario.
+    """
+    yield from _request_session(request, _read_engine(request))
+
+def get_auth_session(request: Request):
+    """
+    Sesión para las consultas de autenticación: la de lectura en GET/HEAD y la del primario
+    en las escrituras, es decir, la misma que va a usar el endpoint. Sin réplicas, una lectura
+    ocupa así una sola conexión del primario en lugar de una para autenticar y otra para leer.
+    """
+    if request.method in ("GET", "HEAD"):
+        yield from _request_session(request, _read_engine(request))
+    else:
+        yield from _request_session(request, get_engine())
 
 def get_current_client(
     x_api_key: str = Header(..., description="API Key for authentication"),
     x_client_id: Optional[str] = Header(None, description="Target Client ID (Required for Service Access)"),
-    session: Session = Depends(get_session)
+    session: Session = Depends(get_auth_session)
 ) -> Client:
     """
     Authenticates the request based on X-API-Key and optionally X-Client-ID.
@@ -18,12 +81,15 @@ def get_current_client(
     1. Check if X-API-Key belongs to a Client (Direct Access).
     2. Check if X-API-Key belongs to an InferenceClient (Service Access).
        - If Service Access, X-Client-ID IS REQUIRED to identify the target client.
+
+    The lookups are independent, so they are sent together (one round trip with psycopg 3).
     """
+    queries = [(CLIENT_BY_KEY, {"api_key": x_api_key}), (SERVICE_BY_KEY, {"api_key": x_api_key})]
+    if x_client_id:
+        queries.append((CLIENT_BY_ID, {"client_id": x_client_id}))
+    client, service, *target = fetch_first_pipelined(session, queries)
     
     # 1. Try Direct Client Access
-    statement = select(Client).where(Client.client_key == x_api_key)
-    client = session.exec(statement).first()
-    
     if client:
         if not client.is_active:
              raise HTTPException(
@@ -39,12 +105,10 @@ def get_current_client(
                 detail="API Key does not match provided Client ID"
             )
             
+        limit_caller(x_api_key, x_client_id, "client", client.id)
         return client
 
     # 2. Try Service Access (e.g. Orchestrator acting on behalf of a client)
-    statement = select(InferenceClient).where(InferenceClient.api_key == x_api_key)
-    service = session.exec(statement).first()
-    
     if service:
         if not service.is_active:
              raise HTTPException(
@@ -58,8 +122,8 @@ def get_current_client(
                 detail="X-Client-ID header is required for service access"
             )
             
-        # Fetch the target client
-        target_client = session.get(Client, x_client_id)
+        # The target client (fetched along with the key lookups)
+        target_client = target[0]
         if not target_client:
              raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -72,6 +136,8 @@ def get_current_client(
                 detail="Target Client is inactive"
             )
             
+        # El presupuesto es el del servicio que llama, no el del cliente en cuyo nombre actúa
+        limit_caller(x_api_key, x_client_id, "service", service.id)
         return target_client
         
     # 3. Auth Failed
@@ -82,7 +148,7 @@ def get_current_client(
 
 def get_inference_service(
     x_api_key: str = Header(..., description="API Key for internal service authentication"),
-    session: Session = Depends(get_session)
+    session: Session = Depends(get_auth_session)
 ) -> InferenceClient:
     """Authenticates internal services (like InferenceCenter)."""
     statement = select(InferenceClient).where(InferenceClient.api_key == x_api_key)
@@ -100,39 +166,40 @@ def get_inference_service(
             detail="Service is inactive"
         )
         
+    limit_caller(x_api_key, None, "service", service.id)
     return service
 
 def get_any_authenticated_caller(
     x_api_key: str = Header(..., description="API Key for authentication"),
-    session: Session = Depends(get_session)
+    session: Session = Depends(get_auth_session)
 ):
     """
     Authenticates the request based on X-API-Key.
     Allows BOTH direct clients and internal services, without requiring x-client-id.
     Useful for global endpoints like listing AI models.
     """
+    client, service = fetch_first_pipelined(
+        session, [(CLIENT_BY_KEY, {"api_key": x_api_key}), (SERVICE_BY_KEY, {"api_key": x_api_key})]
+    )
+
     # 1. Try Direct Client Access
-    statement = select(Client).where(Client.client_key == x_api_key)
-    client = session.exec(statement).first()
-    
     if client:
         if not client.is_active:
              raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Client is inactive"
             )
+        limit_caller(x_api_key, None, "client", client.id)
         return client
 
     # 2. Try Service Access
-    statement = select(InferenceClient).where(InferenceClient.api_key == x_api_key)
-    service = session.exec(statement).first()
-    
     if service:
         if not service.is_active:
              raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Service is inactive"
             )
+        limit_caller(x_api_key, None, "service", service.id)
         return service
         
     # 3. Auth Failed
@@ -0,0 +1,54 @@
+"""
+Sparse fieldsets en los endpoints de lectura: `?fields=id,role,created_at`.
+
+Con `fields`, la consulta carga sólo esas columnas (load_only: las demás ni se leen de la base
+de datos ni se serializan) y la respuesta sólo incluye esos campos. `id` va siempre.
+Sin `fields`, la respuesta es la de siempre (el modelo completo).
+"""
+from typing import Iterable, List, Optional
+
+from fastapi import HTTPException, Query
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy.orm import load_only
+
+FIELDS_QUERY = Query(
+    default=None,
+    description="Campos a devolver, separados por comas (ej: id,title,updated_at). Por defecto, todos",
+)
+
+
+def parse_fields(fields: Optional[str], schema) -> Optional[List[str]]:
+    """
+    Lista de campos pedidos, validada contra el esquema de la respuesta (un SQLModel o un
+    DTO de pydantic). None si no se pidió `fields`. 400 si alguno no existe.
+    """
+    if not fields:
+        return None
+    names = list(dict.fromkeys(name.strip() for name in fields.split(",") if name.strip()))
+    unknown = [name for name in names if name not in schema.model_fields]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return ["id"] + [name for name in names if name != "id"]
+
+
+def field_options(model, fields: Optional[Iterable[str]]) -> list:
+    """Opciones de carga para `select(model).options(*...)` o `session.get(..., options=...)`."""
+    if fields is None:
+        return []
+    columns = model.__table__.columns
+    return [load_only(*(getattr(model, name) for name in fields if name in columns))]
+
+
+def project(item, fields: List[str]) -> dict:
+    """Sólo los campos pedidos de una entidad (o de un dict). Los ausentes, como null."""
+    if isinstance(item, dict):
+        return {name: item.get(name) for name in fields}
+    return {name: getattr(item, name, None) for name in fields}
+
+
+def sparse_response(items, fields: List[str]) -> JSONResponse:
+    """Respuesta con sólo los campos pedidos, de una entidad o de una lista."""
+    if isinstance(items, list):
+        return JSONResponse(jsonable_encoder([project(item, fields) for item in items]))
+    return JSONResponse(jsonable_encoder(project(items, fields)))
@@ -0,0 +1,397 @@
+"""
+Soporte de `Idempotency-Key` para peticiones POST y PATCH.
+
+El orquestador puede reintentar (o lanzar peticiones duplicadas en paralelo, "hedging")
+con timeouts cortos sin crear filas duplicadas:
+
+- La primera petición con una clave se ejecuta y su respuesta se guarda en IdempotencyRecord
+  (con TTL) y en una caché en memoria.
+- Una repetición con la misma clave devuelve la respuesta original sin volver a ejecutarse
+  (cabecera `Idempotent-Replayed: true`).
+- Un duplicado concurrente espera a que termine la primera petición: en el mismo worker con
+  un asyncio.Event; en otro worker, consultando la fila pendiente en la base de datos.
+- La fila pendiente lleva un lease (`locked_until`) que se renueva mientras la petición se
+  ejecuta. Si el worker cae, el lease caduca y un reintento toma la clave en vez de recibir 409
+  hasta que venza el TTL. Un error o una cancelación liberan la clave al momento.
+- Reutilizar la clave con otro cuerpo o en otra ruta devuelve 422.
+- Las respuestas 5xx y 429 no se guardan: el cliente puede reintentar con la misma clave.
+- El cuerpo se guarda en memoria para calcular su huella y pasárselo al endpoint: por encima de
+  IDEMPOTENCY_MAX_BODY la petición recibe 413. /import (streaming de gigas) no admite la clave.
+  Una respuesta mayor que ese límite (o SSE) se envía sin guardarla y libera la clave.
+
+Las claves están separadas por credenciales (X-API-Key + X-Client-ID).
+"""
+import asyncio
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+import anyio
+from sqlalchemy import and_, or_, update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select, delete
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse, Response
+
+from src.core.database import get_engine, replica_router
+from src.core.models import IdempotencyRecord
+
+IDEMPOTENCY_HEADER = "idempotency-key"
+IDEMPOTENCY_TTL_HOURS = float(os.getenv("IDEMPOTENCY_TTL_HOURS", "24"))
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000"))
+# Espera máxima de un duplicado concurrente antes de responder 409
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "30"))
+IDEMPOTENCY_PRUNE_INTERVAL = float(os.getenv("IDEMPOTENCY_PRUNE_INTERVAL", "3600"))
+# Lease de la fila pendiente; se renueva cada tercio mientras la petición sigue en curso
+IDEMPOTENCY_LEASE_SECONDS = float(os.getenv("IDEMPOTENCY_LEASE_SECONDS", "30"))
+# Tamaño máximo del cuerpo de la petición, y de la respuesta que se guarda
+IDEMPOTENCY_MAX_BODY = int(os.getenv("IDEMPOTENCY_MAX_BODY", str(1024 * 1024)))
+_METHODS = ("POST", "PATCH")
+# Cuerpos en streaming: no se pueden guardar en memoria ni repetir
+_EXEMPT_PATHS = ("/import",)
+_POLL_SECONDS = 0.05
+
+# (fingerprint, status_code, content_type, body, expires_at)
+_Stored = Tuple[str, int, Optional[str], bytes, datetime]
+
+
+class _ResponseCache:
+    """LRU en memoria delante de la tabla (evita una consulta por repetición)."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._items: "OrderedDict[str, _Stored]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[_Stored]:
+        item = self._items.get(key)
+        if item is None:
+            return None
+        if item[4] <= datetime.utcnow():
+            self._items.pop(key, None)
+            return None
+        self._items.move_to_end(key)
+        return item
+
+    def put(self, key: str, item: _Stored) -> None:
+        self._items[key] = item
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+
+def _record_id(principal: str, idempotency_key: str) -> str:
+    return hashlib.sha256(f"{principal}|{idempotency_key}".encode()).hexdigest()[:40]
+
+
+def _fingerprint(method: str, path: str, query: bytes):
+    """Huella de la petición; el cuerpo se añade con update() a medida que llega."""
+    return hashlib.sha256(f"{method} {path}?".encode() + query + b"\n")
+
+
+# --- Acceso a la tabla (se ejecuta en el threadpool) ---
+
+def _load(record_id: str) -> Optional[IdempotencyRecord]:
+    with Session(get_engine()) as session:
+        record = session.get(IdempotencyRecord, record_id)
+        if record is not None and record.expires_at <= datetime.utcnow():
+            session.delete(record)
+            session.commit()
+            return None
+        return record
+
+
+def _lease_expired(record: IdempotencyRecord, now: datetime) -> bool:
+    if record.locked_until is None:
+        # Filas anteriores al lease: se usa created_at como inicio
+        return record.created_at + timedelta(seconds=IDEMPOTENCY_LEASE_SECONDS) < now
+    return record.locked_until < now
+
+
+def _claim(record_id: str, fingerprint: str) -> bool:
+    """
+    Inserta la fila pendiente con su lease. Si ya existe, la toma sólo si sigue pendiente y su
+    lease ha caducado (el worker que la tenía cayó). False si otra petición tiene la clave.
+    """
+    now = datetime.utcnow()
+    locked_until = now + timedelta(seconds=IDEMPOTENCY_LEASE_SECONDS)
+    expires_at = now + timedelta(hours=IDEMPOTENCY_TTL_HOURS)
+    with Session(get_engine()) as session:
+        session.add(IdempotencyRecord(
+            id=record_id, fingerprint=fingerprint, expires_at=expires_at, locked_until=locked_until,
+        ))
+        try:
+            session.commit()
+            return True
+        except IntegrityError:
+            session.rollback()
+        lease_start = now - timedelta(seconds=IDEMPOTENCY_LEASE_SECONDS)
+        result = session.exec(
+            update(IdempotencyRecord)
+            .where(
+                IdempotencyRecord.id == record_id,
+                IdempotencyRecord.status_code.is_(None),
+                or_(
+                    IdempotencyRecord.locked_until < now,
+                    and_(IdempotencyRecord.locked_until.is_(None), IdempotencyRecord.created_at < lease_start),
+                ),
+            )
+            .values(fingerprint=fingerprint, expires_at=expires_at, locked_until=locked_until)
+        )
+        session.commit()
+        return result.rowcount == 1
+
+
+def _renew(record_id: str) -> None:
+    """Prolonga el lease de una fila que sigue pendiente."""
+    locked_until = datetime.utcnow() + timedelta(seconds=IDEMPOTENCY_LEASE_SECONDS)
+    with Session(get_engine()) as session:
+        session.exec(
+            update(IdempotencyRecord)
+            .where(IdempotencyRecord.id == record_id, IdempotencyRecord.status_code.is_(None))
+            .values(locked_until=locked_until)
+        )
+        session.commit()
+
+
+def _complete(record_id: str, status_code: int, content_type: Optional[str], body: bytes) -> None:
+    with Session(get_engine()) as session:
+        record = session.get(IdempotencyRecord, record_id)
+        if record is None:
+            return
+        record.status_code = status_code
+        record.content_type = content_type
+        record.body = body
+        record.locked_until = None
+        session.add(record)
+        session.commit()
+
+
+def _release(record_id: str) -> None:
+    """Libera la clave (respuesta 5xx o error): el cliente podrá reintentar."""
+    with Session(get_engine()) as session:
+        session.exec(delete(IdempotencyRecord).where(IdempotencyRecord.id == record_id))
+        session.commit()
+
+
+def prune_idempotency_records(batch_size: int = 5000) -> int:
+    """Borra por lotes los registros caducados (job periódico)."""
+    total = 0
+    with Session(get_engine()) as session:
+        while True:
+            ids = session.exec(
+                select(IdempotencyRecord.id)
+                .where(IdempotencyRecord.expires_at < datetime.utcnow())
+                .limit(batch_size)
+            ).all()
+            if not ids:
+                break
+            session.exec(delete(IdempotencyRecord).where(IdempotencyRecord.id.in_(ids)))
+            session.commit()
+            total += len(ids)
+            if len(ids) < batch_size:
+                break
+    if total:
+        print(f"🧹 Idempotencia: {total} registros caducados eliminados")
+    return total
+
+
+class IdempotencyMiddleware:
+    """Middleware ASGI. Debe ir DENTRO de la negociación de contenido (ve y guarda JSON)."""
+
+    def __init__(self, app, cache_size: int = IDEMPOTENCY_CACHE_SIZE):
+        self.app = app
+        self.cache = _ResponseCache(cache_size)
+        self.in_flight: Dict[str, asyncio.Event] = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in _METHODS or scope["path"].startswith(_EXEMPT_PATHS):
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        idempotency_key = headers.get(IDEMPOTENCY_HEADER)
+        principal = replica_router.principal_key(headers.get("x-api-key"), headers.get("x-client-id"))
+        if not idempotency_key or not principal:
+            await self.app(scope, receive, send)
+            return
+
+        digest = _fingerprint(scope["method"], scope["path"], scope.get("query_string", b""))
+        chunks = []
+        size = 0
+        more_body = True
+        while more_body:
+            message = await receive()
+            chunk = message.get("body", b"")
+            size += len(chunk)
+            if size > IDEMPOTENCY_MAX_BODY:
+                await self._too_large(scope, receive, send)
+                return
+            digest.update(chunk)
+            chunks.append(chunk)
+            more_body = message.get("more_body", False)
+        body = b"".join(chunks)
+        record_id = _record_id(principal, idempotency_key)
+        fingerprint = digest.hexdigest()
+
+        # 1. Duplicado concurrente en este worker: esperar a la primera petición
+        while (pending := self.in_flight.get(record_id)) is not None:
+            try:
+                await asyncio.wait_for(pending.wait(), timeout=IDEMPOTENCY_WAIT_SECONDS)
+            except asyncio.TimeoutError:
+                await self._in_progress(scope, receive, send)
+                return
+
+        # 2. Repetición ya vista por este worker
+        stored = self.cache.get(record_id)
+        if stored is not None:
+            await self._replay(stored, fingerprint, scope, receive, send)
+            return
+
+        event = asyncio.Event()
+        self.in_flight[record_id] = event
+        try:
+            # 3. Repetición guardada por otro worker (o antes de un reinicio)
+            stored = await self._stored(record_id)
+            if stored is not None:
+                await self._replay(stored, fingerprint, scope, receive, send)
+                return
+            # 4. Primera petición: reservar la clave (la fila pendiente bloquea a otros workers)
+            if not await run_in_threadpool(_claim, record_id, fingerprint):
+                stored, claimed = await self._wait_other_worker(record_id, fingerprint)
+                if not claimed:
+                    if stored is None:
+                        await self._in_progress(scope, receive, send)
+                    else:
+                        await self._replay(stored, fingerprint, scope, receive, send)
+                    return
+            await self._execute(record_id, fingerprint, body, scope, send)
+        finally:
+            self.in_flight.pop(record_id, None)
+            event.set()
+
+    async def _stored(self, record_id: str) -> Optional[_Stored]:
+        record = await run_in_threadpool(_load, record_id)
+        if record is None or record.status_code is None:
+            return None
+        stored = (record.fingerprint, record.status_code, record.content_type, record.body or b"", record.expires_at)
+        self.cache.put(record_id, stored)
+        return stored
+
+    async def _wait_other_worker(self, record_id: str, fingerprint: str) -> Tuple[Optional[_Stored], bool]:
+        """
+        Espera la respuesta de la petición que tiene la clave en otro worker.
+        Devuelve (respuesta guardada, False), o (None, True) si esta petición se queda la clave
+        porque la otra la liberó o su lease caducó.
+        """
+        deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+        while time.monotonic() < deadline:
+            await asyncio.sleep(_POLL_SECONDS)
+            record = await run_in_threadpool(_load, record_id)
+            if record is not None and record.status_code is not None:
+                return await self._stored(record_id), False
+            if record is None or _lease_expired(record, datetime.utcnow()):
+                if await run_in_threadpool(_claim, record_id, fingerprint):
+                    return None, True
+        return None, False
+
+    @staticmethod
+    async def _keep_lease(record_id: str):
+        while True:
+            await asyncio.sleep(IDEMPOTENCY_LEASE_SECONDS / 3)
+            try:
+                await run_in_threadpool(_renew, record_id)
+            except Exception as e:
+                print(f"⚠️ Idempotencia: no se pudo renovar el lease: {e}")
+
+    @staticmethod
+    async def _release_shielded(record_id: str):
+        # Tras una cancelación (cliente desconectado) cualquier await se cancelaría al momento
+        with anyio.CancelScope(shield=True):
+            await run_in_threadpool(_release, record_id)
+
+    async def _execute(self, record_id: str, fingerprint: str, body: bytes, scope, send):
+        sent = False
+
+        async def replay_receive():
+            nonlocal sent
+            if sent:
+                return {"type": "http.disconnect"}
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        start_message = None
+        chunks = []
+        size = 0
+        storable = True
+
+        async def capture(message):
+            nonlocal start_message, size, storable
+            if message["type"] == "http.response.start":
+                start_message = message
+                content_type = Headers(raw=message["headers"]).get("content-type", "")
+                storable = not content_type.startswith("text/event-stream")
+            elif message["type"] == "http.response.body" and storable:
+                chunk = message.get("body", b"")
+                size += len(chunk)
+                if size > IDEMPOTENCY_MAX_BODY:
+                    # No se guarda: se deja de acumular y se sigue enviando
+                    storable = False
+                    chunks.clear()
+                else:
+                    chunks.append(chunk)
+            await send(message)
+
+        lease = asyncio.create_task(self._keep_lease(record_id))
+        try:
+            await self.app(scope, replay_receive, capture)
+            status_code = start_message["status"] if start_message else 500
+            # 5xx y 429 son transitorios: no se guardan para que el reintento se ejecute
+            if status_code >= 500 or status_code == 429 or not storable:
+                await self._release_shielded(record_id)
+                return
+            content_type = Headers(raw=start_message["headers"]).get("content-type")
+            response_body = b"".join(chunks)
+            await run_in_threadpool(_complete, record_id, status_code, content_type, response_body)
+        except BaseException:
+            # Error, cancelación o fallo al guardar: la clave no puede quedar pendiente
+            await self._release_shielded(record_id)
+            raise
+        finally:
+            lease.cancel()
+        expires_at = datetime.utcnow() + timedelta(hours=IDEMPOTENCY_TTL_HOURS)
+        self.cache.put(record_id, (fingerprint, status_code, content_type, response_body, expires_at))
+
+    @staticmethod
+    async def _replay(stored: _Stored, fingerprint: str, scope, receive, send):
+        if stored[0] != fingerprint:
+            response = JSONResponse(
+                {"detail": "Idempotency-Key reused with a different request"}, status_code=422
+            )
+        else:
+            response = Response(
+                content=stored[3],
+                status_code=stored[1],
+                media_type=stored[2],
+                headers={"Idempotent-Replayed": "true"},
+            )
+        await response(scope, receive, send)
+
+    @staticmethod
+    async def _too_large(scope, receive, send):
+        response = JSONResponse(
+            {"detail": f"Request body too large for an Idempotency-Key (max {IDEMPOTENCY_MAX_BODY} bytes)"},
+            status_code=413,
+        )
+        await response(scope, receive, send)
+
+    @staticmethod
+    async def _in_progress(scope, receive, send):
+        response = JSONResponse(
+            {"detail": "A request with this Idempotency-Key is still in progress"},
+            status_code=409,
+            headers={"Retry-After": "1"},
+        )
+        await response(scope, receive, send)
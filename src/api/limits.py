@@ -0,0 +1,434 @@
+"""
+Límites por llamante: token buckets y admisión justa al pool de conexiones.
+
+1. Rate limiting (RateLimiter): un token bucket en memoria por identidad autenticada
+   (Client o InferenceClient), comprobado en las dependencias de autenticación.
+   Superar el presupuesto devuelve 429 inmediato con `Retry-After`.
+
+2. Admisión justa (FairAdmissionMiddleware): como mucho `limit` peticiones a la vez por worker.
+   Cuando hay cola, los huecos van primero a la clase de prioridad más alta (chat de servicios
+   internos > escrituras y chat de clientes > listados en segundo plano) y, dentro de cada clase,
+   se reparten por weighted fair queueing entre llamantes: un cliente que lanza cientos de
+   peticiones no deja sin servicio al resto.
+
+3. Límite adaptativo (AdaptiveLimit): `limit` se ajusta por AIMD entre ADAPTIVE_MIN_LIMIT y
+   ADMISSION_MAX_CONCURRENCY (por defecto, las conexiones del worker) según la latencia observada
+   y la espera por conexión del pool. Pasada la capacidad, el exceso se descarta enseguida con 503
+   (si la espera estimada supera ADMISSION_MAX_WAIT, la cola está llena o se agota la espera)
+   en lugar de acumularse 30 s en el pool: el p99 queda acotado.
+
+Los buckets y las colas son por worker (en proceso): con N workers el límite efectivo es N veces
+el configurado. Los buckets y pesos de cada llamante se recuerdan como mucho para
+RATE_LIMIT_MAX_CALLERS llamantes (LRU): un bucket olvidado vuelve lleno, como tras estar ocioso.
+"""
+import asyncio
+import heapq
+import itertools
+import json
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, status
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+
+from src.core.database import connections_per_worker, replica_router, pool_waits
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1").lower() in ("1", "true", "yes")
+# Presupuestos por defecto (peticiones/segundo y ráfaga) de cada tipo de llamante
+RATE_LIMIT_CLIENT_RPS = float(os.getenv("RATE_LIMIT_CLIENT_RPS", "20"))
+RATE_LIMIT_CLIENT_BURST = float(os.getenv("RATE_LIMIT_CLIENT_BURST", "40"))
+RATE_LIMIT_SERVICE_RPS = float(os.getenv("RATE_LIMIT_SERVICE_RPS", "200"))
+RATE_LIMIT_SERVICE_BURST = float(os.getenv("RATE_LIMIT_SERVICE_BURST", "400"))
+# Excepciones por id, ej: {"JotaOrchestrator": {"rps": 500, "burst": 1000, "weight": 8}}
+RATE_LIMIT_OVERRIDES: Dict[str, dict] = json.loads(os.getenv("RATE_LIMIT_OVERRIDES", "{}"))
+# Llamantes con bucket y peso en memoria; pasado el tope se olvidan los de uso más antiguo
+RATE_LIMIT_MAX_CALLERS = int(os.getenv("RATE_LIMIT_MAX_CALLERS", "10000"))
+
+ADMISSION_CONTROL = os.getenv("ADMISSION_CONTROL", "1").lower() in ("1", "true", "yes")
+ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", "2"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "200"))
+# Peso en la cola justa: a más peso, más huecos cuando el pool está saturado
+ADMISSION_CLIENT_WEIGHT = float(os.getenv("ADMISSION_CLIENT_WEIGHT", "1"))
+ADMISSION_SERVICE_WEIGHT = float(os.getenv("ADMISSION_SERVICE_WEIGHT", "4"))
+# /import: una importación masiva dura minutos; ni ocupa la cola ni distorsiona el límite adaptativo
+_UNMETERED_PATHS = ("/health", "/docs", "/redoc", "/openapi.json", "/import")
+# /export ocupa su hueco (y su conexión) hasta el final, pero su duración depende del volumen de
+# datos, no de la carga de la DB: no entra en la muestra de latencia del límite adaptativo
+_UNSAMPLED_PATHS = ("/export",)
+
+# Límite de concurrencia adaptativo (AIMD) sobre ADMISSION_MAX_CONCURRENCY como máximo
+ADAPTIVE_CONCURRENCY = os.getenv("ADAPTIVE_CONCURRENCY", "1").lower() in ("1", "true", "yes")
+ADAPTIVE_MIN_LIMIT = int(os.getenv("ADAPTIVE_MIN_LIMIT", "2"))
+ADAPTIVE_WINDOW = float(os.getenv("ADAPTIVE_WINDOW", "1"))                          # Segundos por ventana de medida
+ADAPTIVE_LATENCY_TOLERANCE = float(os.getenv("ADAPTIVE_LATENCY_TOLERANCE", "2"))    # Latencia / línea base tolerada
+ADAPTIVE_POOL_WAIT_TARGET = float(os.getenv("ADAPTIVE_POOL_WAIT_TARGET", "0.05"))   # Espera máxima por conexión (s)
+ADAPTIVE_BACKOFF = float(os.getenv("ADAPTIVE_BACKOFF", "0.8"))
+ADAPTIVE_BASELINE_DRIFT = 0.01
+
+PRIORITY_CRITICAL = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BACKGROUND = 2
+
+
+class _CallerMap:
+    """Dict con tope de entradas: al pasarse olvida las de uso más antiguo (LRU). Thread-safe."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._items: "OrderedDict" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._items:
+                return default
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def setdefault(self, key, value):
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                return self._items[key]
+            self._put(key, value)
+            return value
+
+    def __setitem__(self, key, value) -> None:
+        with self._lock:
+            self._put(key, value)
+
+    def _put(self, key, value) -> None:
+        self._items[key] = value
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+class TokenBucket:
+    """Bucket clásico: `rate` tokens por segundo hasta un máximo de `burst`."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self) -> float:
+        """Consume un token. Devuelve 0 si lo había o los segundos hasta que haya uno."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate if self.rate > 0 else math.inf
+
+
+class RateLimiter:
+    """Token buckets por identidad (tipo + id), creados bajo demanda."""
+
+    def __init__(self, max_callers: int = RATE_LIMIT_MAX_CALLERS):
+        self._buckets = _CallerMap(max_callers)
+
+    @staticmethod
+    def budget(kind: str, identity: str) -> Tuple[float, float]:
+        override = RATE_LIMIT_OVERRIDES.get(identity, {})
+        if kind == "service":
+            return override.get("rps", RATE_LIMIT_SERVICE_RPS), override.get("burst", RATE_LIMIT_SERVICE_BURST)
+        return override.get("rps", RATE_LIMIT_CLIENT_RPS), override.get("burst", RATE_LIMIT_CLIENT_BURST)
+
+    def check(self, kind: str, identity: str) -> None:
+        """
+        Consume un token del llamante.
+
+        Raises:
+            HTTPException: 429 con Retry-After si ha agotado su presupuesto
+        """
+        if not RATE_LIMIT_ENABLED:
+            return
+        key = (kind, identity)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets.setdefault(key, TokenBucket(*self.budget(kind, identity)))
+        wait = bucket.take()
+        if wait > 0:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Rate limit exceeded",
+                headers={"Retry-After": str(max(1, math.ceil(wait)))},
+            )
+
+
+rate_limiter = RateLimiter()
+
+
+class FairAdmission:
+    """
+    Semáforo con cola justa ponderada (virtual finish time, como en WFQ) y clases de prioridad.
+    Entre prioridades manda la clase; dentro de una clase, cada llamante avanza su etiqueta
+    1/peso por petición y se admite siempre la etiqueta menor.
+    Con ADAPTIVE_CONCURRENCY el límite se ajusta solo (ver AdaptiveLimit).
+    Se usa desde un único event loop.
+    """
+
+    def __init__(self, limit: int, adaptive: Optional["AdaptiveLimit"] = None):
+        self.limit = limit
+        self.adaptive = adaptive
+        self.active = 0
+        self.peak_active = 0
+        self.virtual_time = 0.0
+        self._last_finish: Dict[str, float] = {}
+        self._queue: List[Tuple[int, float, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        # Peso de cada llamante y qué llamantes son servicios, aprendidos al autenticarse (ver register_weight)
+        self.weights = _CallerMap(RATE_LIMIT_MAX_CALLERS)
+        self.services = _CallerMap(RATE_LIMIT_MAX_CALLERS)
+
+    def _waiting(self) -> List[Tuple[int, float, int, asyncio.Future]]:
+        return [entry for entry in self._queue if not entry[3].done()]
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiting())
+
+    def _admit(self) -> None:
+        self.active += 1
+        self.peak_active = max(self.peak_active, self.active)
+
+    def _expected_wait(self, priority: int) -> float:
+        """Espera estimada de una petición nueva: las que van delante / límite × latencia típica."""
+        if self.adaptive is None:
+            return 0.0
+        ahead = sum(1 for entry in self._waiting() if entry[0] <= priority)
+        return (ahead + 1) / max(1, self.limit) * self.adaptive.latency
+
+    def _make_room(self, priority: int) -> bool:
+        """Cola llena: expulsa a la petición en espera de peor prioridad si es peor que la nueva."""
+        waiting = self._waiting()
+        worst = max(waiting, key=lambda entry: (entry[0], entry[1], entry[2]))
+        if worst[0] <= priority:
+            return False
+        worst[3].set_result(False)
+        return True
+
+    async def acquire(self, principal: str, timeout: float, priority: int = 1) -> bool:
+        """True si se admite la petición; False si se descarta (cola llena, espera excesiva o timeout)."""
+        if self.active < self.limit and not self.queued:
+            self._admit()
+            return True
+        if self._expected_wait(priority) > timeout:
+            return False  # No va a entrar a tiempo: mejor descartarla ya
+        if self.queued >= ADMISSION_MAX_QUEUE and not self._make_room(priority):
+            return False
+        weight = self.weights.get(principal, ADMISSION_CLIENT_WEIGHT)
+        tag = max(self.virtual_time, self._last_finish.get(principal, 0.0)) + 1 / weight
+        self._last_finish[principal] = tag
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, tag, next(self._seq), future))
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            if future.done() and not future.cancelled():
+                return future.result()  # Se le admitió justo al expirar: el hueco ya es suyo
+            self._abandon(future)
+            return False
+        except BaseException:
+            # Cancelada (ej: el cliente se desconectó): si ya se le había dado el hueco se
+            # devuelve; si no, sale de la cola. Si no, nadie liberaría ese hueco nunca.
+            if future.done() and not future.cancelled() and future.result():
+                self.release()
+            else:
+                self._abandon(future)
+            raise
+
+    def _abandon(self, future: asyncio.Future) -> None:
+        """Retira de la cola una petición que ya no espera."""
+        future.cancel()
+        self._queue = [entry for entry in self._queue if entry[3] is not future]
+        heapq.heapify(self._queue)
+
+    def _wake(self) -> bool:
+        """Pasa un hueco libre a la siguiente petición en cola. False si no hay nadie esperando."""
+        while self._queue:
+            _, tag, _, future = heapq.heappop(self._queue)
+            if future.done():
+                continue
+            self.virtual_time = tag
+            future.set_result(True)
+            return True
+        return False
+
+    def release(self, latency: Optional[float] = None) -> None:
+        if latency is not None and self.adaptive is not None:
+            new_limit = self.adaptive.observe(latency, self.limit, self.peak_active)
+            if new_limit is not None:
+                self.limit = new_limit
+                self.peak_active = self.active
+        if self.active > self.limit or not self._wake():
+            self.active -= 1
+        # Si el límite ha crecido, admitir a más gente de la cola
+        while self.active < self.limit and self._wake():
+            self._admit()
+        if self.active == 0:
+            # Sistema ocioso: olvidar el historial para que no crezca indefinidamente
+            self._last_finish.clear()
+            self.virtual_time = 0.0
+
+
+class AdaptiveLimit:
+    """
+    Límite de concurrencia AIMD guiado por la latencia de las peticiones y la espera por conexión.
+
+    Cada ADAPTIVE_WINDOW segundos se compara la latencia media de la ventana con la mejor
+    observada (línea base) y se mira la espera máxima por una conexión del pool:
+    - Latencia > línea base × ADAPTIVE_LATENCY_TOLERANCE, o espera > ADAPTIVE_POOL_WAIT_TARGET:
+      saturación → límite × ADAPTIVE_BACKOFF (decremento multiplicativo).
+    - Si no, y el límite se llegó a alcanzar en la ventana → límite + 1 (incremento aditivo).
+    """
+
+    def __init__(self, min_limit: int, max_limit: int):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.baseline: Optional[float] = None
+        self.latency = 0.0  # Media móvil, para estimar esperas en cola
+        self._window_start = time.monotonic()
+        self._samples: List[float] = []
+
+    def observe(self, latency: float, limit: int, peak_active: int) -> Optional[int]:
+        """Registra la latencia de una petición. Al cerrar la ventana devuelve el nuevo límite; si no, None."""
+        self.latency = latency if not self.latency else 0.9 * self.latency + 0.1 * latency
+        self._samples.append(latency)
+        now = time.monotonic()
+        if now - self._window_start < ADAPTIVE_WINDOW:
+            return None
+        samples, self._samples = self._samples, []
+        self._window_start = now
+        _, _, pool_wait = pool_waits.drain()
+        average = sum(samples) / len(samples)
+
+        if self.baseline is None or average < self.baseline:
+            self.baseline = average
+        else:
+            # La línea base sube poco a poco: si la carga normal cambia, no se penaliza para siempre
+            self.baseline *= 1 + ADAPTIVE_BASELINE_DRIFT
+
+        if pool_wait > ADAPTIVE_POOL_WAIT_TARGET or average > self.baseline * ADAPTIVE_LATENCY_TOLERANCE:
+            return max(self.min_limit, int(limit * ADAPTIVE_BACKOFF))
+        if peak_active >= limit:
+            return min(self.max_limit, limit + 1)
+        return limit
+
+
+_max_concurrency = int(os.getenv("ADMISSION_MAX_CONCURRENCY", connections_per_worker()))
+admission = FairAdmission(
+    _max_concurrency,
+    AdaptiveLimit(min(ADAPTIVE_MIN_LIMIT, _max_concurrency), _max_concurrency) if ADAPTIVE_CONCURRENCY else None,
+)
+
+
+def configure_admission(connections: int) -> None:
+    """
+    Dimensiona la admisión con las conexiones del pool del worker (al arrancar). Cada petición
+    admitida usa una sola: la autenticación y el endpoint comparten sesión. Así ninguna petición
+    admitida espera por el pool. ADMISSION_MAX_CONCURRENCY, si está definida, manda.
+    """
+    limit = int(os.getenv("ADMISSION_MAX_CONCURRENCY", connections))
+    admission.limit = limit
+    if admission.adaptive is not None:
+        admission.adaptive.min_limit = min(ADAPTIVE_MIN_LIMIT, limit)
+        admission.adaptive.max_limit = limit
+
+
+def request_priority(method: str, path: str, principal: str) -> int:
+    """
+    Clase de prioridad de una petición (menor = más prioritaria):
+    0 = chat de servicios internos (orquestador), 1 = escrituras y chat de clientes,
+    2 = lecturas en segundo plano (listados, sync, changes, agenda).
+    """
+    if path.startswith("/chat"):
+        return PRIORITY_CRITICAL if admission.services.get(principal, False) else PRIORITY_NORMAL
+    if method in ("GET", "HEAD"):
+        return PRIORITY_BACKGROUND
+    return PRIORITY_NORMAL
+
+
+def register_weight(api_key: Optional[str], client_id: Optional[str], kind: str, identity: str) -> None:
+    """Asocia el peso del llamante a su clave de cabeceras (la que ve el middleware)."""
+    principal = replica_router.principal_key(api_key, client_id)
+    if principal is None:
+        return
+    default = ADMISSION_SERVICE_WEIGHT if kind == "service" else ADMISSION_CLIENT_WEIGHT
+    admission.weights[principal] = RATE_LIMIT_OVERRIDES.get(identity, {}).get("weight", default)
+    if kind == "service":
+        admission.services[principal] = True
+
+
+def limit_caller(api_key: Optional[str], client_id: Optional[str], kind: str, identity: str) -> None:
+    """Punto de entrada desde las dependencias de autenticación: peso para la cola + token bucket."""
+    register_weight(api_key, client_id, kind, identity)
+    rate_limiter.check(kind, identity)
+
+
+class FairAdmissionMiddleware:
+    """
+    Middleware ASGI de admisión. El hueco se libera con el último trozo del cuerpo: los streams
+    que leen de la DB mientras se envían (exportación, historial archivado) siguen usando su
+    conexión. Sólo los SSE lo liberan al empezar: pasan casi todo el tiempo esperando eventos.
+    """
+
+    def __init__(self, app, controller: FairAdmission = admission):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        if not ADMISSION_CONTROL or scope["type"] != "http" or scope["path"].startswith(_UNMETERED_PATHS):
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        principal = replica_router.principal_key(headers.get("x-api-key"), headers.get("x-client-id")) or ""
+        priority = request_priority(scope["method"], scope["path"], principal)
+        if not await self.controller.acquire(principal, ADMISSION_MAX_WAIT, priority):
+            # Sobrecarga del servidor, no culpa del llamante: 503 inmediato en vez de esperar al pool
+            response = JSONResponse(
+                {"detail": "Server overloaded, retry later"},
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={"Retry-After": "1"},
+            )
+            await response(scope, receive, send)
+            return
+
+        started = time.monotonic()
+        released = False
+        sampled = not scope["path"].startswith(_UNSAMPLED_PATHS)
+
+        def release(measure: bool):
+            nonlocal released
+            if not released:
+                released = True
+                self.controller.release(time.monotonic() - started if measure else None)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                content_type = Headers(raw=message["headers"]).get("content-type", "")
+                if content_type.startswith("text/event-stream"):
+                    # Los SSE se miden hasta aquí: lo que tarden después no es carga de la DB
+                    release(measure=sampled)
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                release(measure=sampled)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            release(measure=False)
@@ -0,0 +1,247 @@
+"""
+Negociación de contenido para la API.
+
+- `Accept: application/msgpack` → las respuestas JSON se reenvían como MessagePack.
+  Los campos de fecha (`*_at` y los que el esquema OpenAPI declara `date-time`) viajan como
+  Timestamp nativo de MessagePack (ext -1) en vez de ISO 8601.
+- `Content-Type: application/msgpack` → el cuerpo se traduce a JSON antes de llegar a los routers,
+  así que los endpoints no necesitan saber nada del formato.
+- `Accept-Encoding: zstd | gzip` → las respuestas a partir de COMPRESSION_MIN_SIZE bytes se comprimen.
+
+JSON sigue siendo el formato por defecto. Una respuesta JSON sin Content-Length (historial de una
+conversación archivada) se comprime por trozos según llega; en MessagePack se acumula entera,
+como cualquier otra. El resto de streams (SSE, NDJSON, export...) se envían tal cual, sin buffer.
+Toda respuesta JSON lleva `Vary: Accept, Accept-Encoding`, también cuando la petición no pidió
+ni MessagePack ni compresión: una caché no debe servir esa versión a quien sí los pide.
+"""
+import gzip
+import json
+import os
+import zlib
+from datetime import datetime, timezone
+from typing import Set
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import JSONResponse
+
+try:
+    import msgpack
+except ImportError:  # Dependencia opcional: sin ella sólo se sirve JSON
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:  # Dependencia opcional: sin ella se comprime con gzip
+    zstandard = None
+
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack")
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+
+_zstd_compressor = zstandard.ZstdCompressor(level=3) if zstandard else None
+
+# Campos de fecha con otro nombre que `*_at` (recurrence_end, recurrence_id, bucket_start...)
+_datetime_fields: Set[str] = set()
+
+
+def _accepts_msgpack(accept: str) -> bool:
+    return msgpack is not None and any(t in accept for t in MSGPACK_TYPES)
+
+
+def _choose_encoding(accept_encoding: str):
+    """Elige la codificación preferida entre las que anuncia el cliente (zstd > gzip)."""
+    offered = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            offered[name.strip().lower()] = q
+    if _zstd_compressor and offered.get("zstd", 0) > 0:
+        return "zstd"
+    if offered.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+
+def _compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "zstd":
+        return _zstd_compressor.compress(body)
+    return gzip.compress(body, compresslevel=6)
+
+
+def _compressobj(encoding: str):
+    """Compresor incremental para las respuestas en streaming."""
+    if encoding == "zstd":
+        return _zstd_compressor.compressobj()
+    return zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+
+def _add_vary(headers: MutableHeaders) -> None:
+    headers.add_vary_header("Accept")
+    headers.add_vary_header("Accept-Encoding")
+
+
+def _is_datetime_schema(schema: dict) -> bool:
+    if schema.get("format") == "date-time":
+        return True
+    return any(_is_datetime_schema(option) for option in schema.get("anyOf", []))
+
+
+def register_datetime_fields(openapi_schema: dict) -> None:
+    """Registra los campos que algún modelo de la API declara como datetime (arranque)."""
+    for model in openapi_schema.get("components", {}).get("schemas", {}).values():
+        for name, schema in model.get("properties", {}).items():
+            if _is_datetime_schema(schema):
+                _datetime_fields.add(name)
+
+
+def _compact_datetimes(value, key: str = ""):
+    """Convierte los campos de fecha (ISO 8601) en datetimes para empaquetarlos como Timestamp."""
+    if isinstance(value, dict):
+        return {k: _compact_datetimes(v, k) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_compact_datetimes(v, key) for v in value]
+    if isinstance(value, str) and (key.endswith("_at") or key in _datetime_fields):
+        try:
+            dt = datetime.fromisoformat(value)
+        except ValueError:
+            return value
+        # La API trabaja con datetimes naive en UTC
+        return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+    return value
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        if value.tzinfo:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value.isoformat()
+    if isinstance(value, bytes):
+        return value.hex()
+    raise TypeError(f"Tipo no serializable: {type(value).__name__}")
+
+
+def encode_msgpack(payload) -> bytes:
+    return msgpack.packb(_compact_datetimes(payload), datetime=True)
+
+
+class ContentNegotiationMiddleware:
+    """Middleware ASGI que traduce MessagePack <-> JSON y comprime las respuestas."""
+
+    def __init__(self, app, min_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.min_size = min_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        content_type = headers.get("content-type", "").split(";")[0].strip().lower()
+
+        # --- Petición: MessagePack -> JSON ---
+        if content_type in MSGPACK_TYPES:
+            if msgpack is None:
+                response = JSONResponse({"detail": "MessagePack no soportado en este servidor"}, status_code=415)
+                await response(scope, receive, send)
+                return
+            body = b""
+            more_body = True
+            while more_body:
+                message = await receive()
+                body += message.get("body", b"")
+                more_body = message.get("more_body", False)
+            try:
+                decoded = msgpack.unpackb(body, timestamp=3) if body else None
+                body = json.dumps(decoded, default=_json_default).encode() if body else b""
+            except (ValueError, TypeError):
+                response = JSONResponse({"detail": "Cuerpo MessagePack inválido"}, status_code=400)
+                await response(scope, receive, send)
+                return
+
+            request_headers = MutableHeaders(scope=scope)
+            request_headers["content-type"] = "application/json"
+            request_headers["content-length"] = str(len(body))
+            sent = False
+
+            async def receive():
+                nonlocal sent
+                if sent:
+                    return {"type": "http.disconnect"}
+                sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+
+        # --- Respuesta ---
+        wants_msgpack = _accepts_msgpack(headers.get("accept", ""))
+        encoding = _choose_encoding(headers.get("accept-encoding", ""))
+        if not wants_msgpack and not encoding:
+            async def send_vary(message):
+                if message["type"] == "http.response.start":
+                    response_headers = MutableHeaders(raw=message["headers"])
+                    if response_headers.get("content-type", "").startswith("application/json"):
+                        _add_vary(response_headers)
+                await send(message)
+
+            await self.app(scope, receive, send_vary)
+            return
+
+        start_message = None
+        chunks = []
+        passthrough = False
+        compressor = None
+
+        async def send_wrapper(message):
+            nonlocal start_message, passthrough, compressor
+            if message["type"] == "http.response.start":
+                response_headers = MutableHeaders(raw=message["headers"])
+                response_type = response_headers.get("content-type", "")
+                if not response_type.startswith("application/json") or "content-encoding" in response_headers:
+                    # Streaming u otros formatos: se envían tal cual, sin buffer
+                    passthrough = True
+                    await send(message)
+                    return
+                _add_vary(response_headers)
+                if "content-length" not in response_headers and not wants_msgpack:
+                    # JSON en streaming: se comprime por trozos, sin acumularlo
+                    compressor = _compressobj(encoding)
+                    response_headers["content-encoding"] = encoding
+                    await send(message)
+                    return
+                start_message = message
+                return
+
+            if passthrough or message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            more_body = message.get("more_body", False)
+            if compressor is not None:
+                body = compressor.compress(message.get("body", b""))
+                if not more_body:
+                    body += compressor.flush()
+                if body or not more_body:
+                    await send({"type": "http.response.body", "body": body, "more_body": more_body})
+                return
+
+            chunks.append(message.get("body", b""))
+            if more_body:
+                return
+
+            body = b"".join(chunks)
+            response_headers = MutableHeaders(raw=start_message["headers"])
+            if wants_msgpack and body:
+                body = encode_msgpack(json.loads(body))
+                response_headers["content-type"] = "application/msgpack"
+            if encoding and len(body) >= self.min_size:
+                body = _compress(body, encoding)
+                response_headers["content-encoding"] = encoding
+            response_headers["content-length"] = str(len(body))
+            await send(start_message)
+            await send({"type": "http.response.body", "body": body, "more_body": False})
+
+        await self.app(scope, receive, send_wrapper)
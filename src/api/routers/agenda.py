@@ -0,0 +1,141 @@
+"""
+Router de agenda: todo lo necesario para pintar un día o una semana en una sola llamada.
+
+Evita el N+1 sobre HTTP (/events y después /tasks?event_id= y /reminders?event_id= por evento):
+las relaciones se cargan con selectinload, con un número constante de consultas.
+"""
+from datetime import datetime
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from pydantic import BaseModel, ConfigDict
+from sqlalchemy.orm import selectinload
+from sqlmodel import Session, select
+
+from src.core.models import Event, Task, Reminder
+from src.core.recurrence import events_in_window, reminders_in_window
+from src.api.dependencies import get_read_session
+from src.api.security import verify_api_key
+
+router = APIRouter(
+    prefix="/agenda",
+    tags=["Agenda"],
+)
+
+
+# --- DTOs ---
+class AgendaReminder(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: str
+    message: str
+    trigger_at: datetime
+    is_completed: bool
+    recurrence_id: Optional[datetime] = None  # Disparo original si es una ocurrencia de una serie
+    task_id: Optional[str] = None
+    event_id: Optional[str] = None
+    version: int
+    created_at: datetime
+    updated_at: datetime
+
+
+class AgendaTask(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: str
+    title: str
+    status: str
+    priority: int
+    event_id: Optional[str] = None
+    timing_relative_to_event: Optional[str] = None
+    version: int
+    created_at: datetime
+    updated_at: datetime
+    reminders: List[AgendaReminder] = []
+
+
+class AgendaEvent(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: str
+    title: str
+    description: Optional[str] = None
+    start_at: datetime
+    end_at: Optional[datetime] = None
+    all_day: bool
+    location: Optional[str] = None
+    recurrence_id: Optional[datetime] = None  # Inicio original si es una ocurrencia de una serie
+    version: int
+    created_at: datetime
+    updated_at: datetime
+    tasks: List[AgendaTask] = []
+    reminders: List[AgendaReminder] = []
+
+
+class AgendaResponse(BaseModel):
+    start: datetime
+    end: datetime
+    events: List[AgendaEvent]        # Eventos que se solapan con la ventana, con sus tareas y recordatorios
+    tasks: List[AgendaTask]          # Tareas sin evento con recordatorios en la ventana (o abiertas, si se piden)
+    reminders: List[AgendaReminder]  # Recordatorios sueltos (sin tarea ni evento) que saltan en la ventana
+
+
+# --- Endpoints ---
+
+@router.get("", response_model=AgendaResponse)
+def read_agenda(
+    start: datetime = Query(..., alias="from", description="Inicio de la ventana (incluido)"),
+    end: datetime = Query(..., alias="to", description="Fin de la ventana (excluido)"),
+    include_open_tasks: bool = False,
+    session: Session = Depends(get_read_session),
+    _: bool = Depends(verify_api_key)
+):
+    """
+    Agenda de la ventana [from, to): eventos con sus tareas y recordatorios anidados,
+    más las tareas y recordatorios independientes que vencen en la ventana.
+    Las series recurrentes se expanden en sus ocurrencias dentro de la ventana.
+    `include_open_tasks` añade además las tareas sin evento que no están en estado "done".
+    """
+    if end <= start:
+        raise HTTPException(status_code=400, detail="'to' must be after 'from'")
+
+    def in_window(reminders):
+        # reminders_in_window incluye el extremo superior; la agenda usa [from, to)
+        return [reminder for reminder in reminders if reminder.trigger_at < end]
+
+    # 1. Eventos (simples + series) con tareas (+ sus recordatorios) y recordatorios del evento
+    events_query = select(Event).options(
+        selectinload(Event.tasks).selectinload(Task.reminders),
+        selectinload(Event.reminders),
+    )
+    events = events_in_window(session, events_query, start, end)
+
+    # 2. Tareas sin evento: las que tienen recordatorios en la ventana (Task no tiene fecha propia)
+    due_reminders = in_window(reminders_in_window(
+        session, select(Reminder).where(Reminder.task_id.is_not(None)), start, end
+    ))
+    task_filter = Task.id.in_({reminder.task_id for reminder in due_reminders})
+    if include_open_tasks:
+        task_filter = task_filter | (Task.status != "done")
+    tasks = session.exec(
+        select(Task)
+        .where(Task.event_id.is_(None), task_filter)
+        .options(selectinload(Task.reminders))
+        .order_by(Task.priority.desc(), Task.created_at)
+    ).all()
+
+    # 3. Recordatorios sueltos
+    reminders = in_window(reminders_in_window(
+        session,
+        select(Reminder).where(Reminder.task_id.is_(None), Reminder.event_id.is_(None)),
+        start,
+        end,
+    ))
+
+    return AgendaResponse(
+        start=start,
+        end=end,
+        events=[AgendaEvent.model_validate(event) for event in events],
+        tasks=[AgendaTask.model_validate(task) for task in tasks],
+        reminders=[AgendaReminder.model_validate(reminder) for reminder in reminders],
+    )
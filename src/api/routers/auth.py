@@ -2,9 +2,9 @@ from fastapi import APIRouter, Depends, HTTPException, status, Query, Header
 from sqlmodel import Session, select
 from typing import Optional
 
-from src.core.database import get_session
 from src.core.models import InferenceClient, Client
 from src.api.security import verify_api_key
+from src.api.dependencies import get_session
 
 router = APIRouter(
     prefix="/auth",
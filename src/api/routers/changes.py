@@ -0,0 +1,126 @@
+"""
+Router de change data capture: stream de cambios de Tasks, Events y Reminders.
+
+Pensado para servicios internos (orquestador, consumidores de recordatorios) que hoy
+tendrían que hacer polling de los listados.
+"""
+import asyncio
+import json
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from sqlmodel import Session
+
+from src.core.models import InferenceClient, OutboxConsumer
+from src.core.outbox import change_notifier, fetch_changes
+from src.api.dependencies import get_inference_service, get_session
+from src.api.security import verify_api_key
+
+router = APIRouter(
+    prefix="/changes",
+    tags=["Changes"],
+)
+
+HEARTBEAT_SECONDS = 15
+
+
+# --- DTOs ---
+class ChangeAck(BaseModel):
+    consumer: str
+    offset: int
+
+
+# --- Endpoints ---
+
+@router.get("/stream")
+async def stream_changes(
+    request: Request,
+    after: Optional[int] = None,
+    consumer: Optional[str] = None,
+    last_event_id: Optional[str] = Header(None, alias="Last-Event-ID"),
+    session: Session = Depends(get_session),
+    service: InferenceClient = Depends(get_inference_service),
+    _: bool = Depends(verify_api_key)
+):
+    """
+    Stream SSE de cambios. Cada evento lleva su offset como `id`, así que el cliente
+    puede reanudar con `Last-Event-ID`, con `?after=<offset>` o con `?consumer=<nombre>`
+    (continúa desde el último offset confirmado con POST /changes/ack).
+    """
+    if last_event_id is not None:
+        try:
+            offset = int(last_event_id)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Last-Event-ID must be an integer offset")
+    elif after is not None:
+        offset = after
+    elif consumer:
+        registered = await run_in_threadpool(session.get, OutboxConsumer, consumer)
+        offset = registered.last_acked_id if registered else 0
+    else:
+        offset = 0
+    # La autenticación ya terminó: no retener una conexión del pool durante todo el stream
+    await run_in_threadpool(session.close)
+
+    async def events():
+        nonlocal offset
+        wakeup = change_notifier.broadcaster.subscribe()
+        try:
+            while not await request.is_disconnected():
+                changes = await run_in_threadpool(fetch_changes, offset)
+                for change in changes:
+                    offset = change["offset"]
+                    yield f"id: {offset}\nevent: change\ndata: {json.dumps(change)}\n\n"
+                if changes:
+                    continue
+                try:
+                    await asyncio.wait_for(wakeup.wait(), timeout=HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                wakeup.clear()
+        finally:
+            change_notifier.broadcaster.unsubscribe(wakeup)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@router.post("/ack", response_model=OutboxConsumer)
+def ack_changes(
+    ack: ChangeAck,
+    session: Session = Depends(get_session),
+    service: InferenceClient = Depends(get_inference_service),
+    _: bool = Depends(verify_api_key)
+):
+    """
+    Confirma que el consumidor ha procesado todo hasta `offset` (incluido).
+    El primer ack registra al consumidor; el outbox no se poda hasta que TODOS confirman.
+    """
+    registered = session.get(OutboxConsumer, ack.consumer)
+    if not registered:
+        registered = OutboxConsumer(id=ack.consumer, last_acked_id=ack.offset)
+    elif ack.offset > registered.last_acked_id:
+        registered.last_acked_id = ack.offset
+        registered.version += 1
+    session.add(registered)
+    session.commit()
+    session.refresh(registered)
+    return registered
+
+
+@router.delete("/consumers/{consumer}", status_code=status.HTTP_204_NO_CONTENT)
+def unregister_consumer(
+    consumer: str,
+    session: Session = Depends(get_session),
+    service: InferenceClient = Depends(get_inference_service),
+    _: bool = Depends(verify_api_key)
+):
+    """Da de baja un consumidor para que deje de bloquear la poda del outbox."""
+    registered = session.get(OutboxConsumer, consumer)
+    if not registered:
+        raise HTTPException(status_code=404, detail="Consumer not found")
+    session.delete(registered)
+    session.commit()
+    return None
@@ -1,13 +1,33 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Body
-from sqlmodel import Session, select
-from typing import List, Optional
-from pydantic import BaseModel
+import asyncio
+import json
+
+from fastapi import APIRouter, Depends, HTTPException, Header, Query, Request, status, Body
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlmodel import Session, select, func
+from typing import List, Optional, Tuple
+from pydantic import BaseModel, Field
 from datetime import datetime
 from enum import Enum
 
-from src.core.database import get_session
-from src.core.models import Conversation, Message, Client, AIModel, InferenceClient
-from src.api.dependencies import get_current_client, get_inference_service, get_any_authenticated_caller
+from src.core.database import get_engine
+from src.core.models import Conversation, Message, Client, AIModel, InferenceClient, RetentionPolicy
+from src.core.retention import ARCHIVING, DELETING, pending_deletions, retention_progress
+from src.core.group_commit import CHAT_WRITE_BEHIND, group_committer
+from src.core.activity import activity_tracker
+from src.core.drafts import (
+    DRAFT_POLL_INTERVAL, append_chunk, chunks_after, draft_broadcaster, draft_contents, finalize_draft,
+    with_draft_content,
+)
+from src.core.embeddings import encode, store_embedding, index_after_commit, save_embedding, semantic_search
+from src.core.archive import (
+    restore_conversation, get_archive, load_archived_messages, stream_archived_messages
+)
+from src.api.dependencies import (
+    get_current_client, get_inference_service, get_any_authenticated_caller, get_read_session, get_session
+)
+from src.api.fields import FIELDS_QUERY, field_options, parse_fields, project, sparse_response
 from src.api.security import verify_api_key
 
 router = APIRouter(
@@ -21,12 +41,29 @@ class ConversationCreate(BaseModel):
     title: Optional[str] = None
     ai_model_id: Optional[str] = None  # Modelo de IA inicial para esta conversación
 
+class ConversationStatus(str, Enum):
+    ACTIVE = "active"
+    ARCHIVED = "archived"
+
 class ConversationUpdate(BaseModel):
     """Permite actualizar campos mutables de una conversación, como el modelo de IA activo."""
     title: Optional[str] = None
     ai_model_id: Optional[str] = None
-    status: Optional[str] = None
+    status: Optional[ConversationStatus] = None
+
+
+class RetentionPolicyUpdate(BaseModel):
+    archive_after_days: Optional[int] = Field(default=None, ge=1)
+    purge_archived_after_days: Optional[int] = Field(default=None, ge=1)
+
+class PendingDeletion(BaseModel):
+    conversation_id: int
+    messages_remaining: int
 
+class RetentionStatus(BaseModel):
+    policy: Optional[RetentionPolicy] = None
+    pending_deletions: List[PendingDeletion]
+    worker_progress: dict  # Contadores del job en este worker desde el arranque
 
 class MessageRole(str, Enum):
     USER = "user"
@@ -37,6 +74,29 @@ class MessageCreate(BaseModel):
     role: MessageRole
     content: str
     ai_model_id: Optional[str] = None  # Modelo que generó este mensaje (obligatorio para role=assistant)
+    draft: bool = False  # Respuesta del asistente en generación: se completa con :append y :finalize
+    # Embedding del contenido (EMBEDDING_DIM floats), calculado por quien llama, para /chat/search/semantic
+    embedding: Optional[List[float]] = None
+
+class EmbeddingData(BaseModel):
+    embedding: List[float]
+
+class SemanticSearch(BaseModel):
+    embedding: List[float]  # Embedding de la consulta, del mismo modelo que los de los mensajes
+    k: int = Field(default=10, ge=1, le=100)
+    conversation_id: Optional[int] = None  # Restringir a una conversación
+
+class SemanticHit(BaseModel):
+    message: Message
+    score: float  # Similitud coseno
+
+class ChunkAppend(BaseModel):
+    content: str
+
+class ChunkAppended(BaseModel):
+    message_id: str
+    chunk_id: int  # Orden del trozo; es también el `id` del evento en el stream en vivo
+    size: int
 
 class AIModelRead(BaseModel):
     id: str
@@ -50,13 +110,15 @@ class AIModelRead(BaseModel):
 
 @router.get("/models", response_model=List[AIModelRead])
 def list_models(
-    session: Session = Depends(get_session),
+    fields: Optional[str] = FIELDS_QUERY,
+    session: Session = Depends(get_read_session),
     caller = Depends(get_any_authenticated_caller),
     _: bool = Depends(verify_api_key)
 ):
     """Devuelve la lista de modelos disponibles con todos sus atributos."""
-    models = session.exec(select(AIModel)).all()
-    return models
+    fields = parse_fields(fields, AIModelRead)
+    models = session.exec(select(AIModel).options(*field_options(AIModel, fields))).all()
+    return sparse_response(models, fields) if fields else models
 
 @router.post("/conversations", response_model=Conversation, status_code=status.HTTP_201_CREATED)
 def create_conversation(
@@ -82,18 +144,43 @@ def create_conversation(
 def list_conversations(
     limit: Optional[int] = 50,
     status_filter: Optional[str] = None,
-    session: Session = Depends(get_session),
+    fields: Optional[str] = FIELDS_QUERY,
+    session: Session = Depends(get_read_session),
     client: Client = Depends(get_current_client),
     _: bool = Depends(verify_api_key)
 ):
-    """Lista las conversaciones del cliente autenticado, ordenadas por actualización más reciente."""
-    query = select(Conversation).where(Conversation.client_id == client.id)
+    """
+    Lista las conversaciones del cliente autenticado, ordenadas por actualización más reciente.
+    La actividad de los mensajes aún sin volcar (ver src/core/activity.py) se superpone aquí.
+    """
+    fields = parse_fields(fields, Conversation)
+    # updated_at se carga siempre: ordena y recibe la actividad pendiente
+    query = select(Conversation).where(Conversation.client_id == client.id).options(
+        *field_options(Conversation, fields and fields + ["updated_at"])
+    )
     
     if status_filter:
         query = query.where(Conversation.status == status_filter)
-        
-    query = query.order_by(Conversation.updated_at.desc()).limit(limit)
-    return session.exec(query).all()
+    else:
+        query = query.where(Conversation.status != DELETING)
+
+    conversations = session.exec(query.order_by(Conversation.updated_at.desc()).limit(limit)).all()
+    pending = activity_tracker.pending()
+    if not pending:
+        return sparse_response(conversations, fields) if fields else conversations
+
+    # Las conversaciones con actividad pendiente pueden subir desde fuera de la página
+    listed = {conversation.id for conversation in conversations}
+    missing = [conversation_id for conversation_id in pending if conversation_id not in listed]
+    if missing:
+        conversations += session.exec(query.where(Conversation.id.in_(missing))).all()
+    for conversation in conversations:
+        at = pending.get(conversation.id)
+        if at is not None and at > conversation.updated_at:
+            session.expunge(conversation)  # Sólo para la respuesta: nunca se escribe desde aquí
+            conversation.updated_at = at
+    conversations.sort(key=lambda conversation: conversation.updated_at, reverse=True)
+    return sparse_response(conversations[:limit], fields) if fields else conversations[:limit]
 
 @router.patch("/conversations/{conversation_id}", response_model=Conversation)
 def update_conversation(
@@ -103,9 +190,13 @@ def update_conversation(
     client: Client = Depends(get_current_client),
     _: bool = Depends(verify_api_key)
 ):
-    """Actualiza una conversación: puede cambiar el modelo de IA activo, el título o el estado."""
+    """
+    Actualiza una conversación: puede cambiar el modelo de IA activo, el título o el estado.
+    Pasar a "archived" la deja en "archiving": el job de archivado compacta sus mensajes en un
+    blob comprimido y la deja "archived". Volver a "active" los restaura.
+    """
     conversation = session.get(Conversation, conversation_id)
-    if not conversation:
+    if not conversation or conversation.status == DELETING:
         raise HTTPException(status_code=404, detail="Conversation not found")
     if conversation.client_id != client.id:
         raise HTTPException(status_code=403, detail="Not authorized to modify this conversation")
@@ -121,66 +212,452 @@ def update_conversation(
         conversation.title = update_data.title
 
     if update_data.status is not None:
-        conversation.status = update_data.status
+        # Fila bloqueada: el job de archivado no puede compactarla a la vez
+        session.refresh(conversation, with_for_update=True)
+        if update_data.status == ConversationStatus.ARCHIVED:
+            # Los mensajes pasan al almacenamiento frío en segundo plano (compact_archiving)
+            if conversation.status == ConversationStatus.ACTIVE.value:
+                conversation.status = ARCHIVING
+        elif conversation.status != ConversationStatus.ACTIVE.value:
+            restore_conversation(session, conversation)
+            conversation.status = ConversationStatus.ACTIVE.value
+
+    conversation.updated_at = datetime.utcnow()
+    session.add(conversation)
+    session.commit()
+    session.refresh(conversation)
+    return conversation
+
+@router.delete("/conversations/{conversation_id}", response_model=Conversation, status_code=status.HTTP_202_ACCEPTED)
+def delete_conversation(
+    conversation_id: int,
+    session: Session = Depends(get_session),
+    client: Client = Depends(get_current_client),
+    _: bool = Depends(verify_api_key)
+):
+    """
+    Borra una conversación y todos sus mensajes.
+    El borrado es asíncrono: la conversación pasa a "deleting" (deja de ser visible) y el
+    motor de retención borra sus mensajes por lotes. El progreso se consulta en /chat/retention.
+    """
+    conversation = session.get(Conversation, conversation_id)
+    if not conversation or conversation.status == DELETING:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    if conversation.client_id != client.id:
+        raise HTTPException(status_code=403, detail="Not authorized to delete this conversation")
 
+    conversation.status = DELETING
     conversation.updated_at = datetime.utcnow()
+    conversation.version += 1
     session.add(conversation)
     session.commit()
     session.refresh(conversation)
     return conversation
 
+@router.get("/retention", response_model=RetentionStatus)
+def get_retention_status(
+    session: Session = Depends(get_read_session),
+    client: Client = Depends(get_current_client),
+    _: bool = Depends(verify_api_key)
+):
+    """Política de retención del cliente y progreso de los borrados en curso."""
+    return RetentionStatus(
+        policy=session.get(RetentionPolicy, client.id),
+        pending_deletions=pending_deletions(session, client.id),
+        worker_progress=retention_progress,
+    )
+
+@router.put("/retention", response_model=RetentionPolicy)
+def set_retention_policy(
+    policy_data: RetentionPolicyUpdate,
+    session: Session = Depends(get_session),
+    client: Client = Depends(get_current_client),
+    _: bool = Depends(verify_api_key)
+):
+    """Define la política de retención del cliente (un campo a null desactiva ese paso)."""
+    policy = session.get(RetentionPolicy, client.id)
+    if policy is None:
+        policy = RetentionPolicy(id=client.id)
+    else:
+        policy.version += 1
+        policy.updated_at = datetime.utcnow()
+    policy.archive_after_days = policy_data.archive_after_days
+    policy.purge_archived_after_days = policy_data.purge_archived_after_days
+    session.add(policy)
+    session.commit()
+    session.refresh(policy)
+    return policy
+
+def _seq_of(message: dict) -> int:
+    # Los blobs anteriores a Message.seq no lo traen: van en su orden original, delante
+    return message.get("seq") or 0
+
+_MESSAGE_FIELDS = list(Message.model_fields)
+
+def _sparse_archived(message: dict, fields: Optional[List[str]], content_preview: Optional[int]) -> dict:
+    """Mensaje ya serializado (blob archivado) recortado a `fields` y `content_preview`."""
+    item = project(message, fields or _MESSAGE_FIELDS)
+    if content_preview is not None and "content" in item:
+        content = item["content"] or ""
+        item["content"] = content[:content_preview]
+        item["content_truncated"] = len(content) > content_preview
+    return item
+
+def _sparse_messages(
+    session: Session, statement, backwards: bool, fields: Optional[List[str]], content_preview: Optional[int]
+) -> List[dict]:
+    """
+    Historial con `fields` y/o `content_preview` sin leer lo que no se pide: load_only de las
+    columnas pedidas y, con content_preview, sólo los N primeros caracteres de `content`
+    (substr en la base de datos: el texto completo no sale de ella).
+    """
+    fields = fields or _MESSAGE_FIELDS
+    wants_content = "content" in fields
+    preview = wants_content and content_preview is not None
+    loaded = [name for name in fields if not (preview and name == "content")]
+    if wants_content:
+        loaded.append("status")  # Los borradores completan su texto con los trozos
+    statement = statement.options(*field_options(Message, loaded))
+    if preview:
+        statement = statement.add_columns(func.substr(Message.content, 1, content_preview), func.length(Message.content))
+    # Con columnas añadidas, filas (mensaje, recorte, longitud): session.exec sólo daría el mensaje
+    rows = (session.execute(statement) if preview else session.exec(statement)).all()
+    if backwards:
+        rows = list(reversed(rows))
+    messages = [row[0] for row in rows] if preview else rows
+    drafts = draft_contents(session, [m.id for m in messages if m.status == "draft"]) if wants_content else {}
+
+    items = []
+    for i, message in enumerate(messages):
+        item = {name: None if name == "content" else getattr(message, name) for name in fields}
+        if preview:
+            _, content, length = rows[i]
+            draft = drafts.get(message.id, "")
+            item["content"] = (content + draft)[:content_preview]
+            item["content_truncated"] = length + len(draft) > content_preview
+        elif wants_content:
+            item["content"] = message.content + drafts.get(message.id, "")
+        items.append(item)
+    return items
+
 @router.get("/{conversation_id}/messages", response_model=List[Message])
 def get_conversation_messages(
     conversation_id: int,
-    limit: Optional[int] = None,
-    session: Session = Depends(get_session),
+    limit: Optional[int] = Query(default=None, ge=1),
+    after_seq: Optional[int] = Query(default=None, description="Sólo mensajes con seq mayor (\"desde seq N\")"),
+    before_seq: Optional[int] = Query(default=None, description="Sólo mensajes con seq menor (paginar hacia atrás)"),
+    fields: Optional[str] = FIELDS_QUERY,
+    content_preview: Optional[int] = Query(
+        default=None, ge=0, description="Recortar `content` a N caracteres (añade `content_truncated`)"
+    ),
+    session: Session = Depends(get_read_session),
     client: Client = Depends(get_current_client),
     _: bool = Depends(verify_api_key)
 ):
-    """Obtiene los mensajes de una conversación en orden cronológico"""
+    """
+    Obtiene los mensajes de una conversación en orden (por `seq`).
+    - `after_seq` + `limit`: los `limit` siguientes a un seq (lectura incremental).
+    - `before_seq` + `limit`: los `limit` anteriores a un seq (scroll hacia atrás), también en orden ascendente.
+    - `fields`: sólo esas columnas (ej: `id,role,created_at` para pintar la lista sin los textos).
+    - `content_preview=N`: `content` recortado a N caracteres en la base de datos, con `content_truncated`.
+    Las conversaciones archivadas se sirven descomprimiendo su blob en streaming.
+    """
+    fields = parse_fields(fields, Message)
+    sparse = fields is not None or content_preview is not None
     conversation = session.get(Conversation, conversation_id)
-    if not conversation:
+    if not conversation or conversation.status == DELETING:
         raise HTTPException(status_code=404, detail="Conversation not found")
         
     # Verificar propiedad
     if conversation.client_id != client.id:
          raise HTTPException(status_code=403, detail="Not authorized to access this conversation")
         
-    statement = select(Message).where(Message.conversation_id == conversation_id).order_by(Message.created_at)
+    if conversation.status == "archived":
+        blob = get_archive(session, conversation_id)
+        if blob is not None:
+            hot = session.exec(select(Message).where(Message.conversation_id == conversation_id)).all()
+            if not hot and limit is None and after_seq is None and before_seq is None and not sparse:
+                return StreamingResponse(stream_archived_messages(blob), media_type="application/json")
+            # Mensajes que llegaron mientras se archivaba: se mezclan con los del blob
+            messages = load_archived_messages(blob) + [message.model_dump(mode="json") for message in hot]
+            messages = [
+                message for message in messages
+                if (after_seq is None or _seq_of(message) > after_seq) and (before_seq is None or _seq_of(message) < before_seq)
+            ]
+            messages.sort(key=_seq_of)
+            if limit is not None:
+                messages = messages[-limit:] if before_seq is not None and after_seq is None else messages[:limit]
+            if sparse:
+                messages = [_sparse_archived(message, fields, content_preview) for message in messages]
+            return JSONResponse(messages)
+
+    # Rango del índice (conversation_id, seq)
+    statement = select(Message).where(Message.conversation_id == conversation_id)
+    if after_seq is not None:
+        statement = statement.where(Message.seq > after_seq)
+    if before_seq is not None:
+        statement = statement.where(Message.seq < before_seq)
+    backwards = before_seq is not None and after_seq is None and limit is not None
+    statement = statement.order_by(Message.seq.desc() if backwards else Message.seq)
     if limit is not None:
         statement = statement.limit(limit)
+    if sparse:
+        return JSONResponse(jsonable_encoder(_sparse_messages(session, statement, backwards, fields, content_preview)))
     messages = session.exec(statement).all()
-    return messages
+    if backwards:
+        messages = list(reversed(messages))
+    # Los borradores se devuelven con el texto generado hasta ahora
+    return with_draft_content(session, messages)
 
-@router.post("/{conversation_id}/messages", response_model=Message, status_code=status.HTTP_201_CREATED)
-def create_message(
-    conversation_id: int,
-    message_data: MessageCreate,
-    session: Session = Depends(get_session),
-    client: Client = Depends(get_current_client),
-    _: bool = Depends(verify_api_key)
-):
-    """Agrega un mensaje a una conversación"""
+def _new_message(session: Session, conversation_id: int, message_data: MessageCreate, client: Client) -> Message:
+    """Valida la conversación y construye el mensaje (sin escribirlo)."""
     conversation = session.get(Conversation, conversation_id)
-    if not conversation:
+    if not conversation or conversation.status == DELETING:
         raise HTTPException(status_code=404, detail="Conversation not found")
         
     # Verificar propiedad
     if conversation.client_id != client.id:
          raise HTTPException(status_code=403, detail="Not authorized to post to this conversation")
+    if conversation.status in ("archived", ARCHIVING):
+        raise HTTPException(status_code=409, detail="Conversation is archived; set status to 'active' to continue it")
+    if message_data.draft and message_data.role != MessageRole.ASSISTANT:
+        raise HTTPException(status_code=400, detail="Only assistant messages can be drafts")
 
-    message = Message(
+    return Message(
         conversation_id=conversation_id,
         role=message_data.role.value,
         content=message_data.content,
-        ai_model_id=message_data.ai_model_id
+        ai_model_id=message_data.ai_model_id,
+        status="draft" if message_data.draft else "final",
     )
-    
-    # Actualizar timestamp de la conversación
-    conversation.updated_at = datetime.utcnow()
-    session.add(conversation)
-    
+
+def _commit_message(session: Session, message: Message) -> Message:
+    """
+    Un commit por mensaje (modo por defecto). La fila de la conversación no se toca:
+    su updated_at se actualiza de forma diferida y agrupada (ver src/core/activity.py).
+    """
     session.add(message)
     session.commit()
     session.refresh(message)
+    activity_tracker.touch(message.conversation_id, message.created_at)
+    return message
+
+def _encode_embedding(values: Optional[List[float]]) -> Optional[bytes]:
+    if values is None:
+        return None
+    try:
+        return encode(values)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _create_message(
+    conversation_id: int,
+    message_data: MessageCreate,
+    vector: Optional[bytes],
+    x_api_key: str,
+    x_client_id: Optional[str],
+    commit: bool,
+) -> Tuple[Message, str]:
+    """
+    Autenticación, validación y (si `commit`) escritura en un único salto al threadpool,
+    con una sesión propia: la conexión se devuelve al pool antes de volver al event loop.
+    Devuelve el mensaje y el id del cliente dueño de la conversación.
+    """
+    with Session(get_engine()) as session:
+        client = get_current_client(x_api_key, x_client_id, session)
+        message = _new_message(session, conversation_id, message_data, client)
+        if commit:
+            if vector is not None:
+                store_embedding(session, message, client.id, vector)
+            _commit_message(session, message)
+            if vector is not None:
+                index_after_commit(get_engine(), client.id, [(message.id, vector)])
+        return message, client.id
+
+@router.post("/{conversation_id}/messages", response_model=Message, status_code=status.HTTP_201_CREATED)
+async def create_message(
+    conversation_id: int,
+    message_data: MessageCreate,
+    x_api_key: str = Header(..., description="API Key for authentication"),
+    x_client_id: Optional[str] = Header(None, description="Target Client ID (Required for Service Access)"),
+    _: bool = Depends(verify_api_key)
+):
+    """
+    Agrega un mensaje a una conversación.
+    Con CHAT_WRITE_BEHIND=1 el mensaje se confirma en un group commit junto con los de otras
+    peticiones; la respuesta llega igualmente después del commit.
+    """
+    vector = _encode_embedding(message_data.embedding)
+    if not CHAT_WRITE_BEHIND:
+        message, _ = await run_in_threadpool(
+            _create_message, conversation_id, message_data, vector, x_api_key, x_client_id, True
+        )
+        return message
+
+    # La espera al grupo no ocupa ni un hilo ni una conexión del pool
+    message, client_id = await run_in_threadpool(
+        _create_message, conversation_id, message_data, vector, x_api_key, x_client_id, False
+    )
+    await group_committer.write(message)
+    if vector is not None:
+        await run_in_threadpool(save_embedding, get_engine(), message, client_id, vector)
     return message
+
+@router.put("/{conversation_id}/messages/{message_id}/embedding", status_code=status.HTTP_204_NO_CONTENT)
+def set_message_embedding(
+    conversation_id: int,
+    message_id: str,
+    data: EmbeddingData,
+    client: Client = Depends(get_current_client),
+    session: Session = Depends(get_session),
+    _: bool = Depends(verify_api_key)
+):
+    """Guarda (o reemplaza) el embedding de un mensaje ya existente."""
+    vector = _encode_embedding(data.embedding)
+    row = session.exec(
+        select(Message, Conversation.client_id)
+        .join(Conversation, Conversation.id == Message.conversation_id)
+        .where(Message.id == message_id, Message.conversation_id == conversation_id)
+    ).first()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Message not found")
+    message, owner_id = row
+    if owner_id != client.id:
+        raise HTTPException(status_code=403, detail="Not authorized to access this conversation")
+    store_embedding(session, message, client.id, vector)
+    session.commit()
+    index_after_commit(get_engine(), client.id, [(message.id, vector)])
+
+@router.post("/search/semantic", response_model=List[SemanticHit])
+def search_semantic(
+    query: SemanticSearch,
+    client: Client = Depends(get_current_client),
+    session: Session = Depends(get_read_session),
+    _: bool = Depends(verify_api_key)
+):
+    """
+    Memoria a largo plazo: los `k` mensajes del cliente más parecidos al embedding de consulta,
+    ordenados por similitud coseno. Sólo cubre mensajes con embedding y en conversaciones no archivadas.
+    """
+    vector = _encode_embedding(query.embedding)
+    hits = semantic_search(session, client.id, vector, query.k, query.conversation_id)
+    return [SemanticHit(message=message, score=score) for message, score in hits]
+
+# --- Borradores (respuestas en generación) ---
+
+def _get_draft(session: Session, conversation_id: int, message_id: str, client: Client) -> Message:
+    """Mensaje de la conversación del cliente, en una sola consulta. 409 si ya no es borrador."""
+    row = session.exec(
+        select(Message, Conversation.client_id)
+        .join(Conversation, Message.conversation_id == Conversation.id)
+        .where(Message.id == message_id, Message.conversation_id == conversation_id)
+    ).first()
+    if not row:
+        raise HTTPException(status_code=404, detail="Message not found")
+    message, owner_id = row
+    if owner_id != client.id:
+        raise HTTPException(status_code=403, detail="Not authorized to access this conversation")
+    if message.status != "draft":
+        raise HTTPException(status_code=409, detail="Message is not a draft")
+    return message
+
+@router.patch("/{conversation_id}/messages/{message_id}:append", response_model=ChunkAppended)
+def append_to_draft(
+    conversation_id: int,
+    message_id: str,
+    chunk: ChunkAppend,
+    session: Session = Depends(get_session),
+    client: Client = Depends(get_current_client),
+    _: bool = Depends(verify_api_key)
+):
+    """
+    Añade un trozo de texto a un mensaje en borrador.
+    Coste O(trozo): se inserta en una tabla auxiliar, el mensaje no se reescribe.
+    """
+    _get_draft(session, conversation_id, message_id, client)
+    stored = append_chunk(session, message_id, chunk.content)
+    session.commit()
+    draft_broadcaster.publish(message_id)
+    return ChunkAppended(message_id=message_id, chunk_id=stored.id, size=len(chunk.content))
+
+@router.post("/{conversation_id}/messages/{message_id}:finalize", response_model=Message)
+def finalize_message(
+    conversation_id: int,
+    message_id: str,
+    session: Session = Depends(get_session),
+    client: Client = Depends(get_current_client),
+    _: bool = Depends(verify_api_key)
+):
+    """Cierra el borrador: concatena los trozos en `content` y lo marca como final."""
+    message = _get_draft(session, conversation_id, message_id, client)
+    finalize_draft(session, message)
+    session.commit()
+    session.refresh(message)
+    activity_tracker.touch(conversation_id)
+    draft_broadcaster.publish(message_id)
+    return message
+
+def _draft_snapshot(message_id: str, after_id: int):
+    """Estado actual del mensaje y los trozos nuevos desde `after_id` (siempre del primario)."""
+    with Session(get_engine()) as session:
+        message = session.get(Message, message_id)
+        if message is None or message.status != "draft":
+            return message, []
+        return message, chunks_after(session, message_id, after_id)
+
+@router.get("/{conversation_id}/messages/{message_id}/stream")
+async def stream_draft(
+    request: Request,
+    conversation_id: int,
+    message_id: str,
+    last_event_id: Optional[str] = Header(None, alias="Last-Event-ID"),
+    session: Session = Depends(get_session),
+    client: Client = Depends(get_current_client),
+    _: bool = Depends(verify_api_key)
+):
+    """
+    Stream SSE de un mensaje mientras se genera.
+
+    - `event: chunk` por cada trozo (`id` = chunk_id; se puede reanudar con Last-Event-ID).
+      Sin Last-Event-ID, el primer evento trae además el contenido inicial del borrador.
+    - `event: final` con el mensaje completo, y se cierra el stream.
+    """
+    # Antes de responder: dentro del stream ya se han enviado las cabeceras del 200
+    try:
+        after_id = int(last_event_id) if last_event_id else 0
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Last-Event-ID must be an integer chunk id")
+    message = await run_in_threadpool(session.get, Message, message_id)
+    conversation = await run_in_threadpool(session.get, Conversation, conversation_id)
+    if not message or not conversation or message.conversation_id != conversation_id:
+        raise HTTPException(status_code=404, detail="Message not found")
+    if conversation.client_id != client.id:
+        raise HTTPException(status_code=403, detail="Not authorized to access this conversation")
+    # La autenticación ya terminó: no retener una conexión del pool durante todo el stream
+    await run_in_threadpool(session.close)
+
+    async def events():
+        nonlocal after_id
+        wakeup = draft_broadcaster.subscribe(message_id)
+        try:
+            if after_id == 0 and message.status == "draft" and message.content:
+                yield f"event: chunk\ndata: {json.dumps({'content': message.content})}\n\n"
+            while not await request.is_disconnected():
+                wakeup.clear()
+                current, chunks = await run_in_threadpool(_draft_snapshot, message_id, after_id)
+                for chunk in chunks:
+                    after_id = chunk.id
+                    yield f"id: {chunk.id}\nevent: chunk\ndata: {json.dumps({'content': chunk.content})}\n\n"
+                if current is None or current.status != "draft":
+                    if current is not None:
+                        yield f"event: final\ndata: {current.model_dump_json()}\n\n"
+                    return
+                try:
+                    # Polling de respaldo: los appends de otros workers no llegan al broadcaster local
+                    await asyncio.wait_for(wakeup.wait(), timeout=DRAFT_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            draft_broadcaster.unsubscribe(wakeup, message_id)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
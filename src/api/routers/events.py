@@ -1,15 +1,23 @@
 """
 Router para operaciones CRUD de Events (Eventos).
 """
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from pydantic import BaseModel, ConfigDict
 from sqlmodel import Session, select
 from typing import List, Optional
-from datetime import datetime
+from datetime import datetime, time, timedelta
 
-from src.core.database import get_session
-from src.core.models import Event
-from src.api.utils import apply_optimistic_locking, update_entity_fields, increment_version
+from src.core.models import Event, RecurrenceOverride
+from src.core.calendar import where_overlaps, event_effective_end, merge_busy, free_slots
+from src.core.recurrence import (
+    events_in_window, expand_events, load_overrides, recurring_events_in_window,
+    refresh_recurrence_end, upsert_override, delete_overrides
+)
+from src.api.utils import apply_optimistic_locking, update_entity_fields, increment_version, record_tombstone
 from src.api.security import verify_api_key
+from src.api.dependencies import get_read_session, get_session
+from src.api.fields import FIELDS_QUERY, field_options, parse_fields, sparse_response
+from src.core.outbox import record_change
 
 router = APIRouter(
     prefix="/events",
@@ -18,28 +26,106 @@ router = APIRouter(
 )
 
 
+# --- DTOs ---
+class EventRead(BaseModel):
+    """Evento o, en consultas por rango, una ocurrencia de una serie recurrente."""
+    model_config = ConfigDict(from_attributes=True)
+
+    id: str
+    title: str
+    description: Optional[str] = None
+    start_at: datetime
+    end_at: Optional[datetime] = None
+    all_day: bool
+    location: Optional[str] = None
+    rrule: Optional[str] = None
+    recurrence_end: Optional[datetime] = None
+    # Inicio original de la ocurrencia (sólo en ocurrencias expandidas)
+    recurrence_id: Optional[datetime] = None
+    version: int
+    created_at: datetime
+    updated_at: datetime
+
+class OccurrenceOverrideData(BaseModel):
+    cancelled: bool = False
+    changes: dict = {}  # Campos a sobrescribir: title, description, start_at, end_at, all_day, location
+
+class TimeBlock(BaseModel):
+    start: datetime
+    end: datetime
+
+class FreeBusyResponse(BaseModel):
+    start: datetime
+    end: datetime
+    busy: List[TimeBlock]
+
+class SlotsResponse(BaseModel):
+    start: datetime
+    end: datetime
+    duration_minutes: int
+    slots: List[TimeBlock]
+
+
+def _busy_blocks(session: Session, start: datetime, end: datetime):
+    """Bloques ocupados en [start, end), fusionados y recortados a la ventana."""
+    # Sólo las columnas necesarias, filtradas por el índice de rangos
+    query = select(Event.start_at, Event.end_at, Event.all_day).where(Event.rrule.is_(None))
+    query = where_overlaps(query, session.get_bind().dialect.name, start, end)
+    periods = list(session.exec(query))
+
+    # Series recurrentes: se expanden sólo dentro de la ventana
+    series = session.exec(recurring_events_in_window(select(Event), start, end)).all()
+    if series:
+        overrides = load_overrides(session, "event", [s.id for s in series])
+        periods += [(o.start_at, o.end_at, o.all_day) for o in expand_events(series, overrides, start, end)]
+
+    intervals = []
+    for start_at, end_at, all_day in periods:
+        effective_end = event_effective_end(start_at, end_at, all_day)
+        if start_at < end and effective_end >= start:
+            intervals.append((max(start_at, start), min(effective_end, end)))
+    return merge_busy(intervals)
+
+
 @router.post("", response_model=Event, status_code=status.HTTP_201_CREATED)
 def create_event(
     event: Event,
     session: Session = Depends(get_session),
     _: bool = Depends(verify_api_key)
 ):
-    """Crear un nuevo evento"""
+    """Crear un nuevo evento (opcionalmente recurrente, con `rrule`)"""
+    # Los modelos de tabla no se validan al recibirlos: convertir fechas ISO, etc.
+    event = Event.model_validate(event.model_dump(warnings=False))
+    try:
+        refresh_recurrence_end(event)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid rrule: {e}")
     session.add(event)
+    record_change(session, "event", event, "insert")
     session.commit()
     session.refresh(event)
     return event
 
 
-@router.get("", response_model=List[Event])
+@router.get("", response_model=List[EventRead])
 def read_events(
     start_after: Optional[datetime] = None,
     start_before: Optional[datetime] = None,
     all_day: Optional[bool] = None,
-    session: Session = Depends(get_session),
+    overlaps_start: Optional[datetime] = None,
+    overlaps_end: Optional[datetime] = None,
+    fields: Optional[str] = FIELDS_QUERY,
+    session: Session = Depends(get_read_session),
     _: bool = Depends(verify_api_key)
 ):
-    """Listar todos los eventos con filtros opcionales"""
+    """
+    Listar todos los eventos con filtros opcionales.
+
+    `overlaps_start`/`overlaps_end` devuelven los eventos que se solapan con la ventana
+    [overlaps_start, overlaps_end), incluidos los que empezaron antes (vista de calendario).
+    En ese modo las series recurrentes se expanden en sus ocurrencias dentro de la ventana.
+    """
+    fields = parse_fields(fields, EventRead)
     query = select(Event)
     
     if start_after:
@@ -48,27 +134,79 @@ def read_events(
         query = query.where(Event.start_at <= start_before)
     if all_day is not None:
         query = query.where(Event.all_day == all_day)
+
+    if overlaps_start is not None or overlaps_end is not None:
+        # La expansión de las series necesita las filas completas: sólo se recorta la respuesta
+        events = events_in_window(session, query, overlaps_start, overlaps_end)
+        return sparse_response(events, fields) if fields else events
     
-    events = session.exec(query).all()
-    return events
+    events = session.exec(query.options(*field_options(Event, fields))).all()
+    return sparse_response(events, fields) if fields else events
+
+
+@router.get("/freebusy", response_model=FreeBusyResponse)
+def read_freebusy(
+    start: datetime = Query(..., alias="from"),
+    end: datetime = Query(..., alias="to"),
+    session: Session = Depends(get_read_session),
+    _: bool = Depends(verify_api_key)
+):
+    """Bloques ocupados en [from, to): los eventos solapados se fusionan en un único bloque."""
+    if end <= start:
+        raise HTTPException(status_code=400, detail="'to' must be after 'from'")
+    busy = _busy_blocks(session, start, end)
+    return FreeBusyResponse(start=start, end=end, busy=[TimeBlock(start=s, end=e) for s, e in busy])
+
+
+@router.get("/slots", response_model=SlotsResponse)
+def read_free_slots(
+    duration: int = Query(..., gt=0, description="Duración mínima del hueco, en minutos"),
+    start: datetime = Query(..., alias="from"),
+    end: datetime = Query(..., alias="to"),
+    work_start: time = time(9, 0),
+    work_end: time = time(18, 0),
+    include_weekends: bool = False,
+    limit: int = Query(20, gt=0, le=500),
+    session: Session = Depends(get_read_session),
+    _: bool = Depends(verify_api_key)
+):
+    """
+    Huecos libres de al menos `duration` minutos dentro del horario laboral.
+    Los eventos all_day bloquean el día completo.
+    """
+    if end <= start:
+        raise HTTPException(status_code=400, detail="'to' must be after 'from'")
+    if work_end <= work_start:
+        raise HTTPException(status_code=400, detail="'work_end' must be after 'work_start'")
+    busy = _busy_blocks(session, start, end)
+    slots = free_slots(
+        busy, start, end, timedelta(minutes=duration),
+        work_start, work_end, include_weekends=include_weekends, limit=limit,
+    )
+    return SlotsResponse(
+        start=start, end=end, duration_minutes=duration,
+        slots=[TimeBlock(start=s, end=e) for s, e in slots],
+    )
 
 
 @router.get("/{event_id}", response_model=Event)
 def read_event(
-    event_id: int,
-    session: Session = Depends(get_session),
+    event_id: str,
+    fields: Optional[str] = FIELDS_QUERY,
+    session: Session = Depends(get_read_session),
     _: bool = Depends(verify_api_key)
 ):
     """Obtener un evento específico por ID"""
-    event = session.get(Event, event_id)
+    fields = parse_fields(fields, Event)
+    event = session.get(Event, event_id, options=field_options(Event, fields))
     if not event:
         raise HTTPException(status_code=404, detail="Event not found")
-    return event
+    return sparse_response(event, fields) if fields else event
 
 
 @router.patch("/{event_id}", response_model=Event)
 def update_event(
-    event_id: int,
+    event_id: str,
     event_update: dict,
     session: Session = Depends(get_session),
     _: bool = Depends(verify_api_key)
@@ -86,11 +224,16 @@ def update_event(
     
     # Actualizar campos
     update_entity_fields(event, event_update)
+    try:
+        refresh_recurrence_end(event)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid rrule: {e}")
     
     # Incrementar versión y timestamp
     increment_version(event)
     
     session.add(event)
+    record_change(session, "event", event, "update")
     session.commit()
     session.refresh(event)
     return event
@@ -98,7 +241,7 @@ def update_event(
 
 @router.delete("/{event_id}", status_code=status.HTTP_204_NO_CONTENT)
 def delete_event(
-    event_id: int,
+    event_id: str,
     session: Session = Depends(get_session),
     _: bool = Depends(verify_api_key)
 ):
@@ -108,5 +251,68 @@ def delete_event(
         raise HTTPException(status_code=404, detail="Event not found")
     
     session.delete(event)
+    delete_overrides(session, "event", event.id)
+    record_tombstone(session, "event", event.id)
+    record_change(session, "event", event, "delete")
+    session.commit()
+    return None
+
+
+@router.put("/{event_id}/occurrences/{recurrence_id}", response_model=RecurrenceOverride)
+def override_event_occurrence(
+    event_id: str,
+    recurrence_id: datetime,
+    override_data: OccurrenceOverrideData,
+    session: Session = Depends(get_session),
+    _: bool = Depends(verify_api_key)
+):
+    """
+    Modifica o cancela UNA ocurrencia de un evento recurrente.
+    `recurrence_id` es el inicio original de la ocurrencia.
+    """
+    event = session.get(Event, event_id)
+    if not event:
+        raise HTTPException(status_code=404, detail="Event not found")
+    try:
+        override = upsert_override(
+            session, "event", event, recurrence_id, override_data.cancelled, override_data.changes
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # La serie cambia: nueva versión para /sync y el outbox
+    increment_version(event)
+    session.add(event)
+    record_change(session, "event", event, "update")
+    session.commit()
+    session.refresh(override)
+    return override
+
+
+@router.delete("/{event_id}/occurrences/{recurrence_id}", status_code=status.HTTP_204_NO_CONTENT)
+def delete_event_occurrence_override(
+    event_id: str,
+    recurrence_id: datetime,
+    session: Session = Depends(get_session),
+    _: bool = Depends(verify_api_key)
+):
+    """Elimina la excepción de una ocurrencia (vuelve a seguir la regla de la serie)."""
+    event = session.get(Event, event_id)
+    if not event:
+        raise HTTPException(status_code=404, detail="Event not found")
+    override = session.exec(
+        select(RecurrenceOverride).where(
+            RecurrenceOverride.series_type == "event",
+            RecurrenceOverride.series_id == event_id,
+            RecurrenceOverride.recurrence_id == recurrence_id,
+        )
+    ).first()
+    if not override:
+        raise HTTPException(status_code=404, detail="Occurrence override not found")
+
+    session.delete(override)
+    increment_version(event)
+    session.add(event)
+    record_change(session, "event", event, "update")
     session.commit()
     return None
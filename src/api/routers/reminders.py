@@ -2,14 +2,18 @@
 Router para operaciones CRUD de Reminders (Recordatorios).
 """
 from fastapi import APIRouter, Depends, HTTPException, status
+from pydantic import BaseModel, ConfigDict
 from sqlmodel import Session, select
 from typing import List, Optional
 from datetime import datetime
 
-from src.core.database import get_session
-from src.core.models import Reminder
-from src.api.utils import apply_optimistic_locking, update_entity_fields, increment_version
+from src.core.models import Reminder, RecurrenceOverride
+from src.core.recurrence import refresh_recurrence_end, reminders_in_window, upsert_override, delete_overrides
+from src.api.utils import apply_optimistic_locking, update_entity_fields, increment_version, record_tombstone
 from src.api.security import verify_api_key
+from src.api.dependencies import get_read_session, get_session
+from src.api.fields import FIELDS_QUERY, field_options, parse_fields, sparse_response
+from src.core.outbox import record_change
 
 router = APIRouter(
     prefix="/reminders",
@@ -18,30 +22,66 @@ router = APIRouter(
 )
 
 
+# --- DTOs ---
+class ReminderRead(BaseModel):
+    """Recordatorio o, en consultas por rango, un disparo de una serie recurrente."""
+    model_config = ConfigDict(from_attributes=True)
+
+    id: str
+    message: str
+    trigger_at: datetime
+    is_completed: bool
+    task_id: Optional[str] = None
+    event_id: Optional[str] = None
+    rrule: Optional[str] = None
+    recurrence_end: Optional[datetime] = None
+    # Disparo original de la ocurrencia (sólo en ocurrencias expandidas)
+    recurrence_id: Optional[datetime] = None
+    version: int
+    created_at: datetime
+    updated_at: datetime
+
+class OccurrenceOverrideData(BaseModel):
+    cancelled: bool = False
+    changes: dict = {}  # Campos a sobrescribir: message, trigger_at, is_completed
+
+
 @router.post("", response_model=Reminder, status_code=status.HTTP_201_CREATED)
 def create_reminder(
     reminder: Reminder,
     session: Session = Depends(get_session),
     _: bool = Depends(verify_api_key)
 ):
-    """Crear un nuevo recordatorio"""
+    """Crear un nuevo recordatorio (opcionalmente recurrente, con `rrule`)"""
+    # Los modelos de tabla no se validan al recibirlos: convertir fechas ISO, etc.
+    reminder = Reminder.model_validate(reminder.model_dump(warnings=False))
+    try:
+        refresh_recurrence_end(reminder)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid rrule: {e}")
     session.add(reminder)
+    record_change(session, "reminder", reminder, "insert")
     session.commit()
     session.refresh(reminder)
     return reminder
 
 
-@router.get("", response_model=List[Reminder])
+@router.get("", response_model=List[ReminderRead])
 def read_reminders(
     is_completed: Optional[bool] = None,
-    task_id: Optional[int] = None,
-    event_id: Optional[int] = None,
+    task_id: Optional[str] = None,
+    event_id: Optional[str] = None,
     trigger_after: Optional[datetime] = None,
     trigger_before: Optional[datetime] = None,
-    session: Session = Depends(get_session),
+    fields: Optional[str] = FIELDS_QUERY,
+    session: Session = Depends(get_read_session),
     _: bool = Depends(verify_api_key)
 ):
-    """Listar todos los recordatorios con filtros opcionales"""
+    """
+    Listar todos los recordatorios con filtros opcionales.
+    Con `trigger_after`/`trigger_before` las series recurrentes se expanden en sus disparos.
+    """
+    fields = parse_fields(fields, ReminderRead)
     query = select(Reminder)
     
     if is_completed is not None:
@@ -50,31 +90,33 @@ def read_reminders(
         query = query.where(Reminder.task_id == task_id)
     if event_id:
         query = query.where(Reminder.event_id == event_id)
-    if trigger_after:
-        query = query.where(Reminder.trigger_at >= trigger_after)
-    if trigger_before:
-        query = query.where(Reminder.trigger_at <= trigger_before)
+    if trigger_after or trigger_before:
+        # La expansión de las series necesita las filas completas: sólo se recorta la respuesta
+        reminders = reminders_in_window(session, query, trigger_after, trigger_before)
+        return sparse_response(reminders, fields) if fields else reminders
     
-    reminders = session.exec(query).all()
-    return reminders
+    reminders = session.exec(query.options(*field_options(Reminder, fields))).all()
+    return sparse_response(reminders, fields) if fields else reminders
 
 
 @router.get("/{reminder_id}", response_model=Reminder)
 def read_reminder(
-    reminder_id: int,
-    session: Session = Depends(get_session),
+    reminder_id: str,
+    fields: Optional[str] = FIELDS_QUERY,
+    session: Session = Depends(get_read_session),
     _: bool = Depends(verify_api_key)
 ):
     """Obtener un recordatorio específico por ID"""
-    reminder = session.get(Reminder, reminder_id)
+    fields = parse_fields(fields, Reminder)
+    reminder = session.get(Reminder, reminder_id, options=field_options(Reminder, fields))
     if not reminder:
         raise HTTPException(status_code=404, detail="Reminder not found")
-    return reminder
+    return sparse_response(reminder, fields) if fields else reminder
 
 
 @router.patch("/{reminder_id}", response_model=Reminder)
 def update_reminder(
-    reminder_id: int,
+    reminder_id: str,
     reminder_update: dict,
     session: Session = Depends(get_session),
     _: bool = Depends(verify_api_key)
@@ -92,11 +134,16 @@ def update_reminder(
     
     # Actualizar campos
     update_entity_fields(reminder, reminder_update)
+    try:
+        refresh_recurrence_end(reminder)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid rrule: {e}")
     
     # Incrementar versión y timestamp
     increment_version(reminder)
     
     session.add(reminder)
+    record_change(session, "reminder", reminder, "update")
     session.commit()
     session.refresh(reminder)
     return reminder
@@ -104,7 +151,7 @@ def update_reminder(
 
 @router.delete("/{reminder_id}", status_code=status.HTTP_204_NO_CONTENT)
 def delete_reminder(
-    reminder_id: int,
+    reminder_id: str,
     session: Session = Depends(get_session),
     _: bool = Depends(verify_api_key)
 ):
@@ -114,5 +161,67 @@ def delete_reminder(
         raise HTTPException(status_code=404, detail="Reminder not found")
     
     session.delete(reminder)
+    delete_overrides(session, "reminder", reminder.id)
+    record_tombstone(session, "reminder", reminder.id)
+    record_change(session, "reminder", reminder, "delete")
+    session.commit()
+    return None
+
+
+@router.put("/{reminder_id}/occurrences/{recurrence_id}", response_model=RecurrenceOverride)
+def override_reminder_occurrence(
+    reminder_id: str,
+    recurrence_id: datetime,
+    override_data: OccurrenceOverrideData,
+    session: Session = Depends(get_session),
+    _: bool = Depends(verify_api_key)
+):
+    """
+    Modifica, completa o cancela UN disparo de un recordatorio recurrente.
+    `recurrence_id` es el instante original del disparo.
+    """
+    reminder = session.get(Reminder, reminder_id)
+    if not reminder:
+        raise HTTPException(status_code=404, detail="Reminder not found")
+    try:
+        override = upsert_override(
+            session, "reminder", reminder, recurrence_id, override_data.cancelled, override_data.changes
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    increment_version(reminder)
+    session.add(reminder)
+    record_change(session, "reminder", reminder, "update")
+    session.commit()
+    session.refresh(override)
+    return override
+
+
+@router.delete("/{reminder_id}/occurrences/{recurrence_id}", status_code=status.HTTP_204_NO_CONTENT)
+def delete_reminder_occurrence_override(
+    reminder_id: str,
+    recurrence_id: datetime,
+    session: Session = Depends(get_session),
+    _: bool = Depends(verify_api_key)
+):
+    """Elimina la excepción de un disparo (vuelve a seguir la regla de la serie)."""
+    reminder = session.get(Reminder, reminder_id)
+    if not reminder:
+        raise HTTPException(status_code=404, detail="Reminder not found")
+    override = session.exec(
+        select(RecurrenceOverride).where(
+            RecurrenceOverride.series_type == "reminder",
+            RecurrenceOverride.series_id == reminder_id,
+            RecurrenceOverride.recurrence_id == recurrence_id,
+        )
+    ).first()
+    if not override:
+        raise HTTPException(status_code=404, detail="Occurrence override not found")
+
+    session.delete(override)
+    increment_version(reminder)
+    session.add(reminder)
+    record_change(session, "reminder", reminder, "update")
     session.commit()
     return None
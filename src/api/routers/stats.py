@@ -0,0 +1,104 @@
+"""
+Router de estadísticas de uso para planificación de capacidad.
+
+Responde sólo desde las rollups (UsageRollup, ver src/core/usage.py): el coste es
+O(periodos × modelos), no un recorrido de `message`.
+"""
+from datetime import datetime, timedelta
+from enum import Enum
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, status
+from pydantic import BaseModel
+from sqlmodel import Session, select
+
+from src.core.models import Client, UsageRollup
+from src.core.usage import aggregated_until, truncate
+from src.api.dependencies import get_any_authenticated_caller, get_read_session
+from src.api.security import verify_api_key
+
+router = APIRouter(
+    prefix="/stats",
+    tags=["Stats"],
+)
+
+# Rango por defecto si no se indica `start`
+_DEFAULT_RANGES = {"hour": timedelta(hours=48), "day": timedelta(days=30), "month": timedelta(days=365)}
+
+
+# --- DTOs ---
+class UsageBucketSize(str, Enum):
+    hour = "hour"
+    day = "day"
+    month = "month"
+
+
+class UsageBucket(BaseModel):
+    bucket_start: datetime
+    client_id: str
+    ai_model_id: Optional[str]      # None = mensajes sin modelo (usuario, sistema...)
+    messages: int
+    characters: int
+
+
+class UsageResponse(BaseModel):
+    bucket: UsageBucketSize
+    aggregated_until: Optional[datetime]    # Los mensajes posteriores aún no están contados
+    usage: List[UsageBucket]
+
+
+# --- ENDPOINTS ---
+@router.get("/usage", response_model=UsageResponse)
+def get_usage(
+    bucket: UsageBucketSize = UsageBucketSize.day,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    client_id: Optional[str] = None,
+    ai_model_id: Optional[str] = None,
+    session: Session = Depends(get_read_session),
+    caller = Depends(get_any_authenticated_caller),
+    _: bool = Depends(verify_api_key)
+):
+    """
+    Mensajes y caracteres por cliente, modelo de IA y periodo (UTC), en [start, end).
+
+    Un cliente sólo ve su propio uso; los servicios internos, el de todos los clientes
+    (o el de `client_id`).
+    """
+    if isinstance(caller, Client):
+        if client_id not in (None, caller.id):
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to view this client's usage")
+        client_id = caller.id
+
+    end = end or datetime.utcnow()
+    start = truncate(start or end - _DEFAULT_RANGES[bucket.value], bucket.value)
+    if start >= end:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="start must be before end")
+
+    query = select(UsageRollup).where(
+        UsageRollup.granularity == bucket.value,
+        UsageRollup.bucket_start >= start,
+        UsageRollup.bucket_start < end,
+    )
+    if client_id is not None:
+        query = query.where(UsageRollup.client_id == client_id)
+    if ai_model_id is not None:
+        query = query.where(UsageRollup.ai_model_id == ai_model_id)
+    rows = session.exec(
+        query.order_by(UsageRollup.bucket_start, UsageRollup.client_id, UsageRollup.ai_model_id)
+    ).all()
+
+    return UsageResponse(
+        bucket=bucket,
+        aggregated_until=aggregated_until(session),
+        usage=[
+            UsageBucket(
+                bucket_start=row.bucket_start,
+                client_id=row.client_id,
+                ai_model_id=row.ai_model_id or None,
+                messages=row.messages,
+                characters=row.characters,
+            )
+            for row in rows
+        ],
+    )
@@ -0,0 +1,131 @@
+"""
+Router de sincronización incremental (delta sync) para clientes de escritorio.
+
+En lugar de descargar todas las listas en cada reconexión, el cliente guarda el
+`token` de la última sincronización y pide sólo lo que ha cambiado desde entonces.
+"""
+import base64
+import binascii
+import os
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException
+from pydantic import BaseModel
+from sqlmodel import Session, select, or_, and_
+
+from src.core.models import Task, Event, Reminder, Conversation, Client, Tombstone
+from src.api.dependencies import get_current_client, get_read_session
+from src.api.security import verify_api_key
+
+router = APIRouter(
+    prefix="/sync",
+    tags=["Sync"],
+)
+
+# Margen de seguridad: las filas de los últimos segundos se vuelven a enviar en la siguiente
+# sincronización, por si una transacción con un updated_at anterior aún no había hecho commit.
+SYNC_SAFETY_MARGIN_SECONDS = float(os.getenv("SYNC_SAFETY_MARGIN_SECONDS", "5"))
+_TOKEN_PREFIX = "v1:"
+
+
+def encode_sync_token(high_water_mark: datetime) -> str:
+    """Token opaco a partir de la marca de agua (updated_at máximo ya entregado)."""
+    raw = f"{_TOKEN_PREFIX}{high_water_mark.isoformat()}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_sync_token(token: str) -> datetime:
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode()
+        if not raw.startswith(_TOKEN_PREFIX):
+            raise ValueError(raw)
+        return datetime.fromisoformat(raw[len(_TOKEN_PREFIX):])
+    except (ValueError, binascii.Error, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid sync token")
+
+
+# --- DTOs ---
+class SyncDeletion(BaseModel):
+    entity_type: str
+    id: str
+    deleted_at: datetime
+
+
+class SyncResponse(BaseModel):
+    token: str          # Enviar como ?since= en la próxima sincronización
+    full: bool          # True si es una sincronización completa (sin since)
+    tasks: List[Task]
+    events: List[Event]
+    reminders: List[Reminder]
+    conversations: List[Conversation]
+    deleted: List[SyncDeletion]
+
+
+# --- Endpoints ---
+
+@router.get("", response_model=SyncResponse)
+def sync_changes(
+    since: Optional[str] = None,
+    session: Session = Depends(get_read_session),
+    client: Client = Depends(get_current_client),
+    _: bool = Depends(verify_api_key)
+):
+    """
+    Devuelve todas las entidades creadas, modificadas o borradas desde `since`.
+
+    - Sin `since`: instantánea completa (sin borrados) y token inicial.
+    - Con `since`: sólo los cambios, servidos por los índices sobre `updated_at`.
+      Los borrados llegan como tombstones en `deleted`.
+
+    Las entidades pueden repetirse entre sincronizaciones consecutivas (margen de seguridad);
+    el cliente debe aplicarlas de forma idempotente comparando `version`.
+    """
+    since_at = decode_sync_token(since) if since else None
+    # Se fija antes de leer: nada posterior a este instante queda fuera del siguiente token
+    now = datetime.utcnow()
+
+    def changed(model, *criteria):
+        query = select(model).where(*criteria)
+        if since_at is not None:
+            query = query.where(model.updated_at > since_at)
+        return session.exec(query.order_by(model.updated_at)).all()
+
+    tasks = changed(Task)
+    events = changed(Event)
+    reminders = changed(Reminder)
+    conversations = changed(Conversation, Conversation.client_id == client.id)
+
+    deleted = []
+    if since_at is not None:
+        tombstones = session.exec(
+            select(Tombstone)
+            .where(Tombstone.deleted_at > since_at)
+            .where(or_(
+                Tombstone.client_id.is_(None),
+                and_(Tombstone.entity_type == "conversation", Tombstone.client_id == client.id),
+            ))
+            .order_by(Tombstone.deleted_at)
+        ).all()
+        deleted = [
+            SyncDeletion(entity_type=t.entity_type, id=t.entity_id, deleted_at=t.deleted_at)
+            for t in tombstones
+        ]
+
+    # Nueva marca de agua: lo último entregado, pero nunca más allá de now - margen
+    seen = [row.updated_at for rows in (tasks, events, reminders, conversations) for row in rows[-1:]]
+    seen += [d.deleted_at for d in deleted[-1:]]
+    high_water_mark = max(seen) if seen else (since_at or datetime.min)
+    high_water_mark = min(high_water_mark, now - timedelta(seconds=SYNC_SAFETY_MARGIN_SECONDS))
+    if since_at is not None:
+        high_water_mark = max(high_water_mark, since_at)
+
+    return SyncResponse(
+        token=encode_sync_token(high_water_mark),
+        full=since_at is None,
+        tasks=tasks,
+        events=events,
+        reminders=reminders,
+        conversations=conversations,
+        deleted=deleted,
+    )
@@ -5,10 +5,12 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from sqlmodel import Session, select
 from typing import List, Optional
 
-from src.core.database import get_session
 from src.core.models import Task
-from src.api.utils import apply_optimistic_locking, update_entity_fields, increment_version
+from src.api.utils import apply_optimistic_locking, update_entity_fields, increment_version, record_tombstone
 from src.api.security import verify_api_key
+from src.api.dependencies import get_read_session, get_session
+from src.api.fields import FIELDS_QUERY, field_options, parse_fields, sparse_response
+from src.core.outbox import record_change
 
 router = APIRouter(
     prefix="/tasks",
@@ -25,6 +27,7 @@ def create_task(
 ):
     """Crear una nueva tarea"""
     session.add(task)
+    record_change(session, "task", task, "insert")
     session.commit()
     session.refresh(task)
     return task
@@ -34,12 +37,14 @@ def create_task(
 def read_tasks(
     status_filter: Optional[str] = None,
     priority: Optional[int] = None,
-    event_id: Optional[int] = None,
-    session: Session = Depends(get_session),
+    event_id: Optional[str] = None,
+    fields: Optional[str] = FIELDS_QUERY,
+    session: Session = Depends(get_read_session),
     _: bool = Depends(verify_api_key)
 ):
     """Listar todas las tareas con filtros opcionales"""
-    query = select(Task)
+    fields = parse_fields(fields, Task)
+    query = select(Task).options(*field_options(Task, fields))
     
     if status_filter:
         query = query.where(Task.status == status_filter)
@@ -49,25 +54,27 @@ def read_tasks(
         query = query.where(Task.event_id == event_id)
     
     tasks = session.exec(query).all()
-    return tasks
+    return sparse_response(tasks, fields) if fields else tasks
 
 
 @router.get("/{task_id}", response_model=Task)
 def read_task(
-    task_id: int,
-    session: Session = Depends(get_session),
+    task_id: str,
+    fields: Optional[str] = FIELDS_QUERY,
+    session: Session = Depends(get_read_session),
     _: bool = Depends(verify_api_key)
 ):
     """Obtener una tarea específica por ID"""
-    task = session.get(Task, task_id)
+    fields = parse_fields(fields, Task)
+    task = session.get(Task, task_id, options=field_options(Task, fields))
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
-    return task
+    return sparse_response(task, fields) if fields else task
 
 
 @router.patch("/{task_id}", response_model=Task)
 def update_task(
-    task_id: int,
+    task_id: str,
     task_update: dict,
     session: Session = Depends(get_session),
     _: bool = Depends(verify_api_key)
@@ -90,6 +97,7 @@ def update_task(
     increment_version(task)
     
     session.add(task)
+    record_change(session, "task", task, "update")
     session.commit()
     session.refresh(task)
     return task
@@ -97,7 +105,7 @@ def update_task(
 
 @router.delete("/{task_id}", status_code=status.HTTP_204_NO_CONTENT)
 def delete_task(
-    task_id: int,
+    task_id: str,
     session: Session = Depends(get_session),
     _: bool = Depends(verify_api_key)
 ):
@@ -107,5 +115,7 @@ def delete_task(
         raise HTTPException(status_code=404, detail="Task not found")
     
     session.delete(task)
+    record_tombstone(session, "task", task.id)
+    record_change(session, "task", task, "delete")
     session.commit()
     return None
@@ -0,0 +1,97 @@
+"""
+Router de exportación e importación masiva de los datos de un cliente (copias de seguridad,
+migraciones entre instancias). El formato y el detalle están en src/core/transfer.py.
+"""
+from enum import Enum
+from typing import Dict, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session
+
+from src.core import transfer
+from src.core.models import Client
+from src.api.dependencies import get_current_client, get_session
+from src.api.security import verify_api_key
+
+router = APIRouter(tags=["Export"])
+
+
+# --- DTOs ---
+class ExportCompression(str, Enum):
+    zstd = "zstd"
+    gzip = "gzip"
+
+
+class ImportResult(BaseModel):
+    imported: Dict[str, int]            # Entidades importadas por tipo
+    skipped: Dict[str, int]             # Tareas, eventos... que ya existían (mismo id)
+    conversation_ids: Dict[int, int]    # id en el fichero -> id nuevo
+
+
+_MEDIA_TYPES = {None: "application/x-ndjson", "zstd": "application/zstd", "gzip": "application/gzip"}
+_EXTENSIONS = {None: "", "zstd": ".zst", "gzip": ".gz"}
+
+
+# --- ENDPOINTS ---
+@router.get("/export")
+def export_data(
+    compression: Optional[ExportCompression] = None,
+    session: Session = Depends(get_session),
+    client: Client = Depends(get_current_client),
+    _: bool = Depends(verify_api_key)
+):
+    """
+    Descarga todos los datos del cliente en NDJSON (opcionalmente comprimido), en streaming.
+    """
+    codec = compression.value if compression else None
+    if codec == "zstd" and transfer.zstandard is None:
+        raise HTTPException(status_code=400, detail="zstd compression is not available")
+    # La autenticación ya terminó: la exportación abre su propia sesión
+    session.close()
+
+    body = transfer.export_client(client.id)
+    if codec:
+        body = transfer.compress_stream(body, codec)
+    filename = f"jota-export-{client.id}.ndjson{_EXTENSIONS[codec]}"
+    return StreamingResponse(
+        body,
+        media_type=_MEDIA_TYPES[codec],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@router.post("/import", response_model=ImportResult, status_code=status.HTTP_201_CREATED)
+async def import_data(
+    request: Request,
+    session: Session = Depends(get_session),
+    client: Client = Depends(get_current_client),
+    _: bool = Depends(verify_api_key)
+):
+    """
+    Importa un fichero de GET /export (NDJSON, con o sin zstd/gzip) en el cliente autenticado.
+    Todo o nada: cualquier error deshace la importación entera.
+    """
+    await run_in_threadpool(session.close)
+    importer = await run_in_threadpool(transfer.ClientImport, client.id)
+    decoder = transfer.LineDecoder()
+    try:
+        batch = []
+        async for chunk in request.stream():
+            batch.extend(decoder.feed(chunk))
+            if len(batch) >= transfer.TRANSFER_BATCH_SIZE:
+                await run_in_threadpool(importer.feed, batch)
+                batch = []
+        batch.extend(decoder.close())
+        await run_in_threadpool(importer.feed, batch)
+        counts = await run_in_threadpool(importer.finish)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except IntegrityError:
+        raise HTTPException(status_code=409, detail="Import conflicts with existing data")
+    finally:
+        await run_in_threadpool(importer.close)
+    return ImportResult(imported=counts, skipped=importer.skipped, conversation_ids=importer.conversation_ids)
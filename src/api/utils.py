@@ -4,8 +4,12 @@ Incluye funciones de optimistic locking y helpers comunes.
 """
 from fastapi import HTTPException
 from datetime import datetime
+from typing import Optional
+from pydantic import ValidationError
 from sqlmodel import Session
 
+from src.core.models import Tombstone
+
 
 def apply_optimistic_locking(entity, update_data: dict) -> None:
     """
@@ -36,13 +40,25 @@ def update_entity_fields(entity, update_data: dict, exclude_fields: list = None)
         entity: La entidad a actualizar
         update_data: Diccionario con los nuevos valores
         exclude_fields: Lista de campos que no deben ser actualizados
+
+    Raises:
+        HTTPException: Si algún valor no es válido para el modelo (HTTP 422)
     """
     if exclude_fields is None:
         exclude_fields = ["id", "created_at"]
-    
-    for key, value in update_data.items():
-        if hasattr(entity, key) and key not in exclude_fields:
-            setattr(entity, key, value)
+
+    changes = {
+        key: value for key, value in update_data.items()
+        if hasattr(entity, key) and key not in exclude_fields
+    }
+    # Validar contra el modelo para que los tipos lleguen convertidos (ej: fechas ISO -> datetime)
+    try:
+        validated = type(entity).model_validate({**entity.model_dump(), **changes})
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False, include_context=False))
+
+    for key in changes:
+        setattr(entity, key, getattr(validated, key))
 
 
 def increment_version(entity) -> None:
@@ -54,3 +70,17 @@ def increment_version(entity) -> None:
     """
     entity.version += 1
     entity.updated_at = datetime.utcnow()
+
+
+def record_tombstone(session: Session, entity_type: str, entity_id, client_id: Optional[str] = None) -> None:
+    """
+    Registra el borrado de una entidad para que /sync lo propague.
+    Debe llamarse dentro de la misma transacción que el borrado.
+
+    Args:
+        session: Sesión activa (el commit lo hace quien llama)
+        entity_type: Tipo de entidad ("task", "event", "reminder", "conversation")
+        entity_id: ID de la entidad borrada
+        client_id: Cliente propietario, si la entidad pertenece a un cliente
+    """
+    session.add(Tombstone(entity_type=entity_type, entity_id=str(entity_id), client_id=client_id))
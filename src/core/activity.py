@@ -0,0 +1,128 @@
+"""
+Última actividad de las conversaciones (Conversation.updated_at) sin contención.
+
+Antes, cada mensaje actualizaba `conversation.updated_at` en su misma transacción: los
+escritores concurrentes de una conversación (mensaje del usuario, borrador del asistente,
+mensajes de herramientas) se serializaban en el row lock de la conversación, y cada append
+reescribía la fila (bloat en Postgres).
+
+Ahora el camino de escritura sólo anota la actividad en memoria (`touch`), agrupada por
+conversación, y un job periódico la vuelca cada CONVERSATION_ACTIVITY_FLUSH_SECONDS con un
+único UPDATE por conversación (y sólo si avanza el timestamp):
+- Mientras está pendiente, list_conversations superpone lo anotado en este worker, así que
+  el orden es exacto con un worker y, con varios, va como mucho un intervalo por detrás.
+- Si un worker cae con actividad sin volcar, el mensaje más reciente sigue siendo la
+  referencia: `last_activity` la deriva de él (lo usa la retención antes de archivar), y al
+  arrancar `recover_activity` recalcula updated_at desde los mensajes recientes para que el
+  orden de list_conversations no quede desfasado.
+"""
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from sqlalchemy import bindparam, func, update
+from sqlmodel import Session, select
+
+from src.core.database import get_engine
+from src.core.models import Conversation, Message
+
+CONVERSATION_ACTIVITY_FLUSH_SECONDS = float(os.getenv("CONVERSATION_ACTIVITY_FLUSH_SECONDS", "1"))
+# Ventana de mensajes que se revisa al arrancar, hacia atrás desde el último volcado
+CONVERSATION_ACTIVITY_RECOVERY_SECONDS = float(os.getenv("CONVERSATION_ACTIVITY_RECOVERY_SECONDS", "300"))
+
+
+class ActivityTracker:
+    """Timestamps de actividad pendientes de volcar, coalescidos por conversación."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        """Estado limpio (tras un fork lo pendiente pertenece al padre)."""
+        self._pending: Dict[int, datetime] = {}
+        self._lock = threading.Lock()
+
+    def touch(self, conversation_id: int, at: Optional[datetime] = None) -> None:
+        at = at or datetime.utcnow()
+        with self._lock:
+            if at > self._pending.get(conversation_id, datetime.min):
+                self._pending[conversation_id] = at
+
+    def pending(self) -> Dict[int, datetime]:
+        with self._lock:
+            return dict(self._pending)
+
+    def flush(self) -> int:
+        """Vuelca lo pendiente en una transacción. Devuelve cuántas conversaciones se tocaron."""
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        if not batch:
+            return 0
+        statement = (
+            update(Conversation)
+            .where(Conversation.id == bindparam("conversation_id"))
+            .where(Conversation.updated_at < bindparam("at"))
+            .values(updated_at=bindparam("at"))
+            .execution_options(synchronize_session=False)
+        )
+        try:
+            with Session(get_engine()) as session:
+                # Orden fijo por id: dos workers volcando a la vez nunca se bloquean mutuamente
+                session.connection().execute(statement, [
+                    {"conversation_id": conversation_id, "at": batch[conversation_id]}
+                    for conversation_id in sorted(batch)
+                ])
+                session.commit()
+        except Exception:
+            # Se reintenta en el siguiente volcado (sin pisar lo anotado mientras tanto)
+            for conversation_id, at in batch.items():
+                self.touch(conversation_id, at)
+            raise
+        return len(batch)
+
+
+activity_tracker = ActivityTracker()
+
+os.register_at_fork(after_in_child=activity_tracker.reset)
+
+
+def flush_activity() -> None:
+    """Job periódico: vuelca la actividad pendiente de este worker."""
+    activity_tracker.flush()
+
+
+def recover_activity() -> int:
+    """
+    Arranque: recupera la actividad que un worker caído no llegó a volcar.
+    Lo perdido es posterior (salvo un intervalo y el desfase de relojes) al último volcado,
+    así que basta con los mensajes de la ventana anterior al mayor updated_at: MAX(created_at)
+    por conversación por el índice de created_at, aplicado con el mismo UPDATE condicional.
+    """
+    with Session(get_engine()) as session:
+        newest_flush = session.exec(select(func.max(Conversation.updated_at))).one()
+        if newest_flush is None:
+            return 0
+        since = newest_flush - timedelta(seconds=CONVERSATION_ACTIVITY_RECOVERY_SECONDS)
+        rows = session.exec(
+            select(Message.conversation_id, func.max(Message.created_at))
+            .where(Message.created_at > since)
+            .group_by(Message.conversation_id)
+        ).all()
+    for conversation_id, at in rows:
+        activity_tracker.touch(conversation_id, at)
+    return activity_tracker.flush()
+
+
+def last_activity(session: Session, conversation: Conversation) -> datetime:
+    """
+    Última actividad real: updated_at o el mensaje más reciente, lo que sea posterior.
+    Una sola lectura del índice (conversation_id, seq).
+    """
+    newest = session.exec(
+        select(Message.created_at)
+        .where(Message.conversation_id == conversation.id)
+        .order_by(Message.seq.desc())
+        .limit(1)
+    ).first()
+    return max(conversation.updated_at, newest) if newest else conversation.updated_at
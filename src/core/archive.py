@@ -0,0 +1,135 @@
+"""
+Almacenamiento frío de conversaciones archivadas.
+
+Al archivar, los mensajes se serializan (array JSON, mismo formato que la API) y se guardan
+comprimidos en una sola fila de ArchivedConversation; las filas de `message` se borran.
+La compactación la hace un job en segundo plano (ver src/core/retention.py), leyendo y
+comprimiendo por lotes de ARCHIVE_CHUNK_SIZE mensajes: la memoria no crece con la conversación.
+Al desarchivar se restauran tal cual (mismos ids, fechas y versiones).
+La lectura descomprime en streaming, sin reconstruir los objetos Message.
+"""
+import gzip
+import io
+import json
+import os
+import zlib
+from typing import Iterator, List, Optional
+
+from sqlmodel import Session, select, delete
+
+from src.core.drafts import fold_drafts
+from src.core.models import ArchivedConversation, Conversation, Message
+
+try:
+    import zstandard
+except ImportError:  # Dependencia opcional: sin ella se comprime con gzip
+    zstandard = None
+
+ARCHIVE_COMPRESSION_LEVEL = int(os.getenv("ARCHIVE_COMPRESSION_LEVEL", "10"))
+# Mensajes leídos, comprimidos y borrados por lote al compactar
+ARCHIVE_CHUNK_SIZE = int(os.getenv("ARCHIVE_CHUNK_SIZE", "1000"))
+_STREAM_CHUNK = 64 * 1024
+
+
+def _compressor() -> tuple:
+    """Compresor incremental (compress + flush) del codec disponible."""
+    if zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=ARCHIVE_COMPRESSION_LEVEL).compressobj()
+    # wbits=31: formato gzip, legible con gzip.decompress
+    return "gzip", zlib.compressobj(min(ARCHIVE_COMPRESSION_LEVEL, 9), zlib.DEFLATED, 31)
+
+
+def _decompress(codec: str, payload: bytes) -> bytes:
+    if codec == "zstd":
+        # decompressobj: los blobs comprimidos por lotes no llevan el tamaño en la cabecera
+        return zstandard.ZstdDecompressor().decompressobj().decompress(payload)
+    return gzip.decompress(payload)
+
+
+def _dump_messages(messages: List[Message]) -> bytes:
+    return b",".join(
+        json.dumps(message.model_dump(mode="json"), separators=(",", ":")).encode() for message in messages
+    )
+
+
+def archive_conversation(session: Session, conversation: Conversation) -> Optional[ArchivedConversation]:
+    """
+    Compacta los mensajes de la conversación en un blob y borra sus filas.
+    Recorre los mensajes por lotes de seq (ARCHIVE_CHUNK_SIZE): cada lote se serializa, pasa
+    al compresor incremental y se borra, así que sólo hay un lote en memoria.
+    No cambia el estado ni hace commit: lo hace quien llama, en la misma transacción.
+    """
+    if session.exec(select(ArchivedConversation.id).where(ArchivedConversation.conversation_id == conversation.id)).first():
+        return None  # Ya archivada
+
+    # Los borradores se archivan con el texto generado hasta ahora
+    fold_drafts(session, conversation.id)
+    codec, compressor = _compressor()
+    parts = [compressor.compress(b"[")]
+    raw_size, message_count, last_seq = 2, 0, None
+    while True:
+        statement = select(Message).where(Message.conversation_id == conversation.id)
+        if last_seq is not None:
+            statement = statement.where(Message.seq > last_seq)
+        messages = session.exec(statement.order_by(Message.seq).limit(ARCHIVE_CHUNK_SIZE)).all()
+        if not messages:
+            break
+        raw = (b"," if message_count else b"") + _dump_messages(messages)
+        parts.append(compressor.compress(raw))
+        raw_size += len(raw)
+        message_count += len(messages)
+        last_seq = messages[-1].seq
+        ids = [message.id for message in messages]
+        for message in messages:
+            session.expunge(message)
+        # Sólo las filas archivadas: un mensaje que llegue a la vez se queda en la tabla caliente
+        session.exec(delete(Message).where(Message.id.in_(ids)))
+        if len(messages) < ARCHIVE_CHUNK_SIZE:
+            break
+    parts.append(compressor.compress(b"]"))
+    parts.append(compressor.flush())
+    blob = ArchivedConversation(
+        conversation_id=conversation.id,
+        codec=codec,
+        message_count=message_count,
+        raw_size=raw_size,
+        payload=b"".join(parts),
+    )
+    session.add(blob)
+    return blob
+
+
+def restore_conversation(session: Session, conversation: Conversation) -> int:
+    """Vuelve a insertar los mensajes archivados en `message` y borra el blob. Sin commit."""
+    blob = session.exec(
+        select(ArchivedConversation).where(ArchivedConversation.conversation_id == conversation.id)
+    ).first()
+    if blob is None:
+        return 0
+    rows = json.loads(_decompress(blob.codec, blob.payload))
+    # Los blobs anteriores a Message.seq no lo traen: se numeran al insertar, en el orden del blob
+    session.add_all(Message.model_validate(row) for row in rows)
+    session.delete(blob)
+    return len(rows)
+
+
+def get_archive(session: Session, conversation_id: int) -> Optional[ArchivedConversation]:
+    return session.exec(
+        select(ArchivedConversation).where(ArchivedConversation.conversation_id == conversation_id)
+    ).first()
+
+
+def load_archived_messages(blob: ArchivedConversation) -> List[dict]:
+    """Mensajes archivados ya deserializados (dicts con el formato de la API)."""
+    return json.loads(_decompress(blob.codec, blob.payload))
+
+
+def stream_archived_messages(blob: ArchivedConversation) -> Iterator[bytes]:
+    """Descomprime el blob por trozos: el JSON se envía tal cual se guardó."""
+    if blob.codec == "zstd":
+        reader = zstandard.ZstdDecompressor().stream_reader(blob.payload)
+    else:
+        reader = gzip.GzipFile(fileobj=io.BytesIO(blob.payload))
+    with reader:
+        while chunk := reader.read(_STREAM_CHUNK):
+            yield chunk
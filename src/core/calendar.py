@@ -0,0 +1,164 @@
+"""
+Utilidades de calendario: intervalos de eventos y consultas por solapamiento.
+
+Un evento ocupa el intervalo cerrado [start_at, fin efectivo]:
+- all_day: al menos el día completo desde start_at (o hasta end_at si es posterior).
+- end_at válido (>= start_at): hasta end_at.
+- end_at = None (indeterminado) o inválido: evento puntual en start_at.
+
+En Postgres las consultas por rango usan un índice GiST sobre tsrange(start_at, fin, '[]').
+La expresión de la consulta debe coincidir EXACTAMENTE con la del índice para que el
+planificador lo use, por eso ambas salen de aquí. Las columnas son `timestamp without time zone`,
+así que se usa tsrange (no tstzrange).
+"""
+from datetime import datetime, time, timedelta
+from typing import Iterable, List, Optional, Tuple
+
+from sqlalchemy import case, func, literal_column, or_, text
+from sqlalchemy.engine import Engine
+
+from src.core.models import Event
+
+ALL_DAY = timedelta(days=1)
+
+EVENT_PERIOD_INDEX_DDL = """
+CREATE INDEX IF NOT EXISTS ix_event_period ON event USING gist (
+    tsrange(
+        start_at,
+        CASE
+            WHEN all_day THEN GREATEST(COALESCE(end_at, start_at), start_at + interval '1 day')
+            WHEN end_at >= start_at THEN end_at
+            ELSE start_at
+        END,
+        '[]'
+    )
+)
+"""
+
+
+def event_effective_end(start_at: datetime, end_at: Optional[datetime], all_day: bool) -> datetime:
+    """Fin efectivo de un evento (misma regla que el índice de Postgres)."""
+    if all_day:
+        return max(end_at or start_at, start_at + ALL_DAY)
+    if end_at is not None and end_at >= start_at:
+        return end_at
+    return start_at
+
+
+def event_period_sql():
+    """tsrange(start_at, fin efectivo, '[]') con la misma forma que ix_event_period."""
+    end = case(
+        (Event.all_day, func.greatest(
+            func.coalesce(Event.end_at, Event.start_at),
+            Event.start_at + literal_column("interval '1 day'"),
+        )),
+        (Event.end_at >= Event.start_at, Event.end_at),
+        else_=Event.start_at,
+    )
+    return func.tsrange(Event.start_at, end, literal_column("'[]'"))
+
+
+def where_overlaps(query, dialect_name: str, start: Optional[datetime], end: Optional[datetime]):
+    """
+    Restringe una consulta de Event a los eventos que solapan [start, end).
+    Un extremo None deja el rango abierto por ese lado.
+
+    En Postgres usa el operador && sobre el índice GiST. En otros motores aplica un
+    prefiltro conservador sobre (start_at, end_at); el resultado exacto se obtiene
+    después con filter_overlapping().
+    """
+    if start is None and end is None:
+        return query
+    if dialect_name == "postgresql":
+        window = func.tsrange(start, end, literal_column("'[)'"))
+        return query.where(event_period_sql().op("&&")(window))
+
+    if end is not None:
+        query = query.where(Event.start_at < end)
+    if start is not None:
+        # Un evento que empezó hasta un día antes puede seguir activo (all_day / end_at inválido)
+        query = query.where(or_(Event.end_at >= start, Event.start_at >= start - ALL_DAY))
+    return query
+
+
+def overlaps(event, start: Optional[datetime], end: Optional[datetime]) -> bool:
+    if end is not None and not event.start_at < end:
+        return False
+    if start is not None and not event_effective_end(event.start_at, event.end_at, event.all_day) >= start:
+        return False
+    return True
+
+
+def filter_overlapping(events: Iterable, start: Optional[datetime], end: Optional[datetime]) -> List:
+    """Filtro exacto en Python (complemento del prefiltro de where_overlaps)."""
+    return [event for event in events if overlaps(event, start, end)]
+
+
+Interval = Tuple[datetime, datetime]
+
+
+def merge_busy(intervals: Iterable[Interval]) -> List[Interval]:
+    """
+    Fusiona intervalos solapados o contiguos (ordenar + barrido, O(n log n)).
+    Los intervalos de duración cero (eventos puntuales) no ocupan tiempo y se descartan.
+    """
+    merged: List[Interval] = []
+    for start, end in sorted(i for i in intervals if i[1] > i[0]):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def free_slots(
+    busy: List[Interval],
+    start: datetime,
+    end: datetime,
+    duration: timedelta,
+    work_start: time,
+    work_end: time,
+    include_weekends: bool = False,
+    limit: Optional[int] = None,
+) -> List[Interval]:
+    """
+    Huecos libres de al menos `duration` dentro del horario laboral de cada día de [start, end).
+
+    Args:
+        busy: Bloques ocupados ya fusionados y ordenados (merge_busy)
+        work_start / work_end: Horario laboral diario
+        include_weekends: Si False se saltan sábados y domingos
+        limit: Número máximo de huecos a devolver
+    """
+    slots: List[Interval] = []
+    i = 0
+    day = start.replace(hour=0, minute=0, second=0, microsecond=0)
+    while day < end and (limit is None or len(slots) < limit):
+        if include_weekends or day.weekday() < 5:
+            window_start = max(start, datetime.combine(day.date(), work_start))
+            window_end = min(end, datetime.combine(day.date(), work_end))
+            # Los bloques que terminan antes de esta ventana no afectan a las siguientes
+            while i < len(busy) and busy[i][1] <= window_start:
+                i += 1
+            cursor = window_start
+            j = i
+            while cursor < window_end and (limit is None or len(slots) < limit):
+                next_busy = busy[j] if j < len(busy) and busy[j][0] < window_end else None
+                gap_end = min(next_busy[0], window_end) if next_busy else window_end
+                if gap_end - cursor >= duration:
+                    slots.append((cursor, gap_end))
+                if not next_busy:
+                    break
+                cursor = max(cursor, next_busy[1])
+                j += 1
+        day += timedelta(days=1)
+    return slots
+
+
+def ensure_calendar_indexes(engine: Engine) -> None:
+    """Crea el índice GiST de rangos en Postgres (en otros motores no aplica)."""
+    if engine.dialect.name != "postgresql":
+        return
+    with engine.begin() as conn:
+        conn.execute(text(EVENT_PERIOD_INDEX_DDL))
@@ -1,7 +1,16 @@
 import os
 import time
-from sqlalchemy import create_engine, text
-from sqlalchemy.exc import OperationalError
+import hashlib
+import itertools
+import threading
+import warnings
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import create_engine, event, inspect, literal, text
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.sql import Select
+from sqlalchemy.exc import OperationalError, SAWarning, SQLAlchemyError
+from sqlalchemy.pool import NullPool
 from sqlmodel import SQLModel, Session
 from dotenv import load_dotenv
 
@@ -9,17 +18,444 @@ load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://admin:pass@db:5432/brain")
 
-# Configuración del engine con pool robusto para acceso concurrente
-# Esto permite que múltiples servicios (API + futuro MCP) accedan sin conflictos
-engine = create_engine(
-    DATABASE_URL,
-    echo=False,
-    pool_pre_ping=True,        # Verifica conexiones antes de usarlas
-    pool_size=10,               # Conexiones base en el pool
-    max_overflow=20,            # Conexiones adicionales bajo carga
-    pool_timeout=30,            # Segundos de espera antes de fallar
-    pool_recycle=3600,          # Recicla conexiones cada hora (evita conexiones obsoletas)
-)
+# --- DIMENSIONADO DEL POOL ---
+# DB_MAX_CONNECTIONS es el presupuesto TOTAL de conexiones de este servicio contra Postgres,
+# repartido entre los WEB_CONCURRENCY workers de uvicorn. Por defecto (30 / 1 worker)
+# equivale a la configuración histórica pool_size=10 + max_overflow=20.
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", "30"))
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# "queue": pool propio de SQLAlchemy (por defecto).
+# "pgbouncer": sin pool local (NullPool) y sin prepared statements del lado servidor,
+#              para PgBouncer en modo transaction pooling.
+DB_POOL_MODE = os.getenv("DB_POOL_MODE", "queue").lower()
+
+# --- PSYCOPG 3 ---
+# Las URLs postgresql:// sin driver explícito usan psycopg 3 (postgresql+psycopg2:// sigue soportado:
+# psycopg2-binary está en requirements.txt).
+# Prepared statements automáticos: una consulta que se repite DB_PREPARE_THRESHOLD veces en una
+# conexión se prepara en el servidor y deja de parsearse y planificarse en cada ejecución.
+DB_PREPARE_THRESHOLD = int(os.getenv("DB_PREPARE_THRESHOLD", "2"))
+DB_PREPARED_MAX = int(os.getenv("DB_PREPARED_MAX", "256"))    # Prepared statements por conexión (LRU)
+# Pipeline mode: las consultas independientes de una petición (ej. las de autenticación) en un solo round trip
+DB_PIPELINE = os.getenv("DB_PIPELINE", "1").lower() not in ("0", "false", "no")
+
+# --- SQLITE (modo embebido, un solo nodo) ---
+# Con DATABASE_URL=sqlite:///... la base de datos es un fichero local: WAL (los lectores no
+# bloquean al escritor ni al revés), un único escritor a la vez y un pool de lectores de solo lectura.
+SQLITE_BUSY_TIMEOUT = float(os.getenv("SQLITE_BUSY_TIMEOUT", "30"))          # Segundos esperando el lock de escritura
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL").upper()       # NORMAL: fsync sólo en los checkpoints del WAL
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))  # Bytes del fichero leídos vía mmap
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))        # Caché de páginas por conexión
+SQLITE_READ_POOL_SIZE = int(os.getenv("SQLITE_READ_POOL_SIZE", "8"))         # Conexiones de lectura por worker
+SQLITE_OPTIMIZE_INTERVAL = float(os.getenv("SQLITE_OPTIMIZE_INTERVAL", "3600"))  # Segundos entre PRAGMA optimize
+
+
+def is_sqlite(url: str = DATABASE_URL) -> bool:
+    return make_url(url).get_backend_name() == "sqlite"
+
+
+def _is_file_sqlite(url: str) -> bool:
+    """SQLite en fichero (una base de datos en memoria no se puede compartir entre engines)."""
+    database = make_url(url).database
+    return is_sqlite(url) and bool(database) and database != ":memory:" and not database.startswith("file::memory:")
+
+
+def _driver_url(url: str) -> str:
+    """postgresql:// sin driver explícito -> psycopg 3 (si está instalado)."""
+    parsed = make_url(url)
+    if parsed.drivername != "postgresql":
+        return url
+    try:
+        import psycopg  # noqa: F401
+    except ImportError:
+        return url
+    return parsed.set(drivername="postgresql+psycopg").render_as_string(hide_password=False)
+
+
+# Conexiones de cada worker que viven fuera del pool (el LISTEN del outbox en la API). Se
+# descuentan de su parte de DB_MAX_CONNECTIONS; las reserva el proceso antes de crear el engine.
+_dedicated_connections = 0
+
+
+def reserve_dedicated_connections(count: int) -> None:
+    global _dedicated_connections
+    _dedicated_connections = count
+
+
+def connections_per_worker() -> int:
+    """Conexiones del pool de cada worker sin exceder DB_MAX_CONNECTIONS entre todos."""
+    return max(1, DB_MAX_CONNECTIONS // max(1, WEB_CONCURRENCY) - _dedicated_connections)
+
+
+def _engine_options(
+    url: str, max_connections: int, pool_timeout: float, read_only: bool = False, connect_timeout: Optional[int] = None
+) -> dict:
+    """Opciones de create_engine según el modo de pool y el presupuesto de conexiones."""
+    options = {"echo": False}
+    connect_args = {}
+    if connect_timeout is not None and make_url(url).get_backend_name() == "postgresql":
+        connect_args["connect_timeout"] = connect_timeout  # libpq: segundos enteros
+
+    if _is_file_sqlite(url):
+        # Sin servidor: ni pre-ping ni reciclado. El timeout del driver es el busy timeout
+        options.update(pool_timeout=pool_timeout)
+        connect_args.update(check_same_thread=False, timeout=SQLITE_BUSY_TIMEOUT)
+        if read_only:
+            options.update(pool_size=SQLITE_READ_POOL_SIZE, max_overflow=SQLITE_READ_POOL_SIZE)
+        else:
+            options.update(pool_size=max(1, max_connections // 3), max_overflow=max(0, max_connections - max_connections // 3))
+            # BEGIN IMMEDIATE justo antes de la primera escritura (las lecturas previas no abren
+            # transacción): el escritor toma el lock al empezar y espera su turno con el busy
+            # timeout, en vez de fallar con SQLITE_BUSY al pasar de lectura a escritura.
+            connect_args["isolation_level"] = "IMMEDIATE"
+    elif DB_POOL_MODE == "pgbouncer":
+        # PgBouncer ya hace de pool: cada checkout abre/cierra una conexión barata contra él.
+        options["poolclass"] = NullPool
+        # En transaction pooling una sesión de servidor no pertenece al cliente entre
+        # transacciones, así que los prepared statements con nombre no son válidos.
+        if make_url(url).drivername == "postgresql+psycopg":
+            connect_args["prepare_threshold"] = None
+    else:
+        if make_url(url).drivername == "postgresql+psycopg":
+            connect_args["prepare_threshold"] = DB_PREPARE_THRESHOLD
+        # Un tercio del presupuesto fijo, el resto como overflow bajo carga
+        pool_size = max(1, max_connections // 3)
+        options.update(
+            pool_pre_ping=True,                             # Verifica conexiones antes de usarlas
+            pool_size=pool_size,                            # Conexiones base en el pool
+            max_overflow=max(0, max_connections - pool_size),  # Conexiones adicionales bajo carga
+            pool_timeout=pool_timeout,                      # Segundos de espera antes de fallar
+            pool_recycle=3600,                              # Recicla conexiones cada hora (evita conexiones obsoletas)
+        )
+
+    if connect_args:
+        options["connect_args"] = connect_args
+    return options
+
+
+class PoolWaitStats:
+    """
+    Esperas por una conexión (pool + pre-ping) medidas en las sesiones de las peticiones.
+    El limitador de concurrencia adaptativo las consume por ventanas (ver src/api/limits.py).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._count, self._total, self._max = 0, 0.0, 0.0
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._count += 1
+            self._total += seconds
+            self._max = max(self._max, seconds)
+
+    def drain(self):
+        """Devuelve (número, media, máximo) de la ventana actual y empieza otra."""
+        with self._lock:
+            count, total, peak = self._count, self._total, self._max
+            self._count, self._total, self._max = 0, 0.0, 0.0
+        return count, (total / count if count else 0.0), peak
+
+
+pool_waits = PoolWaitStats()
+
+
+def _apply_sqlite_pragmas(engine: Engine, read_only: bool) -> None:
+    """PRAGMAs por conexión del modo SQLite (WAL y synchronous se guardan en el propio fichero)."""
+
+    @event.listens_for(engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        if not read_only:
+            cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA busy_timeout={int(SQLITE_BUSY_TIMEOUT * 1000)}")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        if read_only:
+            # El pool de lectura nunca escribe (ni por error)
+            cursor.execute("PRAGMA query_only=ON")
+        cursor.close()
+
+
+def create_app_engine(
+    url: str, max_connections: int, pool_timeout: float, read_only: bool = False, connect_timeout: Optional[int] = None
+) -> Engine:
+    """create_engine con las opciones de pool de la aplicación (y los PRAGMAs en modo SQLite)."""
+    url = _driver_url(url)
+    engine = create_engine(url, **_engine_options(url, max_connections, pool_timeout, read_only, connect_timeout))
+    if _is_file_sqlite(url):
+        _apply_sqlite_pragmas(engine, read_only)
+    elif engine.dialect.driver == "psycopg":
+        @event.listens_for(engine, "connect")
+        def _on_connect(dbapi_connection, connection_record):
+            dbapi_connection.prepared_max = DB_PREPARED_MAX
+    return engine
+
+
+_pipelined_sql: Dict[int, tuple] = {}
+
+
+def _compiled_for_pipeline(statement: Select, dialect) -> tuple:
+    """SQL compilado una sola vez por consulta (las del pipeline son constantes de módulo)."""
+    cached = _pipelined_sql.get(id(statement))
+    if cached is None or cached[0] is not statement:
+        cached = (statement, statement.compile(dialect=dialect), statement.column_descriptions[0]["entity"])
+        _pipelined_sql[id(statement)] = cached
+    return cached
+
+
+def fetch_first_pipelined(session: Session, queries: List[Tuple[Select, dict]]) -> List[Optional[SQLModel]]:
+    """
+    Primera entidad de cada consulta (como `session.exec(statement, params=...).first()`).
+    Las consultas son fijas (con bindparam) y sólo varían los parámetros.
+
+    Con psycopg 3 viajan juntas en pipeline mode: un único round trip en lugar de uno por
+    consulta. Las filas se incorporan al identity map de la sesión sin volver a leerlas.
+    Con otros drivers se ejecutan una tras otra.
+    """
+    connection = session.connection()
+    if not DB_PIPELINE or connection.dialect.driver != "psycopg":
+        return [session.exec(statement, params=params).first() for statement, params in queries]
+
+    driver_connection = connection.connection.driver_connection
+    cursors = []
+    with driver_connection.pipeline():
+        for statement, params in queries:
+            _, compiled, entity = _compiled_for_pipeline(statement, connection.dialect)
+            cursor = driver_connection.cursor()
+            cursor.execute(compiled.string, compiled.construct_params(params))
+            cursors.append((cursor, entity))
+
+    results = []
+    for cursor, entity in cursors:
+        row = cursor.fetchone()
+        if row is None:
+            results.append(None)
+            continue
+        instance = entity(**{column.name: value for column, value in zip(cursor.description, row)})
+        make_transient_to_detached(instance)
+        results.append(session.merge(instance, load=False))
+    return results
+
+
+def checkout_timed(session: Session) -> Session:
+    """Obtiene ya la conexión de la sesión midiendo cuánto se esperó por ella."""
+    start = time.monotonic()
+    session.connection()
+    pool_waits.record(time.monotonic() - start)
+    return session
+
+
+# El engine se crea de forma perezosa (en el primer uso) y NUNCA se hereda entre procesos:
+# si uvicorn/gunicorn hace fork después de importar este módulo, cada worker crea su propio pool.
+_engine: Optional[Engine] = None
+_sqlite_reader: Optional[Engine] = None
+_engine_lock = threading.Lock()
+
+
+def get_engine() -> Engine:
+    """Devuelve el engine del primario, creándolo en el primer uso dentro del proceso actual."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = create_app_engine(DATABASE_URL, connections_per_worker(), DB_POOL_TIMEOUT)
+    return _engine
+
+
+def get_reader_engine() -> Engine:
+    """
+    Engine para lecturas sin réplicas. En modo SQLite, el pool de lectores (query_only):
+    con WAL ven todo lo confirmado sin esperar al escritor. En otro caso, el primario.
+    """
+    global _sqlite_reader
+    if not _is_file_sqlite(DATABASE_URL):
+        return get_engine()
+    if _sqlite_reader is None:
+        get_engine()  # El escritor primero: activa WAL en el fichero
+        with _engine_lock:
+            if _sqlite_reader is None:
+                _sqlite_reader = create_app_engine(DATABASE_URL, SQLITE_READ_POOL_SIZE, DB_POOL_TIMEOUT, read_only=True)
+    return _sqlite_reader
+
+
+def optimize_sqlite() -> None:
+    """
+    Job periódico del modo SQLite: estadísticas del planificador al día (ANALYZE la primera
+    vez, luego PRAGMA optimize, que sólo reanaliza lo que lo necesita) y checkpoint del WAL.
+    """
+    with get_engine().connect() as conn:
+        if conn.execute(text("SELECT name FROM sqlite_master WHERE name = 'sqlite_stat1'")).first() is None:
+            conn.execute(text("ANALYZE"))
+        conn.execute(text("PRAGMA optimize"))
+        conn.execute(text("PRAGMA wal_checkpoint(PASSIVE)"))
+        conn.commit()
+
+
+def __getattr__(name: str):
+    # Compatibilidad: `from src.core.database import engine` sigue funcionando (scripts)
+    if name == "engine":
+        return get_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# --- RÉPLICAS DE LECTURA (Opcional) ---
+# REPLICA_DATABASE_URLS: lista separada por comas de réplicas de solo lectura.
+# Si está vacía, todas las lecturas van al primario como hasta ahora.
+REPLICA_DATABASE_URLS = [
+    url.strip() for url in os.getenv("REPLICA_DATABASE_URLS", "").split(",") if url.strip()
+]
+REPLICA_STICKY_SECONDS = float(os.getenv("REPLICA_STICKY_SECONDS", "5"))      # Ventana read-your-writes tras una escritura
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "10"))   # Lag máximo tolerado antes de sacar la réplica
+REPLICA_HEALTH_INTERVAL = float(os.getenv("REPLICA_HEALTH_INTERVAL", "15"))   # Segundos entre comprobaciones de salud
+# Una réplica inalcanzable no debe colgar a nadie el timeout TCP del sistema (minutos)
+REPLICA_CONNECT_TIMEOUT = int(os.getenv("REPLICA_CONNECT_TIMEOUT", "2"))
+
+# Lag de replicación en segundos. Si la réplica ya ha reproducido todo lo recibido, el lag es 0
+# (evita marcar como retrasada una réplica cuyo primario simplemente no tiene escrituras).
+_REPLICA_LAG_QUERY = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+""")
+
+
+class _Replica:
+    """Estado de salud de una réplica de lectura."""
+
+    def __init__(self, url: str):
+        self.url = url
+        self._engine: Optional[Engine] = None
+        self.healthy = True
+        self.lag: float = 0.0
+
+    @property
+    def engine(self) -> Engine:
+        if self._engine is None:
+            with _engine_lock:
+                if self._engine is None:
+                    # Mismo presupuesto por worker que el primario; una réplica saturada
+                    # no debe retener la petición (timeout corto y se cae al primario).
+                    self._engine = create_app_engine(
+                        self.url, connections_per_worker(), 5, connect_timeout=REPLICA_CONNECT_TIMEOUT
+                    )
+        return self._engine
+
+    def reset(self) -> None:
+        if self._engine is not None:
+            self._engine.dispose(close=False)
+            self._engine = None
+
+
+class ReplicaRouter:
+    """
+    Enruta las lecturas entre las réplicas sanas (round-robin) y el primario.
+
+    - Las réplicas se comprueban cada REPLICA_HEALTH_INTERVAL segundos (conexión + lag) en un
+      job en segundo plano (check_replicas); las peticiones sólo leen el último estado.
+      Una réplica caída o con lag > REPLICA_MAX_LAG_SECONDS sale de la rotación
+      hasta que la siguiente comprobación la dé por buena.
+    - Tras una escritura, el mismo llamante lee del primario durante
+      REPLICA_STICKY_SECONDS (read-your-writes).
+    """
+
+    def __init__(self, urls: List[str]):
+        self.replicas = [_Replica(url) for url in urls]
+        self._rr = itertools.count()
+        self._last_write: Dict[str, float] = {}
+        self._write_lock = threading.Lock()
+
+    @staticmethod
+    def principal_key(api_key: Optional[str], client_id: Optional[str] = None) -> Optional[str]:
+        """Clave de stickiness a partir de las credenciales (no se guarda la API key en claro)."""
+        if not api_key:
+            return None
+        return hashlib.sha256(f"{api_key}|{client_id or ''}".encode()).hexdigest()[:32]
+
+    def mark_write(self, key: Optional[str]) -> None:
+        """Registra que el llamante acaba de escribir en el primario."""
+        if not key or not self.replicas:
+            return
+        now = time.monotonic()
+        with self._write_lock:
+            self._last_write[key] = now
+            # Limpieza perezosa para que el diccionario no crezca sin límite
+            if len(self._last_write) > 10000:
+                cutoff = now - REPLICA_STICKY_SECONDS
+                self._last_write = {k: t for k, t in self._last_write.items() if t >= cutoff}
+
+    def is_sticky(self, key: Optional[str]) -> bool:
+        if not key:
+            return False
+        last = self._last_write.get(key)
+        return last is not None and time.monotonic() - last < REPLICA_STICKY_SECONDS
+
+    def _check(self, replica: _Replica) -> None:
+        """Comprueba conexión y lag de una réplica (como mucho REPLICA_CONNECT_TIMEOUT si no responde)."""
+        try:
+            with replica.engine.connect() as conn:
+                if replica.engine.dialect.name == "postgresql":
+                    replica.lag = float(conn.execute(_REPLICA_LAG_QUERY).scalar() or 0)
+                else:
+                    conn.execute(text("SELECT 1"))
+                    replica.lag = 0.0
+            healthy = replica.lag <= REPLICA_MAX_LAG_SECONDS
+            if healthy != replica.healthy:
+                print(f"{'✅' if healthy else '⚠️ '} Réplica {replica.engine.url.host}: "
+                      f"{'de vuelta en rotación' if healthy else f'fuera de rotación (lag {replica.lag:.1f}s)'}")
+            replica.healthy = healthy
+        except SQLAlchemyError as e:
+            if replica.healthy:
+                print(f"⚠️  Réplica {replica.engine.url.host} fuera de rotación: {e}")
+            replica.healthy = False
+
+    def check_replicas(self) -> None:
+        """Job periódico (cada REPLICA_HEALTH_INTERVAL): actualiza la salud de todas las réplicas."""
+        for replica in self.replicas:
+            self._check(replica)
+
+    def pick(self) -> Optional[Engine]:
+        """Devuelve el engine de una réplica sana, o None si no hay ninguna disponible. Sin E/S."""
+        if not self.replicas:
+            return None
+        healthy = [r for r in self.replicas if r.healthy]
+        if not healthy:
+            return None
+        return healthy[next(self._rr) % len(healthy)].engine
+
+    def read_engine(self, key: Optional[str] = None, force_primary: bool = False) -> Engine:
+        """Engine para una lectura: réplica si es seguro, primario en caso contrario."""
+        if force_primary or self.is_sticky(key):
+            return get_engine()
+        return self.pick() or get_reader_engine()
+
+
+replica_router = ReplicaRouter(REPLICA_DATABASE_URLS)
+
+
+def _reset_engines_after_fork() -> None:
+    """
+    En el proceso hijo descarta los pools heredados del padre sin cerrar sus sockets
+    (siguen siendo del padre); el hijo creará los suyos en el primer uso.
+    """
+    global _engine, _sqlite_reader
+    if _engine is not None:
+        _engine.dispose(close=False)
+        _engine = None
+    if _sqlite_reader is not None:
+        _sqlite_reader.dispose(close=False)
+        _sqlite_reader = None
+    for replica in replica_router.replicas:
+        replica.reset()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_engines_after_fork)
 
 def bootstrap_system_clients(session: Session):
     """
@@ -162,6 +598,44 @@ def bootstrap_clients(session: Session):
     
     session.commit()
 
+def ensure_indexes(engine: Engine):
+    """
+    Crea los índices declarados en los modelos que aún no existan.
+    create_all() sólo crea índices al crear la tabla, así que en bases de datos
+    ya provisionadas los índices nuevos se añaden aquí.
+    """
+    for table in SQLModel.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+def ensure_columns(engine: Engine):
+    """
+    Añade a las tablas existentes las columnas nuevas de los modelos (ALTER TABLE ADD COLUMN).
+    Igual que con los índices, create_all() no modifica tablas ya creadas.
+    Las columnas NOT NULL se añaden con su valor por defecto escalar.
+    """
+    inspector = inspect(engine)
+    for table in SQLModel.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        with warnings.catch_warnings():
+            # messageembedding.embedding (pgvector, fuera del modelo): sólo interesan los nombres
+            warnings.filterwarnings("ignore", message="Did not recognize type 'vector'", category=SAWarning)
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=engine.dialect)}"
+            default = column.default.arg if column.default is not None and column.default.is_scalar else None
+            if default is not None:
+                rendered = literal(default).compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True})
+                ddl += f" DEFAULT {rendered}"
+                if not column.nullable:
+                    ddl += " NOT NULL"
+            print(f"🛠️  Añadiendo columna {table.name}.{column.name}")
+            with engine.begin() as conn:
+                conn.execute(text(ddl))
+
 def init_db():
     """
     Inicializa la base de datos: verifica la conexión y crea las tablas.
@@ -171,6 +645,7 @@ def init_db():
     
     Incluye lógica de reintento robusta para esperar a que PostgreSQL esté listo.
     """
+    engine = get_engine()
     retries = 5
     while retries > 0:
         try:
@@ -187,6 +662,14 @@ def init_db():
             # Crear tablas automáticamente (sin Alembic por ahora)
             print("📦 Creando tablas en la base de datos...")
             SQLModel.metadata.create_all(engine)
+            ensure_columns(engine)
+            from src.core.message_seq import ensure_message_seq
+            ensure_message_seq(engine)
+            ensure_indexes(engine)
+            from src.core.calendar import ensure_calendar_indexes
+            ensure_calendar_indexes(engine)
+            from src.core.embeddings import ensure_vector_index
+            ensure_vector_index(engine)
 
             # Bootstrap de datos
             with Session(engine) as session:
@@ -210,5 +693,5 @@ def get_session():
     Generador de sesiones para FastAPI o scripts.
     Usa 'yield' para asegurar que la sesión se cierre después de usarse.
     """
-    with Session(engine) as session:
-        yield session
\ No newline at end of file
+    with Session(get_engine()) as session:
+        yield checkout_timed(session)
@@ -0,0 +1,84 @@
+"""
+Mensajes en borrador: respuestas del asistente que se persisten mientras se generan.
+
+- append_chunk(): un INSERT en MessageChunk por trozo (O(chunk), sin reescribir el mensaje).
+- finalize_draft(): concatena los trozos en Message.content y los borra.
+- draft_broadcaster: despierta a los streams en vivo del mismo worker al añadir o finalizar.
+  Los streams hacen además polling cada DRAFT_POLL_INTERVAL para ver cambios de otros workers.
+"""
+import os
+from datetime import datetime
+from typing import Dict, Iterable, List
+
+from sqlmodel import Session, select, delete
+
+from src.core.models import Message, MessageChunk
+from src.core.notify import Broadcaster
+
+DRAFT_POLL_INTERVAL = float(os.getenv("DRAFT_POLL_INTERVAL", "1"))
+
+draft_broadcaster = Broadcaster()
+
+
+def append_chunk(session: Session, message_id: str, content: str) -> MessageChunk:
+    """Añade un trozo al borrador. El commit lo hace quien llama."""
+    chunk = MessageChunk(message_id=message_id, content=content)
+    session.add(chunk)
+    return chunk
+
+
+def chunks_after(session: Session, message_id: str, after_id: int = 0) -> List[MessageChunk]:
+    return session.exec(
+        select(MessageChunk)
+        .where(MessageChunk.message_id == message_id, MessageChunk.id > after_id)
+        .order_by(MessageChunk.id)
+    ).all()
+
+
+def draft_contents(session: Session, message_ids: Iterable[str]) -> Dict[str, str]:
+    """Texto acumulado en los trozos de cada borrador (una sola consulta)."""
+    message_ids = list(message_ids)
+    contents: Dict[str, List[str]] = {message_id: [] for message_id in message_ids}
+    if not message_ids:
+        return {}
+    rows = session.exec(
+        select(MessageChunk.message_id, MessageChunk.content)
+        .where(MessageChunk.message_id.in_(message_ids))
+        .order_by(MessageChunk.message_id, MessageChunk.id)
+    ).all()
+    for message_id, content in rows:
+        contents[message_id].append(content)
+    return {message_id: "".join(parts) for message_id, parts in contents.items()}
+
+
+def with_draft_content(session: Session, messages: List[Message]) -> List[Message]:
+    """Copias de los mensajes con el texto de los borradores ya ensamblado (no toca la sesión)."""
+    drafts = draft_contents(session, [m.id for m in messages if m.status == "draft"])
+    if not drafts:
+        return messages
+    return [
+        m.model_copy(update={"content": m.content + drafts[m.id]}) if m.id in drafts else m
+        for m in messages
+    ]
+
+
+def finalize_draft(session: Session, message: Message) -> Message:
+    """Concatena los trozos en `content`, borra los trozos y marca el mensaje como final. Sin commit."""
+    message.content += draft_contents(session, [message.id]).get(message.id, "")
+    message.status = "final"
+    message.updated_at = datetime.utcnow()
+    message.version += 1
+    session.exec(delete(MessageChunk).where(MessageChunk.message_id == message.id))
+    session.add(message)
+    return message
+
+
+def fold_drafts(session: Session, conversation_id: int) -> None:
+    """Finaliza los borradores de una conversación (antes de archivarla o borrar sus mensajes)."""
+    drafts = session.exec(
+        select(Message).where(Message.conversation_id == conversation_id, Message.status == "draft")
+    ).all()
+    for message in drafts:
+        finalize_draft(session, message)
+    if drafts:
+        session.flush()
@@ -0,0 +1,329 @@
+"""
+Búsqueda semántica sobre los embeddings de los mensajes (memoria a largo plazo del orquestador).
+
+Los embeddings los calcula quien llama (al crear el mensaje o después) y se guardan
+normalizados en MessageEmbedding, así que el producto escalar es la similitud coseno.
+La búsqueda top-k por cliente usa uno de dos motores:
+
+- pgvector (Postgres con la extensión `vector`): columna `embedding vector(EMBEDDING_DIM)`
+  con índice HNSW (o IVFFlat) y `ORDER BY embedding <#> :query LIMIT k`.
+- NumPy (resto de casos): por cliente, una matriz float32 N×dim en disco leída con memmap
+  y un fichero paralelo con los ids. Las escrituras se añaden al final (O(1) por mensaje)
+  y la búsqueda multiplica la matriz por bloques. Los candidatos se vuelven a puntuar con
+  los vectores de la base de datos, que es la fuente de verdad: así se descartan los
+  mensajes borrados y las versiones antiguas de un embedding reemplazado.
+  Si faltan los ficheros de un cliente se reconstruyen desde la base de datos.
+"""
+import fcntl
+import os
+import threading
+import uuid
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlmodel import Session, select, delete
+
+from src.core.models import Conversation, Message, MessageEmbedding
+
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "384"))
+# auto: pgvector si la extensión está instalada, si no NumPy
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "auto").lower()
+PGVECTOR_INDEX = os.getenv("PGVECTOR_INDEX", "hnsw").lower()  # hnsw | ivfflat
+PGVECTOR_EF_SEARCH = int(os.getenv("PGVECTOR_EF_SEARCH", "100"))
+PGVECTOR_IVF_LISTS = int(os.getenv("PGVECTOR_IVF_LISTS", "100"))
+PGVECTOR_IVF_PROBES = int(os.getenv("PGVECTOR_IVF_PROBES", "10"))
+VECTOR_INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", "./data/vectors")
+VECTOR_SEARCH_BLOCK = int(os.getenv("VECTOR_SEARCH_BLOCK", "65536"))  # Filas por producto matricial
+# Candidatos por resultado que se vuelven a puntuar contra la base de datos
+VECTOR_OVERFETCH = int(os.getenv("VECTOR_OVERFETCH", "4"))
+
+_ID_BYTES = 16  # uuid en binario
+
+_backend: Optional[str] = None
+
+
+def encode(values: Sequence[float]) -> bytes:
+    """
+    Valida y normaliza un embedding. Devuelve sus bytes float32.
+
+    Raises:
+        ValueError: Dimensión incorrecta, valores no finitos o vector nulo
+    """
+    if len(values) != EMBEDDING_DIM:
+        raise ValueError(f"Embedding must have {EMBEDDING_DIM} dimensions, got {len(values)}")
+    vector = np.asarray(values, dtype=np.float32)
+    if not np.all(np.isfinite(vector)):
+        raise ValueError("Embedding contains non-finite values")
+    norm = float(np.linalg.norm(vector))
+    if norm == 0:
+        raise ValueError("Embedding must not be the zero vector")
+    return (vector / norm).astype(np.float32).tobytes()
+
+
+def decode(vector: bytes):
+    return np.frombuffer(vector, dtype=np.float32)
+
+
+def _pgvector_literal(vector: bytes) -> str:
+    return "[" + ",".join(repr(float(x)) for x in decode(vector)) + "]"
+
+
+def backend(engine: Engine) -> str:
+    """Motor de búsqueda en uso (se decide una vez por proceso)."""
+    global _backend
+    if _backend is None:
+        available = False
+        if engine.dialect.name == "postgresql" and VECTOR_BACKEND != "numpy":
+            with engine.connect() as conn:
+                available = conn.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'vector'")).first() is not None
+        if VECTOR_BACKEND == "pgvector" and not available:
+            raise RuntimeError("VECTOR_BACKEND=pgvector but the 'vector' extension is not installed")
+        _backend = "pgvector" if available else "numpy"
+    return _backend
+
+
+def ensure_vector_index(engine: Engine) -> None:
+    """Columna `vector` e índice ANN en Postgres con pgvector (en otros casos no aplica)."""
+    if engine.dialect.name == "postgresql" and VECTOR_BACKEND != "numpy":
+        try:
+            with engine.begin() as conn:
+                conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+        except Exception as e:
+            # Sin permisos o sin el paquete instalado en el servidor: se usa el índice NumPy
+            print(f"⚠️ pgvector no disponible ({e.__class__.__name__}): búsqueda semántica con NumPy")
+    if backend(engine) != "pgvector":
+        return
+    if PGVECTOR_INDEX == "ivfflat":
+        index_ddl = (
+            "CREATE INDEX IF NOT EXISTS ix_messageembedding_embedding ON messageembedding "
+            f"USING ivfflat (embedding vector_ip_ops) WITH (lists = {PGVECTOR_IVF_LISTS})"
+        )
+    else:
+        index_ddl = (
+            "CREATE INDEX IF NOT EXISTS ix_messageembedding_embedding ON messageembedding "
+            "USING hnsw (embedding vector_ip_ops)"
+        )
+    with engine.begin() as conn:
+        conn.execute(text(f"ALTER TABLE messageembedding ADD COLUMN IF NOT EXISTS embedding vector({EMBEDDING_DIM})"))
+        conn.execute(text(index_ddl))
+    print(f"🧭 Búsqueda semántica con pgvector ({PGVECTOR_INDEX})")
+
+
+class NumpyVectorIndex:
+    """
+    Índice plano en disco por cliente: `<cliente>.f32` (float32 N×dim) + `<cliente>.ids` (uuid N×16).
+    Los appends y reconstrucciones van bajo flock, así que varios workers comparten los ficheros.
+    """
+
+    def __init__(self, directory: str, dim: int):
+        self.directory = directory
+        self.dim = dim
+        # client_id -> (inode, filas, matriz memmap, ids)
+        self._maps: Dict[str, Tuple[int, int, object, object]] = {}
+        self._lock = threading.Lock()
+
+    def _paths(self, client_id: str) -> Tuple[str, str, str]:
+        base = os.path.join(self.directory, uuid.uuid5(uuid.NAMESPACE_URL, client_id).hex)
+        return base + ".f32", base + ".ids", base + ".lock"
+
+    def exists(self, client_id: str) -> bool:
+        return os.path.exists(self._paths(client_id)[0])
+
+    def _locked(self, client_id: str):
+        os.makedirs(self.directory, exist_ok=True)
+        handle = open(self._paths(client_id)[2], "a")
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        return handle
+
+    def _rows(self, vectors_path: str, ids_path: str) -> int:
+        """Filas completas en ambos ficheros (un append interrumpido puede dejar uno más largo)."""
+        return min(os.path.getsize(vectors_path) // (self.dim * 4), os.path.getsize(ids_path) // _ID_BYTES)
+
+    def append(self, client_id: str, items: List[Tuple[str, bytes]]) -> None:
+        """Añade (message_id, vector normalizado) al final del índice del cliente."""
+        if not items:
+            return
+        vectors_path, ids_path, _ = self._paths(client_id)
+        with self._locked(client_id):
+            if not self.exists(client_id):
+                return  # Sin índice aún: se construirá completo desde la base de datos
+            rows = self._rows(vectors_path, ids_path)
+            with open(vectors_path, "r+b") as vectors, open(ids_path, "r+b") as ids:
+                vectors.truncate(rows * self.dim * 4)
+                ids.truncate(rows * _ID_BYTES)
+                vectors.seek(0, os.SEEK_END)
+                ids.seek(0, os.SEEK_END)
+                vectors.write(b"".join(vector for _, vector in items))
+                ids.write(b"".join(uuid.UUID(message_id).bytes for message_id, _ in items))
+
+    def rebuild(self, client_id: str, load_rows: Callable[[], Iterable[Tuple[str, bytes]]], only_if_missing: bool = False) -> None:
+        """
+        Reescribe el índice del cliente (ficheros temporales + rename atómico).
+        Las filas se leen bajo el lock: un append confirmado después espera y se añade detrás.
+        """
+        vectors_path, ids_path, _ = self._paths(client_id)
+        with self._locked(client_id):
+            if only_if_missing and self.exists(client_id):
+                return
+            rows = load_rows()
+            with open(vectors_path + ".tmp", "wb") as vectors, open(ids_path + ".tmp", "wb") as ids:
+                for message_id, vector in rows:
+                    vectors.write(vector)
+                    ids.write(uuid.UUID(message_id).bytes)
+            os.replace(ids_path + ".tmp", ids_path)
+            os.replace(vectors_path + ".tmp", vectors_path)
+
+    def _open(self, client_id: str):
+        vectors_path, ids_path, _ = self._paths(client_id)
+        stat = os.stat(vectors_path)
+        rows = self._rows(vectors_path, ids_path)
+        with self._lock:
+            cached = self._maps.get(client_id)
+            if cached and cached[0] == stat.st_ino and cached[1] == rows:
+                return cached[2], cached[3]
+        if rows == 0:
+            matrix, ids = np.empty((0, self.dim), dtype=np.float32), np.empty((0, _ID_BYTES), dtype=np.uint8)
+        else:
+            matrix = np.memmap(vectors_path, dtype=np.float32, mode="r", shape=(rows, self.dim))
+            ids = np.memmap(ids_path, dtype=np.uint8, mode="r", shape=(rows, _ID_BYTES))
+        with self._lock:
+            self._maps[client_id] = (stat.st_ino, rows, matrix, ids)
+        return matrix, ids
+
+    def search(self, client_id: str, query, k: int) -> List[Tuple[str, float]]:
+        """Top-k (message_id, score) por producto escalar, recorriendo la matriz por bloques."""
+        matrix, ids = self._open(client_id)
+        best_rows = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        for start in range(0, len(matrix), VECTOR_SEARCH_BLOCK):
+            scores = np.asarray(matrix[start:start + VECTOR_SEARCH_BLOCK]) @ query
+            if len(scores) > k:
+                top = np.argpartition(scores, -k)[-k:]
+            else:
+                top = np.arange(len(scores))
+            best_rows = np.concatenate([best_rows, top + start])
+            best_scores = np.concatenate([best_scores, scores[top]])
+            if len(best_scores) > k:
+                keep = np.argpartition(best_scores, -k)[-k:]
+                best_rows, best_scores = best_rows[keep], best_scores[keep]
+        order = np.argsort(-best_scores)
+        return [(str(uuid.UUID(bytes=ids[best_rows[i]].tobytes())), float(best_scores[i])) for i in order]
+
+
+numpy_index = NumpyVectorIndex(VECTOR_INDEX_DIR, EMBEDDING_DIM)
+
+
+# --- Escritura ---
+
+def store_embedding(session: Session, message: Message, client_id: str, vector: bytes) -> None:
+    """Guarda (o reemplaza) el embedding de un mensaje. El commit lo hace quien llama; después, index_after_commit()."""
+    session.merge(MessageEmbedding(
+        message_id=message.id,
+        client_id=client_id,
+        conversation_id=message.conversation_id,
+        dim=EMBEDDING_DIM,
+        vector=vector,
+    ))
+    if backend(session.get_bind()) == "pgvector":
+        session.flush()
+        session.execute(
+            text("UPDATE messageembedding SET embedding = CAST(:vector AS vector) WHERE message_id = :message_id"),
+            params={"vector": _pgvector_literal(vector), "message_id": message.id},
+        )
+
+
+def index_after_commit(engine: Engine, client_id: str, items: List[Tuple[str, bytes]]) -> None:
+    """Añade al índice NumPy los embeddings ya confirmados (con pgvector no hace nada)."""
+    if backend(engine) == "numpy":
+        numpy_index.append(client_id, items)
+
+
+def save_embedding(engine: Engine, message: Message, client_id: str, vector: bytes) -> None:
+    """store_embedding + commit + índice, en una sesión propia."""
+    with Session(engine) as session:
+        store_embedding(session, message, client_id, vector)
+        session.commit()
+    index_after_commit(engine, client_id, [(message.id, vector)])
+
+
+def delete_embeddings(session: Session, message_ids: Sequence[str]) -> None:
+    """Borra los embeddings de mensajes eliminados definitivamente. El commit lo hace quien llama."""
+    session.exec(delete(MessageEmbedding).where(MessageEmbedding.message_id.in_(message_ids)))
+
+
+def delete_conversation_embeddings(session: Session, conversation_id: int) -> None:
+    """Borra los embeddings que queden de una conversación (p. ej. los de sus mensajes archivados)."""
+    session.exec(delete(MessageEmbedding).where(MessageEmbedding.conversation_id == conversation_id))
+
+
+# --- Búsqueda ---
+
+def _client_rows(session: Session, client_id: str) -> List[Tuple[str, bytes]]:
+    return session.exec(
+        select(MessageEmbedding.message_id, MessageEmbedding.vector)
+        .where(MessageEmbedding.client_id == client_id)
+    ).all()
+
+
+def _hydrate(session: Session, client_id: str, query, candidate_ids: List[str], conversation_id: Optional[int], k: int):
+    """Mensajes vivos del cliente entre los candidatos, puntuados con el vector de la base de datos."""
+    if not candidate_ids:
+        return []
+    statement = (
+        select(Message, MessageEmbedding.vector)
+        .join(MessageEmbedding, MessageEmbedding.message_id == Message.id)
+        .join(Conversation, Conversation.id == Message.conversation_id)
+        .where(Message.id.in_(candidate_ids), Conversation.client_id == client_id, Conversation.status != "deleting")
+    )
+    if conversation_id is not None:
+        statement = statement.where(Message.conversation_id == conversation_id)
+    hits = [(message, float(decode(vector) @ query)) for message, vector in session.exec(statement).all()]
+    hits.sort(key=lambda hit: hit[1], reverse=True)
+    return hits[:k]
+
+
+def _search_pgvector(session: Session, client_id: str, query_bytes: bytes, k: int, conversation_id: Optional[int]):
+    if PGVECTOR_INDEX == "ivfflat":
+        session.execute(text(f"SET LOCAL ivfflat.probes = {PGVECTOR_IVF_PROBES}"))
+    else:
+        session.execute(text(f"SET LOCAL hnsw.ef_search = {max(PGVECTOR_EF_SEARCH, k)}"))
+    conversation_filter = "AND m.conversation_id = :conversation_id" if conversation_id is not None else ""
+    rows = session.execute(
+        text(f"""
+            SELECT e.message_id FROM messageembedding e
+            JOIN message m ON m.id = e.message_id
+            WHERE e.client_id = :client_id {conversation_filter}
+            ORDER BY e.embedding <#> CAST(:query AS vector)
+            LIMIT :k
+        """),
+        params={"client_id": client_id, "query": _pgvector_literal(query_bytes), "k": k, "conversation_id": conversation_id},
+    ).all()
+    return [row[0] for row in rows]
+
+
+def semantic_search(
+    session: Session,
+    client_id: str,
+    query_bytes: bytes,
+    k: int,
+    conversation_id: Optional[int] = None,
+) -> List[Tuple[Message, float]]:
+    """Top-k mensajes del cliente más parecidos al embedding de consulta (ya codificado con encode())."""
+    query = decode(query_bytes)
+    engine = session.get_bind()
+    if backend(engine) == "pgvector":
+        candidate_ids = _search_pgvector(session, client_id, query_bytes, k, conversation_id)
+    elif conversation_id is not None:
+        # Una conversación es pequeña: búsqueda exacta directamente sobre sus embeddings
+        candidate_ids = session.exec(
+            select(MessageEmbedding.message_id)
+            .join(Message, Message.id == MessageEmbedding.message_id)
+            .where(MessageEmbedding.client_id == client_id, Message.conversation_id == conversation_id)
+        ).all()
+    else:
+        if not numpy_index.exists(client_id):
+            numpy_index.rebuild(client_id, lambda: _client_rows(session, client_id), only_if_missing=True)
+        candidate_ids = [message_id for message_id, _ in numpy_index.search(client_id, query, k * VECTOR_OVERFETCH)]
+    return _hydrate(session, client_id, query, list(candidate_ids), conversation_id, k)
@@ -0,0 +1,147 @@
+"""
+Write-behind con group commit para los mensajes de chat.
+
+Con CHAT_WRITE_BEHIND=1, create_message no hace su propio commit: encola el mensaje y
+espera. Un hilo flusher agrupa los mensajes pendientes (hasta GROUP_COMMIT_MAX_BATCH o
+GROUP_COMMIT_MAX_DELAY_MS desde el primero) y los escribe en UNA transacción:
+- un INSERT para todos los mensajes (executemany, con su `seq` reservado justo antes),
+- sin tocar la fila de la conversación: su updated_at se vuelca aparte (ver src/core/activity.py).
+
+La respuesta HTTP sólo se envía cuando el commit del grupo ha terminado, así que la
+durabilidad es la misma que con un commit por petición: se reparte el coste del fsync.
+"""
+import asyncio
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import List, Tuple
+
+from sqlalchemy import bindparam, insert, select
+from sqlmodel import Session
+
+from src.core.activity import activity_tracker
+from src.core.database import get_engine
+from src.core.message_seq import next_seq, reserve_seqs
+from src.core.models import Message
+
+CHAT_WRITE_BEHIND = os.getenv("CHAT_WRITE_BEHIND", "0").lower() in ("1", "true", "yes")
+GROUP_COMMIT_MAX_BATCH = int(os.getenv("GROUP_COMMIT_MAX_BATCH", "500"))
+GROUP_COMMIT_MAX_DELAY_MS = float(os.getenv("GROUP_COMMIT_MAX_DELAY_MS", "5"))
+
+_Pending = Tuple[Message, Future]
+
+
+class GroupCommitter:
+    """Cola en proceso + hilo flusher que confirma los mensajes por grupos."""
+
+    def __init__(self, max_batch: int = GROUP_COMMIT_MAX_BATCH, max_delay_ms: float = GROUP_COMMIT_MAX_DELAY_MS):
+        self.max_batch = max_batch
+        self.max_delay = max_delay_ms / 1000
+        self.reset()
+
+    def reset(self) -> None:
+        """Estado limpio (tras un fork el hilo flusher no existe en el hijo)."""
+        self._queue: "queue.Queue[_Pending]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="group-commit", daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout: float = 5) -> None:
+        """Confirma lo pendiente y detiene el flusher."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join(timeout)
+
+    def submit(self, message: Message) -> Future:
+        """Encola un mensaje. El Future se resuelve tras el commit de su grupo (o con su error)."""
+        self.start()
+        future: Future = Future()
+        self._queue.put((message, future))
+        return future
+
+    async def write(self, message: Message) -> Message:
+        """Versión asyncio de submit(): espera al group commit sin ocupar un hilo."""
+        await asyncio.wrap_future(self.submit(message))
+        return message
+
+    def _collect(self, first: _Pending) -> Tuple[List[_Pending], bool]:
+        batch = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            first = self._queue.get()
+            if first is None:
+                break
+            batch, stopping = self._collect(first)
+            self._flush(batch)
+
+    def _flush(self, batch: List[_Pending]) -> None:
+        try:
+            self._commit([message for message, _ in batch])
+        except Exception:
+            # Un mensaje inválido (ej. FK rota) no debe tumbar al resto del grupo:
+            # se reintenta uno a uno para devolver el error sólo a quien corresponde
+            for message, future in batch:
+                try:
+                    self._commit([message])
+                except Exception as e:
+                    future.set_exception(e)
+                else:
+                    future.set_result(message)
+            return
+        for message, future in batch:
+            future.set_result(message)
+
+    @staticmethod
+    def _commit(messages: List[Message]) -> None:
+        with Session(get_engine()) as session:
+            dialect_name = session.get_bind().dialect.name
+            if dialect_name == "postgresql":
+                # Reserva + INSERT + commit: lo único que hace el grupo bajo los advisory locks
+                # de sus conversaciones (ver src/core/message_seq.py)
+                seqs = reserve_seqs(session.connection(), [message.conversation_id for message in messages])
+                assigned = {message.id: seq for message, seq in zip(messages, seqs)}
+                session.execute(insert(Message), [
+                    {**message.model_dump(exclude={"seq"}), "seq": assigned[message.id]} for message in messages
+                ])
+            else:
+                # seq en el propio INSERT, fila a fila dentro del grupo
+                statement = insert(Message).values(seq=next_seq(dialect_name, bindparam("seq_conversation_id")))
+                session.execute(statement, [
+                    {**message.model_dump(exclude={"seq"}), "seq_conversation_id": message.conversation_id}
+                    for message in messages
+                ])
+                assigned = dict(session.execute(
+                    select(Message.id, Message.seq).where(Message.id.in_([message.id for message in messages]))
+                ).all())
+            session.commit()
+        for message in messages:
+            message.seq = assigned[message.id]
+            activity_tracker.touch(message.conversation_id, message.created_at)
+
+
+group_committer = GroupCommitter()
+
+# Cada worker arranca su propio flusher al primer submit
+os.register_at_fork(after_in_child=group_committer.reset)
@@ -0,0 +1,40 @@
+"""
+Tareas periódicas en segundo plano (hilos daemon dentro de cada worker).
+
+Cada job debe ser idempotente y tolerar ejecutarse en varios workers a la vez:
+no hay coordinación entre procesos.
+"""
+import threading
+import traceback
+from typing import Callable, Dict
+
+_jobs: Dict[str, threading.Event] = {}
+_jobs_lock = threading.Lock()
+
+
+def start_periodic_job(name: str, interval: float, fn: Callable[[], None]) -> None:
+    """Ejecuta `fn` cada `interval` segundos hasta stop_jobs(). Es idempotente por nombre."""
+    with _jobs_lock:
+        if name in _jobs:
+            return
+        stop = threading.Event()
+        _jobs[name] = stop
+
+    def run():
+        while not stop.wait(interval):
+            try:
+                fn()
+            except Exception:
+                print(f"❌ Error en el job '{name}':")
+                traceback.print_exc()
+
+    threading.Thread(target=run, name=f"job-{name}", daemon=True).start()
+    print(f"⏱️  Job '{name}' programado cada {interval:g}s")
+
+
+def stop_jobs() -> None:
+    """Detiene todos los jobs periódicos (al apagar la aplicación)."""
+    with _jobs_lock:
+        for stop in _jobs.values():
+            stop.set()
+        _jobs.clear()
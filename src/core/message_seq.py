@@ -0,0 +1,151 @@
+"""
+Número de secuencia de los mensajes dentro de su conversación (Message.seq).
+
+El orden del historial ya no depende de `created_at` (reloj de cada réplica de la API, con
+empates): las lecturas ("desde seq N", cursores) son rangos del índice único
+(conversation_id, seq). Sin contador en la fila de la conversación, así que no hay un row lock
+caliente:
+
+- Postgres: `nextval` de una secuencia global, estrictamente creciente dentro de cada
+  conversación (puede tener huecos). nextval no es transaccional: si el seq saliera en el
+  INSERT, dos escritores de la misma conversación podrían hacer commit en otro orden y un
+  lector con `after_seq` saltarse el seq menor. Por eso, como los offsets del outbox, el seq se
+  saca justo antes del commit (`reserve_seqs`), bajo un advisory lock de la conversación que
+  se libera con el commit: dentro de una conversación los seq se hacen visibles en orden, y
+  los escritores sólo se esperan durante ese último paso, no durante toda su transacción.
+  El INSERT por el ORM deja seq a NULL (la fila aún no es visible para nadie) y un UPDATE la
+  numera en before_commit; el group commit inserta ya con el seq reservado.
+- Otros motores (SQLite): MAX(seq) + 1 de la conversación como subconsulta del INSERT.
+  SQLite serializa las escrituras, así que la numeración no tiene huecos.
+"""
+from typing import List, Optional
+
+from sqlalchemy import event, func, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session as SASession, object_session
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlmodel import Session, select
+
+from src.core.models import Message
+
+MESSAGE_SEQUENCE = "message_seq_seq"
+# Espacio de claves de pg_advisory_xact_lock(int, int) para las conversaciones
+_SEQ_LOCK_NAMESPACE = 0x73657121
+# Mensajes insertados por el ORM en esta transacción, pendientes de seq (Postgres)
+_PENDING_SEQ = "message_seq_pending"
+
+
+def next_seq(dialect_name: str, conversation_id):
+    """Expresión SQL del siguiente seq (conversation_id puede ser un valor o un bindparam)."""
+    if dialect_name == "postgresql":
+        return func.nextval(MESSAGE_SEQUENCE)
+    return (
+        select(func.coalesce(func.max(Message.seq), 0) + 1)
+        .where(Message.conversation_id == conversation_id)
+        .scalar_subquery()
+    )
+
+
+def reserve_seqs(connection, conversation_ids: List[int]) -> List[int]:
+    """
+    Postgres: seq de cada mensaje (uno por elemento, en el mismo orden). Llamar justo antes del
+    commit: toma el advisory lock de las conversaciones, en orden de id para que dos
+    transacciones no se bloqueen mutuamente, y lo suelta el commit.
+    """
+    # Un solo viaje: la subconsulta de los locks es un InitPlan, se evalúa antes del primer nextval
+    return list(connection.execute(
+        text(f"""
+            SELECT nextval('{MESSAGE_SEQUENCE}') FROM generate_series(1, :count)
+            WHERE (SELECT count(pg_advisory_xact_lock(:namespace, conversation_id))
+                   FROM (SELECT DISTINCT unnest(CAST(:conversation_ids AS integer[])) AS conversation_id
+                         ORDER BY 1) AS ordered) > 0
+            ORDER BY 1
+        """),
+        {
+            "count": len(conversation_ids),
+            "namespace": _SEQ_LOCK_NAMESPACE,
+            "conversation_ids": sorted(set(conversation_ids)),
+        },
+    ).scalars())
+
+
+@event.listens_for(Message, "before_insert")
+def _assign_seq(mapper, connection, target):
+    """Todo INSERT por el ORM sin seq (mensajes nuevos, restauraciones antiguas, scripts) recibe uno."""
+    if target.seq is not None:
+        return
+    if connection.dialect.name == "postgresql":
+        object_session(target).info.setdefault(_PENDING_SEQ, []).append(target)
+        return
+    target.seq = next_seq(connection.dialect.name, target.conversation_id)
+
+
+# insert=True: antes que el hook del outbox, así el orden de los advisory locks es siempre el mismo
+@event.listens_for(SASession, "before_commit", insert=True)
+def _number_on_commit(session):
+    """Postgres: numera los mensajes insertados por el ORM en esta transacción, en orden de INSERT."""
+    if session.get_bind().dialect.name != "postgresql":
+        return
+    session.flush()
+    messages = [message for message in session.info.pop(_PENDING_SEQ, []) if message.seq is None]
+    if not messages:
+        return
+    seqs = reserve_seqs(session.connection(), [message.conversation_id for message in messages])
+    session.execute(
+        text("UPDATE message SET seq = :seq WHERE id = :id"),
+        [{"seq": seq, "id": message.id} for message, seq in zip(messages, seqs)],
+    )
+    for message, seq in zip(messages, seqs):
+        set_committed_value(message, "seq", seq)
+
+
+@event.listens_for(SASession, "after_rollback")
+def _discard_pending_seq(session):
+    session.info.pop(_PENDING_SEQ, None)
+
+
+def ensure_message_seq(engine: Engine) -> None:
+    """
+    Numera los mensajes anteriores a la columna `seq` (por created_at, en cada conversación)
+    y, en Postgres, crea la secuencia por encima del mayor seq existente.
+    """
+    with Session(engine) as session:
+        pending = session.exec(select(Message.conversation_id).where(Message.seq.is_(None)).distinct()).all()
+        for conversation_id in pending:
+            start = session.exec(
+                select(func.coalesce(func.max(Message.seq), 0)).where(Message.conversation_id == conversation_id)
+            ).one()
+            ids = session.exec(
+                select(Message.id)
+                .where(Message.conversation_id == conversation_id, Message.seq.is_(None))
+                .order_by(Message.created_at, Message.id)
+            ).all()
+            session.execute(
+                text("UPDATE message SET seq = :seq WHERE id = :id"),
+                [{"seq": start + i, "id": message_id} for i, message_id in enumerate(ids, start=1)],
+            )
+            session.commit()
+        if pending:
+            print(f"🔢 Numerados los mensajes de {len(pending)} conversaciones (Message.seq)")
+
+    with engine.begin() as conn:
+        # Sustituido por ix_message_conversation_seq
+        conn.execute(text("DROP INDEX IF EXISTS ix_message_conversation_created_at"))
+        if engine.dialect.name == "postgresql":
+            conn.execute(text(f"CREATE SEQUENCE IF NOT EXISTS {MESSAGE_SEQUENCE}"))
+            advance_message_sequence(conn)
+
+
+def advance_message_sequence(conn, at_least: Optional[int] = None) -> None:
+    """
+    Postgres: lleva la secuencia por encima del mayor seq existente, o de `at_least` si quien
+    llama ya lo conoce (tras insertar mensajes con seq explícito, sin recorrer `message`).
+    Nunca hacia atrás: otro worker puede estar usando ya la secuencia.
+    """
+    highest = ":at_least" if at_least is not None else "(SELECT COALESCE(MAX(seq), 1) FROM message)"
+    conn.execute(text(f"""
+        SELECT setval('{MESSAGE_SEQUENCE}', GREATEST(
+            (SELECT last_value FROM {MESSAGE_SEQUENCE}),
+            {highest}
+        ))
+    """), {"at_least": at_least} if at_least is not None else {})
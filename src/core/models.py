@@ -1,6 +1,7 @@
 import uuid
 from datetime import datetime
 from typing import Optional, List
+from sqlalchemy import Index, Column, JSON, LargeBinary
 from sqlmodel import SQLModel, Field, Relationship
 
 # --- CLASE BASE (Para no repetir campos en todas las tablas) ---
@@ -25,6 +26,13 @@ class BaseStringModel(SQLModel):
 
 # --- EVENTOS ---
 class Event(BaseUUIDModel, table=True):
+    # Índice para las consultas incrementales de /sync ("cambios desde")
+    __table_args__ = (
+        Index("ix_event_updated_at", "updated_at"),
+        # Prefiltro de rangos en motores sin tsrange (en Postgres se usa además ix_event_period, GiST)
+        Index("ix_event_start_at_end_at", "start_at", "end_at"),
+    )
+
     title: str
     description: Optional[str] = None
     start_at: datetime
@@ -32,6 +40,12 @@ class Event(BaseUUIDModel, table=True):
     end_at: Optional[datetime] = None
     all_day: bool = False
     location: Optional[str] = None
+
+    # Recurrencia (RFC 5545), ej: "FREQ=WEEKLY;BYDAY=MO,WE". Las ocurrencias NO se guardan:
+    # se expanden al consultar un rango (ver src/core/recurrence.py)
+    rrule: Optional[str] = None
+    # Fin de la última ocurrencia (calculado). None = serie sin fin
+    recurrence_end: Optional[datetime] = Field(default=None, index=True)
     
     # Relación: Un evento puede tener muchas tareas
     tasks: List["Task"] = Relationship(back_populates="event")
@@ -40,6 +54,8 @@ class Event(BaseUUIDModel, table=True):
 
 # --- TAREAS ---
 class Task(BaseUUIDModel, table=True):
+    __table_args__ = (Index("ix_task_updated_at", "updated_at"),)
+
     title: str
     status: str = Field(default="pending") # pending, doing, done
     priority: int = Field(default=1) # 1 (Baja) a 5 (Crítica)
@@ -57,9 +73,16 @@ class Task(BaseUUIDModel, table=True):
 
 # --- RECORDATORIOS ---
 class Reminder(BaseUUIDModel, table=True):
+    __table_args__ = (Index("ix_reminder_updated_at", "updated_at"),)
+
     message: str
     trigger_at: datetime
     is_completed: bool = False
+
+    # Recurrencia (RFC 5545), igual que en Event
+    rrule: Optional[str] = None
+    # Último disparo de la serie (calculado). None = serie sin fin
+    recurrence_end: Optional[datetime] = Field(default=None, index=True)
     
     # Opcionalmente vinculado a una tarea
     task_id: Optional[str] = Field(default=None, foreign_key="task.id")
@@ -69,6 +92,24 @@ class Reminder(BaseUUIDModel, table=True):
     event_id: Optional[str] = Field(default=None, foreign_key="event.id")
     event: Optional[Event] = Relationship(back_populates="reminders")
 
+# --- RECURRENCIA: excepciones por ocurrencia ---
+class RecurrenceOverride(BaseUUIDModel, table=True):
+    """
+    Excepción sobre UNA ocurrencia de una serie (Event o Reminder):
+    cancelarla o cambiar algunos de sus campos (hora, título, completado...).
+    """
+    __table_args__ = (
+        Index("ix_recurrenceoverride_series", "series_type", "series_id", "recurrence_id", unique=True),
+    )
+
+    series_type: str # event, reminder
+    series_id: str
+    # Inicio ORIGINAL de la ocurrencia (identifica la ocurrencia aunque se mueva)
+    recurrence_id: datetime
+    cancelled: bool = False
+    # Campos sobrescritos, ej: {"start_at": "2026-03-02T11:00:00", "title": "Movida"}
+    changes: dict = Field(default_factory=dict, sa_column=Column(JSON))
+
 # --- INFERENCE LAYER (Internal System) ---
 class InferenceClient(BaseStringModel, table=True):
     # El id heredado ahora juega el rol de identificador (ej: "jota_orchestrator")
@@ -98,8 +139,12 @@ class Client(BaseStringModel, table=True):
     conversations: List["Conversation"] = Relationship(back_populates="client")
 
 class Conversation(BaseNumericModel, table=True):
+    __table_args__ = (Index("ix_conversation_client_updated_at", "client_id", "updated_at"),)
+
     title: Optional[str] = None
-    status: str = Field(default="active") # active, archived
+    # active, archiving (compactación pendiente), archived, deleting (borrado en curso por lotes),
+    # ver src/core/retention.py
+    status: str = Field(default="active")
     
     # Vinculación con Client (Client usa UUID)
     client_id: str = Field(foreign_key="client.id")
@@ -113,13 +158,130 @@ class Conversation(BaseNumericModel, table=True):
     messages: List["Message"] = Relationship(back_populates="conversation")
 
 class Message(BaseUUIDModel, table=True):
+    # Lectura ordenada de una conversación ("desde seq N", cursores) y borrado por lotes de sus mensajes
+    __table_args__ = (
+        Index("ix_message_conversation_seq", "conversation_id", "seq", unique=True),
+        # Agregación incremental de uso por tramos de created_at (ver src/core/usage.py)
+        Index("ix_message_created_at", "created_at"),
+    )
+
     content: str
     role: str # user, assistant, system
     
     # Vinculación con Conversation (Conversation usa int)
     conversation_id: int = Field(foreign_key="conversation.id")
     conversation: Conversation = Relationship(back_populates="messages")
+    # Posición en la conversación, asignada al insertar o, en Postgres, al hacer commit (ver src/core/message_seq.py)
+    seq: Optional[int] = None
     
     # Modelo de IA que generó este mensaje (relevante para mensajes de rol "assistant")
     ai_model_id: Optional[str] = Field(default=None, foreign_key="aimodel.id")
-    ai_model: Optional["AIModel"] = Relationship(back_populates="messages")
\ No newline at end of file
+    ai_model: Optional["AIModel"] = Relationship(back_populates="messages")
+
+    # final | draft (respuesta en generación: el texto se va añadiendo en MessageChunk)
+    status: str = Field(default="final")
+
+class MessageChunk(BaseNumericModel, table=True):
+    """
+    Trozo añadido a un mensaje en borrador. Cada append es un INSERT de tamaño O(chunk)
+    en lugar de reescribir `content` entero; al finalizar se concatenan en Message.content.
+    El id autoincremental da el orden y sirve de Last-Event-ID para el stream en vivo.
+    """
+    __table_args__ = (Index("ix_messagechunk_message_id_id", "message_id", "id"),)
+
+    message_id: str = Field(foreign_key="message.id")
+    content: str
+
+class MessageEmbedding(SQLModel, table=True):
+    """
+    Embedding opcional de un mensaje para la búsqueda semántica (ver src/core/embeddings.py).
+    En tabla aparte para que las filas de `message` sigan siendo estrechas en las lecturas del historial.
+    Sin FK a message: al archivar una conversación sus embeddings se conservan y vuelven a
+    ser buscables al restaurarla (los mensajes recuperan los mismos ids).
+    """
+    message_id: str = Field(primary_key=True)
+    # Desnormalizados: la búsqueda siempre es por cliente y el borrado, por conversación
+    client_id: str = Field(index=True)
+    conversation_id: int = Field(index=True)
+    dim: int
+    # float32 normalizado (producto escalar = similitud coseno)
+    vector: bytes = Field(sa_column=Column(LargeBinary, nullable=False))
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class ArchivedConversation(BaseNumericModel, table=True):
+    """
+    Almacenamiento frío: los mensajes de una conversación archivada, compactados en un
+    único blob comprimido. Las filas de `message` (y sus índices) sólo cubren conversaciones activas.
+    """
+    conversation_id: int = Field(foreign_key="conversation.id", unique=True)
+    codec: str # zstd, gzip
+    message_count: int
+    raw_size: int # Bytes del JSON sin comprimir
+    # Array JSON de mensajes (mismo formato que GET /chat/{id}/messages), comprimido
+    payload: bytes = Field(sa_column=Column(LargeBinary, nullable=False))
+
+class RetentionPolicy(BaseStringModel, table=True):
+    """Política de retención de las conversaciones de un cliente (id = client.id)."""
+    # Archivar las conversaciones activas tras N días sin actividad (None = nunca)
+    archive_after_days: Optional[int] = None
+    # Borrar las conversaciones archivadas tras N días archivadas (None = nunca)
+    purge_archived_after_days: Optional[int] = None
+
+# --- SINCRONIZACIÓN ---
+class Tombstone(BaseNumericModel, table=True):
+    """Rastro de una entidad borrada, para que /sync pueda propagar el borrado a los clientes."""
+    entity_type: str # task, event, reminder, conversation
+    entity_id: str
+    # Sólo para entidades de un cliente concreto (conversaciones); None = visible para todos
+    client_id: Optional[str] = Field(default=None, index=True)
+    deleted_at: datetime = Field(default_factory=datetime.utcnow, index=True)
+
+# --- IDEMPOTENCIA ---
+class IdempotencyRecord(SQLModel, table=True):
+    """
+    Respuesta guardada de una petición con Idempotency-Key (ver src/api/idempotency.py).
+    id = hash(credenciales + clave): ni la API key ni la clave se guardan en claro.
+    """
+    id: str = Field(primary_key=True)
+    fingerprint: str # sha256 de método + ruta + cuerpo
+    # None mientras la primera petición se está ejecutando
+    status_code: Optional[int] = None
+    content_type: Optional[str] = None
+    body: Optional[bytes] = Field(default=None, sa_column=Column(LargeBinary))
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    expires_at: datetime = Field(index=True)
+    # Lease de la petición que la ejecuta: caducado, otra petición puede tomar la clave
+    locked_until: Optional[datetime] = None
+
+# --- CHANGE DATA CAPTURE (Outbox) ---
+class OutboxEvent(BaseNumericModel, table=True):
+    """
+    Cambio sobre una Task/Event/Reminder, escrito en la MISMA transacción que el cambio.
+    El id autoincremental es el offset que usan los consumidores para reanudar.
+    """
+    entity_type: str # task, event, reminder
+    entity_id: str
+    op: str # insert, update, delete
+    entity_version: Optional[int] = None
+
+class OutboxConsumer(BaseStringModel, table=True):
+    # El id heredado es el nombre del consumidor (ej: "jota_orchestrator")
+    last_acked_id: int = Field(default=0) # Último offset confirmado
+
+# --- USO (Rollups) ---
+class UsageRollup(SQLModel, table=True):
+    """
+    Mensajes y caracteres por cliente, modelo de IA y periodo (hora, día o mes, en UTC).
+    Se mantiene de forma incremental (ver src/core/usage.py): GET /stats/usage sólo lee de aquí.
+    """
+    granularity: str = Field(primary_key=True) # hour, day, month
+    client_id: str = Field(primary_key=True)
+    bucket_start: datetime = Field(primary_key=True)
+    ai_model_id: str = Field(default="", primary_key=True) # "" = sin modelo (mensajes del usuario...)
+    messages: int = Field(default=0)
+    characters: int = Field(default=0)
+
+class UsageWatermark(SQLModel, table=True):
+    """Hasta dónde (created_at de los mensajes, exclusivo) está agregado UsageRollup."""
+    id: str = Field(primary_key=True)
+    aggregated_until: datetime
@@ -0,0 +1,41 @@
+"""
+Notificaciones en proceso: permite que un hilo (listener de Postgres, job, endpoint síncrono)
+despierte a corrutinas que esperan en el event loop (streams SSE).
+"""
+import asyncio
+import threading
+from typing import Dict, Hashable, Optional, Set, Tuple
+
+
+class Broadcaster:
+    """Publica avisos por clave a suscriptores asyncio, desde cualquier hilo."""
+
+    def __init__(self):
+        self._subscribers: Dict[Optional[Hashable], Set[Tuple[asyncio.AbstractEventLoop, asyncio.Event]]] = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, key: Optional[Hashable] = None) -> asyncio.Event:
+        """Debe llamarse desde el event loop. Devuelve el Event que se activará en cada aviso."""
+        event = asyncio.Event()
+        with self._lock:
+            self._subscribers.setdefault(key, set()).add((asyncio.get_running_loop(), event))
+        return event
+
+    def unsubscribe(self, event: asyncio.Event, key: Optional[Hashable] = None) -> None:
+        with self._lock:
+            subscribers = self._subscribers.get(key)
+            if not subscribers:
+                return
+            subscribers.difference_update({sub for sub in subscribers if sub[1] is event})
+            if not subscribers:
+                self._subscribers.pop(key, None)
+
+    def publish(self, key: Optional[Hashable] = None) -> None:
+        with self._lock:
+            subscribers = list(self._subscribers.get(key, ()))
+        for loop, event in subscribers:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # Loop cerrado: el suscriptor ya no existe
+                self.unsubscribe(event, key)
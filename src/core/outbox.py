@@ -0,0 +1,217 @@
+"""
+Outbox transaccional para Tasks, Events y Reminders (change data capture).
+
+- record_change() añade una fila a OutboxEvent en la misma transacción que el cambio:
+  si la transacción hace rollback, el evento desaparece con ella.
+- Los offsets (ids) siguen el orden de commit: las filas se insertan justo antes del commit,
+  con un advisory lock de transacción en Postgres. Si un consumidor ve el offset N+1, el N ya
+  es visible (o nunca existirá): leer y confirmar N+1 no puede saltarse un N que aún no ha
+  hecho commit, y prune_outbox no borra nada que nadie haya leído.
+- Al hacer commit se emite un único NOTIFY compacto (el offset más alto) en Postgres.
+- ChangeNotifier escucha esos NOTIFY (o hace polling en otros motores / PgBouncer)
+  y despierta a los streams SSE de /changes.
+- prune_outbox() borra por lotes lo que todos los consumidores ya han confirmado.
+"""
+import os
+import select as select_module
+import threading
+from datetime import datetime, timedelta
+from typing import List
+
+from sqlalchemy import event, func, text
+from sqlalchemy.orm import Session as SASession
+from sqlmodel import Session, select, delete, or_
+
+from src.core.database import get_engine, is_sqlite, DATABASE_URL, DB_POOL_MODE
+from src.core.models import OutboxEvent, OutboxConsumer
+from src.core.notify import Broadcaster
+
+OUTBOX_CHANNEL = os.getenv("OUTBOX_CHANNEL", "jota_outbox")
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "1"))      # Fallback sin LISTEN
+OUTBOX_PRUNE_INTERVAL = float(os.getenv("OUTBOX_PRUNE_INTERVAL", "60"))
+OUTBOX_PRUNE_BATCH = int(os.getenv("OUTBOX_PRUNE_BATCH", "5000"))
+# Límite de seguridad: un consumidor caído no puede hacer crecer el outbox indefinidamente
+OUTBOX_RETENTION_DAYS = float(os.getenv("OUTBOX_RETENTION_DAYS", "7"))
+# pg_advisory_xact_lock que serializa la asignación de offsets con el commit
+_OUTBOX_LOCK_ID = 0x6A6F7461
+
+
+def record_change(session: Session, entity_type: str, entity, op: str) -> None:
+    """
+    Registra un cambio en el outbox. Debe llamarse antes del commit de la propia escritura;
+    la fila se inserta al hacer commit (ver _write_outbox_on_commit).
+
+    Args:
+        session: Sesión de la escritura
+        entity_type: "task", "event" o "reminder"
+        entity: Entidad modificada (se usan su id y version)
+        op: "insert", "update" o "delete"
+    """
+    change = OutboxEvent(
+        entity_type=entity_type,
+        entity_id=str(entity.id),
+        op=op,
+        entity_version=getattr(entity, "version", None),
+    )
+    session.info.setdefault("outbox_changes", []).append(change)
+
+
+@event.listens_for(SASession, "before_commit")
+def _write_outbox_on_commit(session):
+    """
+    Inserta los cambios pendientes justo antes del commit. En Postgres, bajo un advisory lock
+    de transacción (se libera con el commit): una transacción no obtiene sus offsets hasta
+    que la anterior ha terminado, así que los ids quedan en orden de commit. Después, un
+    NOTIFY con el offset más alto; Postgres lo entrega sólo si el commit tiene éxito.
+    """
+    changes: List[OutboxEvent] = session.info.pop("outbox_changes", None)
+    if not changes:
+        return
+    if session.get_bind().dialect.name != "postgresql":
+        # SQLite: un único escritor a la vez, los ids ya salen en orden de commit
+        session.add_all(changes)
+        return
+    # Primero el resto de la transacción: con el lock sólo se insertan filas del outbox
+    # (sin esperar row locks de otros mientras otros esperan este lock)
+    session.flush()
+    session.execute(text("SELECT pg_advisory_xact_lock(:lock_id)"), {"lock_id": _OUTBOX_LOCK_ID})
+    session.add_all(changes)
+    session.flush()
+    max_id = max(change.id for change in changes)
+    session.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": OUTBOX_CHANNEL, "payload": str(max_id)})
+
+
+@event.listens_for(SASession, "after_rollback")
+def _discard_outbox_on_rollback(session):
+    session.info.pop("outbox_changes", None)
+
+
+def fetch_changes(after: int, limit: int = 500) -> List[dict]:
+    """Cambios con offset > after, en orden."""
+    with Session(get_engine()) as session:
+        rows = session.exec(
+            select(OutboxEvent).where(OutboxEvent.id > after).order_by(OutboxEvent.id).limit(limit)
+        ).all()
+        return [
+            {
+                "offset": row.id,
+                "entity_type": row.entity_type,
+                "entity_id": row.entity_id,
+                "op": row.op,
+                "version": row.entity_version,
+                "at": row.created_at.isoformat(),
+            }
+            for row in rows
+        ]
+
+
+def prune_outbox(batch_size: int = OUTBOX_PRUNE_BATCH) -> int:
+    """
+    Borra, en lotes con transacciones cortas, los eventos que todos los consumidores
+    registrados han confirmado (o que superan OUTBOX_RETENTION_DAYS).
+    """
+    total = 0
+    with Session(get_engine()) as session:
+        min_acked = session.exec(select(func.min(OutboxConsumer.last_acked_id))).one()
+        cutoff = datetime.utcnow() - timedelta(days=OUTBOX_RETENTION_DAYS)
+        condition = OutboxEvent.created_at < cutoff
+        if min_acked:
+            condition = or_(OutboxEvent.id <= min_acked, condition)
+
+        while True:
+            ids = session.exec(
+                select(OutboxEvent.id).where(condition).order_by(OutboxEvent.id).limit(batch_size)
+            ).all()
+            if not ids:
+                break
+            session.exec(delete(OutboxEvent).where(OutboxEvent.id.in_(ids)))
+            session.commit()
+            total += len(ids)
+            if len(ids) < batch_size:
+                break
+    if total:
+        print(f"🧹 Outbox: {total} eventos confirmados eliminados")
+    return total
+
+
+class ChangeNotifier:
+    """
+    Hilo que detecta nuevos eventos del outbox y despierta a los streams suscritos.
+    Usa LISTEN en Postgres; con PgBouncer (transaction pooling) u otros motores hace polling.
+    """
+
+    def __init__(self):
+        self.broadcaster = Broadcaster()
+        self.latest_id = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def dedicated_connections() -> int:
+        """Conexiones que retiene fuera del pool: la del LISTEN (Postgres sin PgBouncer)."""
+        return 1 if not is_sqlite(DATABASE_URL) and DB_POOL_MODE != "pgbouncer" else 0
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="outbox-notifier", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread = None
+
+    def _advance(self, offset: int) -> None:
+        if offset > self.latest_id:
+            self.latest_id = offset
+            self.broadcaster.publish()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                engine = get_engine()
+                if engine.dialect.name == "postgresql" and DB_POOL_MODE != "pgbouncer":
+                    self._listen(engine)
+                else:
+                    self._poll(engine)
+            except Exception as e:
+                print(f"⚠️  Outbox notifier: {e}. Reintentando en 5s...")
+                self._stop.wait(5)
+
+    def _poll(self, engine) -> None:
+        while not self._stop.is_set():
+            with Session(engine) as session:
+                latest = session.exec(select(func.max(OutboxEvent.id))).one()
+            self._advance(latest or 0)
+            self._stop.wait(OUTBOX_POLL_INTERVAL)
+
+    def _listen(self, engine) -> None:
+        # Conexión propia, fuera del pool: LISTEN la retiene siempre y no debe quitársela a las peticiones
+        cargs, cparams = engine.dialect.create_connect_args(engine.url)
+        conn = engine.dialect.connect(*cargs, **cparams)
+        try:
+            conn.autocommit = True
+            cursor = conn.cursor()
+            cursor.execute(f"LISTEN {OUTBOX_CHANNEL}")
+            # Por si hubo cambios mientras no escuchábamos
+            cursor.execute("SELECT COALESCE(MAX(id), 0) FROM outboxevent")
+            self._advance(cursor.fetchone()[0])
+
+            while not self._stop.is_set():
+                if hasattr(conn, "poll"):
+                    # psycopg2
+                    if select_module.select([conn], [], [], 5) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self._advance(int(conn.notifies.pop(0).payload))
+                else:
+                    # psycopg 3
+                    for notify in conn.notifies(timeout=5):
+                        self._advance(int(notify.payload))
+        finally:
+            conn.close()
+
+
+change_notifier = ChangeNotifier()
@@ -0,0 +1,288 @@
+"""
+Recurrencia de Events y Reminders (RRULE, RFC 5545) con expansión perezosa.
+
+En la base de datos sólo se guarda la serie (una fila con `rrule`) y sus excepciones
+(RecurrenceOverride): el almacenamiento es O(series), no O(ocurrencias).
+Las ocurrencias se generan al consultar un rango y se cachean por (regla, inicio, ventana).
+"""
+import os
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from dateutil.rrule import rrulestr
+from sqlmodel import Session, select, or_, delete
+
+from src.core.calendar import event_effective_end, where_overlaps, filter_overlapping
+from src.core.models import Event, Reminder, RecurrenceOverride
+
+RECURRENCE_CACHE_SIZE = int(os.getenv("RECURRENCE_CACHE_SIZE", "4096"))
+# Tope de seguridad al calcular el final de series con COUNT/UNTIL enormes
+RECURRENCE_MAX_OCCURRENCES = int(os.getenv("RECURRENCE_MAX_OCCURRENCES", "100000"))
+
+# Campos que una excepción puede sobrescribir en cada tipo de serie
+OVERRIDABLE_FIELDS = {
+    "event": {"title", "description", "start_at", "end_at", "all_day", "location"},
+    "reminder": {"message", "trigger_at", "is_completed"},
+}
+_DATETIME_FIELDS = {"start_at", "end_at", "trigger_at"}
+
+
+@lru_cache(maxsize=RECURRENCE_CACHE_SIZE)
+def _parse_rule(rule: str, dtstart: datetime):
+    return rrulestr(rule, dtstart=dtstart)
+
+
+def validate_rule(rule: str, dtstart: datetime) -> None:
+    """Lanza ValueError si la regla no es una RRULE válida."""
+    _parse_rule(rule, dtstart)
+
+
+@lru_cache(maxsize=RECURRENCE_CACHE_SIZE)
+def occurrence_starts(rule: str, dtstart: datetime, window_start: datetime, window_end: datetime) -> Tuple[datetime, ...]:
+    """Inicios de las ocurrencias en [window_start, window_end). Cacheado por (regla, ventana)."""
+    starts = _parse_rule(rule, dtstart).between(window_start, window_end, inc=True)
+    return tuple(start for start in starts if start < window_end)
+
+
+def last_occurrence_start(rule: str, dtstart: datetime) -> Optional[datetime]:
+    """Inicio de la última ocurrencia, o None si la serie no tiene fin."""
+    if "COUNT=" not in rule.upper() and "UNTIL=" not in rule.upper():
+        return None
+    last = None
+    for i, start in enumerate(_parse_rule(rule, dtstart)):
+        if i >= RECURRENCE_MAX_OCCURRENCES:
+            return None
+        last = start
+    return last
+
+
+def refresh_recurrence_end(entity) -> None:
+    """
+    Recalcula `recurrence_end` tras crear o modificar una serie.
+    Events: fin de la última ocurrencia. Reminders: último disparo.
+
+    Raises:
+        ValueError: Si la regla no es válida
+    """
+    if not entity.rrule:
+        entity.recurrence_end = None
+        return
+    if isinstance(entity, Event):
+        validate_rule(entity.rrule, entity.start_at)
+        last = last_occurrence_start(entity.rrule, entity.start_at)
+        duration = event_effective_end(entity.start_at, entity.end_at, entity.all_day) - entity.start_at
+        entity.recurrence_end = last + duration if last else None
+    else:
+        validate_rule(entity.rrule, entity.trigger_at)
+        entity.recurrence_end = last_occurrence_start(entity.rrule, entity.trigger_at)
+
+
+class Occurrence:
+    """
+    Ocurrencia virtual de una serie. Delega todos los atributos en la serie (incluidas
+    relaciones como tasks/reminders) salvo los desplazados o sobrescritos.
+    """
+
+    def __init__(self, series, recurrence_id: datetime, overrides: Dict):
+        self._series = series
+        self._overrides = overrides
+        self.recurrence_id = recurrence_id
+
+    def __getattr__(self, name):
+        overrides = self.__dict__.get("_overrides", {})
+        if name in overrides:
+            return overrides[name]
+        return getattr(self.__dict__["_series"], name)
+
+
+def _decode_changes(changes: Dict) -> Dict:
+    return {
+        key: datetime.fromisoformat(value) if key in _DATETIME_FIELDS and isinstance(value, str) else value
+        for key, value in (changes or {}).items()
+    }
+
+
+def load_overrides(session: Session, series_type: str, series_ids: Iterable[str]) -> Dict[str, Dict[datetime, RecurrenceOverride]]:
+    """Excepciones de las series indicadas, agrupadas por serie y recurrence_id."""
+    series_ids = list(series_ids)
+    grouped: Dict[str, Dict[datetime, RecurrenceOverride]] = {}
+    if not series_ids:
+        return grouped
+    rows = session.exec(
+        select(RecurrenceOverride).where(
+            RecurrenceOverride.series_type == series_type,
+            RecurrenceOverride.series_id.in_(series_ids),
+        )
+    ).all()
+    for row in rows:
+        grouped.setdefault(row.series_id, {})[row.recurrence_id] = row
+    return grouped
+
+
+def expand_events(series_list: Iterable[Event], overrides, start: datetime, end: datetime) -> List[Occurrence]:
+    """Ocurrencias de las series de eventos que se solapan con [start, end)."""
+    occurrences = []
+    for series in series_list:
+        duration = event_effective_end(series.start_at, series.end_at, series.all_day) - series.start_at
+        exceptions = overrides.get(series.id, {})
+        # Una ocurrencia que empezó antes de la ventana puede seguir activa en ella
+        starts = set(occurrence_starts(series.rrule, series.start_at, start - duration, end))
+        # Excepciones que mueven una ocurrencia de fuera hacia dentro de la ventana
+        # (su recurrence_id ya se validó al crearlas)
+        starts.update(rid for rid, exc in exceptions.items() if not exc.cancelled and "start_at" in exc.changes)
+        for occurrence_start in sorted(starts):
+            exception = exceptions.get(occurrence_start)
+            if exception and exception.cancelled:
+                continue
+            values = {
+                "start_at": occurrence_start,
+                "end_at": occurrence_start + (series.end_at - series.start_at) if series.end_at else None,
+            }
+            if exception:
+                values.update(_decode_changes(exception.changes))
+            effective_end = event_effective_end(values["start_at"], values["end_at"], values.get("all_day", series.all_day))
+            if values["start_at"] < end and effective_end >= start:
+                occurrences.append(Occurrence(series, occurrence_start, values))
+    occurrences.sort(key=lambda occurrence: occurrence.start_at)
+    return occurrences
+
+
+def expand_reminders(series_list: Iterable[Reminder], overrides, start: Optional[datetime], end: Optional[datetime]) -> List[Occurrence]:
+    """Disparos de las series de recordatorios dentro de [start, end]."""
+    occurrences = []
+    for series in series_list:
+        window_start = start or series.trigger_at
+        window_end = end or (series.recurrence_end + timedelta(microseconds=1) if series.recurrence_end else None)
+        if window_end is None:
+            # Serie infinita sin límite superior: no se puede expandir, se devuelve la serie
+            occurrences.append(series)
+            continue
+        exceptions = overrides.get(series.id, {})
+        starts = set(occurrence_starts(series.rrule, series.trigger_at, window_start, window_end + timedelta(microseconds=1)))
+        starts.update(rid for rid, exc in exceptions.items() if not exc.cancelled and "trigger_at" in exc.changes)
+        for trigger in sorted(starts):
+            exception = exceptions.get(trigger)
+            if exception and exception.cancelled:
+                continue
+            values = {"trigger_at": trigger}
+            if exception:
+                values.update(_decode_changes(exception.changes))
+            if window_start <= values["trigger_at"] <= window_end:
+                occurrences.append(Occurrence(series, trigger, values))
+    occurrences.sort(key=lambda occurrence: occurrence.trigger_at)
+    return occurrences
+
+
+def _is_occurrence(rule: str, dtstart: datetime, moment: datetime) -> bool:
+    return moment in occurrence_starts(rule, dtstart, moment, moment + timedelta(microseconds=1))
+
+
+def recurring_events_in_window(query, start: datetime, end: datetime):
+    """Restringe una consulta de Event a las series que pueden tener ocurrencias en [start, end)."""
+    return query.where(
+        Event.rrule.is_not(None),
+        Event.start_at < end,
+        or_(Event.recurrence_end.is_(None), Event.recurrence_end >= start),
+    )
+
+
+def events_in_window(session: Session, query, start: Optional[datetime], end: Optional[datetime]) -> List:
+    """
+    Eventos que se solapan con [start, end) a partir de una consulta base de Event
+    (con sus filtros y opciones de carga): eventos simples + ocurrencias de las series.
+    Sin límite superior las series infinitas no se pueden expandir y se devuelven tal cual.
+    """
+    single = where_overlaps(query.where(Event.rrule.is_(None)), session.get_bind().dialect.name, start, end)
+    events = filter_overlapping(session.exec(single.order_by(Event.start_at)).all(), start, end)
+
+    series = session.exec(recurring_events_in_window(query, start or datetime.min, end or datetime.max)).all()
+    if series and end is None:
+        events.extend(series)
+    elif series:
+        overrides = load_overrides(session, "event", [s.id for s in series])
+        window_start = start or min(s.start_at for s in series)
+        events.extend(expand_events(series, overrides, window_start, end))
+
+    events.sort(key=lambda event: event.start_at)
+    return events
+
+
+def reminders_in_window(session: Session, query, after: Optional[datetime], before: Optional[datetime]) -> List:
+    """
+    Recordatorios que saltan en [after, before] a partir de una consulta base de Reminder:
+    recordatorios simples + disparos de las series.
+    """
+    single = query.where(Reminder.rrule.is_(None))
+    recurring = query.where(Reminder.rrule.is_not(None))
+    if after is not None:
+        single = single.where(Reminder.trigger_at >= after)
+        recurring = recurring.where(or_(Reminder.recurrence_end.is_(None), Reminder.recurrence_end >= after))
+    if before is not None:
+        single = single.where(Reminder.trigger_at <= before)
+        recurring = recurring.where(Reminder.trigger_at <= before)
+
+    reminders = list(session.exec(single).all())
+    series = session.exec(recurring).all()
+    if series:
+        overrides = load_overrides(session, "reminder", [s.id for s in series])
+        reminders.extend(expand_reminders(series, overrides, after, before))
+
+    reminders.sort(key=lambda reminder: reminder.trigger_at)
+    return reminders
+
+
+def upsert_override(
+    session: Session,
+    series_type: str,
+    series,
+    recurrence_id: datetime,
+    cancelled: bool,
+    changes: Dict,
+) -> RecurrenceOverride:
+    """
+    Crea o reemplaza la excepción de una ocurrencia. El commit lo hace quien llama.
+
+    Raises:
+        ValueError: Si la entidad no es recurrente, la ocurrencia no existe o algún campo no es modificable
+    """
+    dtstart = series.start_at if series_type == "event" else series.trigger_at
+    if not series.rrule:
+        raise ValueError("Entity is not recurring")
+    if not _is_occurrence(series.rrule, dtstart, recurrence_id):
+        raise ValueError(f"No occurrence starts at {recurrence_id.isoformat()}")
+    invalid = set(changes) - OVERRIDABLE_FIELDS[series_type]
+    if invalid:
+        raise ValueError(f"Fields not overridable: {', '.join(sorted(invalid))}")
+
+    encoded = {}
+    for key, value in changes.items():
+        if key in _DATETIME_FIELDS and value is not None:
+            value = (value if isinstance(value, datetime) else datetime.fromisoformat(value)).isoformat()
+        encoded[key] = value
+    override = session.exec(
+        select(RecurrenceOverride).where(
+            RecurrenceOverride.series_type == series_type,
+            RecurrenceOverride.series_id == series.id,
+            RecurrenceOverride.recurrence_id == recurrence_id,
+        )
+    ).first()
+    if override is None:
+        override = RecurrenceOverride(series_type=series_type, series_id=series.id, recurrence_id=recurrence_id)
+    else:
+        override.version += 1
+        override.updated_at = datetime.utcnow()
+    override.cancelled = cancelled
+    override.changes = encoded
+    session.add(override)
+    return override
+
+
+def delete_overrides(session: Session, series_type: str, series_id: str) -> None:
+    """Borra las excepciones de una serie (al borrar la serie). El commit lo hace quien llama."""
+    session.exec(
+        delete(RecurrenceOverride).where(
+            RecurrenceOverride.series_type == series_type,
+            RecurrenceOverride.series_id == series_id,
+        )
+    )
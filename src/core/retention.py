@@ -0,0 +1,263 @@
+"""
+Motor de retención de conversaciones y mensajes.
+
+Un job en segundo plano aplica las políticas de cada cliente (RetentionPolicy):
+- Archiva las conversaciones activas sin actividad desde hace `archive_after_days`: pasan a
+  "archiving" y otro job (`compact_archiving`) lleva sus mensajes al almacenamiento frío
+  comprimido (ver src/core/archive.py) y las deja "archived". Igual con PATCH status=archived.
+- Marca para borrado ("deleting") las archivadas desde hace `purge_archived_after_days`.
+- Borra los mensajes de las conversaciones "deleting" en lotes de RETENTION_BATCH_SIZE,
+  cada uno en su propia transacción corta y con una pausa entre lotes, para no retener
+  locks sobre `message` ni competir con el tráfico normal.
+
+El estado vive en la base de datos (status = "deleting"), así que tras una caída el
+siguiente ciclo continúa donde se quedó. Es seguro ejecutarlo en varios workers a la vez.
+"""
+import os
+import time
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import and_, or_
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select, delete, update, func
+
+from src.core.activity import last_activity
+from src.core.archive import archive_conversation
+from src.core.database import get_engine
+from src.core.embeddings import delete_embeddings, delete_conversation_embeddings
+from src.core.models import ArchivedConversation, Conversation, Message, MessageChunk, RetentionPolicy, Tombstone
+
+RETENTION_INTERVAL = float(os.getenv("RETENTION_INTERVAL", "300"))
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "1000"))
+# Pausa entre lotes (segundos): deja respirar a la base de datos entre transacciones
+RETENTION_BATCH_PAUSE = float(os.getenv("RETENTION_BATCH_PAUSE", "0.1"))
+# Tope de lotes de mensajes por ciclo; el resto se borra en los ciclos siguientes
+RETENTION_MAX_BATCHES = int(os.getenv("RETENTION_MAX_BATCHES", "100"))
+# Intervalo del job que compacta las conversaciones pendientes de archivar
+ARCHIVE_COMPACTION_INTERVAL = float(os.getenv("ARCHIVE_COMPACTION_INTERVAL", "30"))
+
+ARCHIVING = "archiving"
+DELETING = "deleting"
+
+# Progreso de este worker (el estado persistente está en la base de datos)
+_progress_lock = threading.Lock()
+retention_progress: Dict = {
+    "last_run_started_at": None,
+    "last_run_finished_at": None,
+    "conversations_archived": 0,
+    "conversations_marked_for_deletion": 0,
+    "conversations_purged": 0,
+    "messages_deleted": 0,
+}
+
+
+def _add_progress(**counters) -> None:
+    with _progress_lock:
+        for key, value in counters.items():
+            retention_progress[key] += value
+
+
+def archive_inactive(client_id: str, cutoff: datetime) -> int:
+    """Marca para archivar las conversaciones activas del cliente sin actividad desde `cutoff`."""
+    with Session(get_engine()) as session:
+        ids = session.exec(
+            select(Conversation.id)
+            .where(
+                Conversation.client_id == client_id,
+                Conversation.status == "active",
+                Conversation.updated_at < cutoff,
+            )
+            .limit(RETENTION_BATCH_SIZE)
+        ).all()
+
+    archived = 0
+    for conversation_id in ids:
+        # Una transacción por conversación
+        with Session(get_engine()) as session:
+            conversation = session.get(Conversation, conversation_id)
+            if conversation is None or conversation.status != "active":
+                continue
+            # updated_at se vuelca en diferido: si un worker cayó antes de volcarlo, manda el último mensaje
+            latest = last_activity(session, conversation)
+            if latest >= cutoff:
+                conversation.updated_at = latest
+                session.add(conversation)
+                session.commit()
+                continue
+            # La compactación la hace el job de archivado, fuera de esta transacción
+            conversation.status = ARCHIVING
+            conversation.version += 1
+            session.add(conversation)
+            session.commit()
+        archived += 1
+    return archived
+
+
+def compact_archiving() -> int:
+    """
+    Job de archivado: compacta las conversaciones "archiving" (y las archivadas que aún no
+    tienen blob) y las deja "archived". Una transacción por conversación con su fila bloqueada:
+    un PATCH que la reactive a la vez espera al commit o la encuentra ya archivada.
+    """
+    with Session(get_engine()) as session:
+        ids = session.exec(
+            select(Conversation.id)
+            .where(or_(
+                Conversation.status == ARCHIVING,
+                and_(
+                    Conversation.status == "archived",
+                    Conversation.id.not_in(select(ArchivedConversation.conversation_id)),
+                ),
+            ))
+            .order_by(Conversation.id)
+            .limit(RETENTION_BATCH_SIZE)
+        ).all()
+
+    compacted = 0
+    for conversation_id in ids:
+        with Session(get_engine()) as session:
+            conversation = session.get(Conversation, conversation_id, with_for_update=True)
+            if conversation is None or conversation.status not in (ARCHIVING, "archived"):
+                continue  # Reactivada o borrada mientras tanto
+            archive_conversation(session, conversation)
+            if conversation.status == ARCHIVING:
+                conversation.status = "archived"
+                conversation.updated_at = datetime.utcnow()  # El plazo de purga cuenta desde aquí
+                conversation.version += 1
+                session.add(conversation)
+            try:
+                session.commit()
+            except IntegrityError:
+                session.rollback()  # Otro worker la compactó a la vez
+                continue
+        compacted += 1
+        time.sleep(RETENTION_BATCH_PAUSE)
+    return compacted
+
+
+def _transition_batch(client_id: str, from_status: str, to_status: str, cutoff: datetime) -> int:
+    """Cambia de estado un lote de conversaciones sin actividad desde `cutoff`."""
+    with Session(get_engine()) as session:
+        ids = session.exec(
+            select(Conversation.id)
+            .where(
+                Conversation.client_id == client_id,
+                Conversation.status == from_status,
+                Conversation.updated_at < cutoff,
+            )
+            .limit(RETENTION_BATCH_SIZE)
+        ).all()
+        if not ids:
+            return 0
+        # updated_at = ahora: el plazo de purga cuenta desde el archivado
+        session.exec(
+            update(Conversation)
+            .where(Conversation.id.in_(ids), Conversation.status == from_status)
+            .values(status=to_status, updated_at=datetime.utcnow(), version=Conversation.version + 1)
+        )
+        session.commit()
+        return len(ids)
+
+
+def apply_policies() -> None:
+    """Archiva y marca para borrado según la política de cada cliente."""
+    now = datetime.utcnow()
+    with Session(get_engine()) as session:
+        policies = session.exec(select(RetentionPolicy)).all()
+
+    for policy in policies:
+        if policy.archive_after_days is not None:
+            cutoff = now - timedelta(days=policy.archive_after_days)
+            while (count := archive_inactive(policy.id, cutoff)):
+                _add_progress(conversations_archived=count)
+        if policy.purge_archived_after_days is not None:
+            cutoff = now - timedelta(days=policy.purge_archived_after_days)
+            while (count := _transition_batch(policy.id, "archived", DELETING, cutoff)):
+                _add_progress(conversations_marked_for_deletion=count)
+                time.sleep(RETENTION_BATCH_PAUSE)
+
+
+def _delete_message_batch(conversation_id: int) -> int:
+    """Borra un lote de mensajes de la conversación en una transacción corta."""
+    with Session(get_engine()) as session:
+        ids = session.exec(
+            select(Message.id).where(Message.conversation_id == conversation_id).limit(RETENTION_BATCH_SIZE)
+        ).all()
+        if ids:
+            session.exec(delete(MessageChunk).where(MessageChunk.message_id.in_(ids)))
+            delete_embeddings(session, ids)
+            session.exec(delete(Message).where(Message.id.in_(ids)))
+            session.commit()
+        return len(ids)
+
+
+def _finish_conversation(conversation_id: int) -> bool:
+    """Borra la conversación ya vacía y deja su tombstone para /sync."""
+    with Session(get_engine()) as session:
+        conversation = session.get(Conversation, conversation_id)
+        if conversation is None or conversation.status != DELETING:
+            return False
+        session.exec(delete(ArchivedConversation).where(ArchivedConversation.conversation_id == conversation_id))
+        delete_conversation_embeddings(session, conversation_id)
+        # El DELETE condicional garantiza que sólo un worker deja el tombstone
+        result = session.exec(
+            delete(Conversation).where(Conversation.id == conversation_id, Conversation.status == DELETING)
+        )
+        if result.rowcount != 1:
+            session.rollback()
+            return False
+        session.add(Tombstone(
+            entity_type="conversation", entity_id=str(conversation_id), client_id=conversation.client_id
+        ))
+        try:
+            session.commit()
+        except IntegrityError:
+            # Llegó un mensaje entre el último lote y el borrado: se reintenta en el próximo ciclo
+            session.rollback()
+            return False
+        return True
+
+
+def purge_deleting(max_batches: int = RETENTION_MAX_BATCHES) -> None:
+    """Borra por lotes los mensajes de las conversaciones "deleting" y después la conversación."""
+    batches = 0
+    with Session(get_engine()) as session:
+        pending = session.exec(
+            select(Conversation.id).where(Conversation.status == DELETING).order_by(Conversation.id)
+        ).all()
+
+    for conversation_id in pending:
+        while batches < max_batches:
+            deleted = _delete_message_batch(conversation_id)
+            if deleted:
+                batches += 1
+                _add_progress(messages_deleted=deleted)
+                time.sleep(RETENTION_BATCH_PAUSE)
+            if deleted < RETENTION_BATCH_SIZE:
+                break
+        else:
+            return  # Tope de lotes alcanzado: el siguiente ciclo continúa
+        if _finish_conversation(conversation_id):
+            _add_progress(conversations_purged=1)
+
+
+def run_retention() -> None:
+    """Un ciclo completo del motor de retención (job periódico)."""
+    retention_progress["last_run_started_at"] = datetime.utcnow()
+    apply_policies()
+    purge_deleting()
+    retention_progress["last_run_finished_at"] = datetime.utcnow()
+
+
+def pending_deletions(session: Session, client_id: str) -> List[Dict]:
+    """Conversaciones del cliente con borrado en curso y los mensajes que les quedan."""
+    rows = session.exec(
+        select(Conversation.id, func.count(Message.id))
+        .outerjoin(Message, Message.conversation_id == Conversation.id)
+        .where(Conversation.client_id == client_id, Conversation.status == DELETING)
+        .group_by(Conversation.id)
+        .order_by(Conversation.id)
+    ).all()
+    return [{"conversation_id": conversation_id, "messages_remaining": count} for conversation_id, count in rows]
@@ -0,0 +1,418 @@
+"""
+Exportación e importación masiva de los datos de un cliente (GET /export, POST /import).
+
+Formato NDJSON: una línea por entidad, `{"type": "<tipo>", "data": {...}}`, con `data` en el
+mismo formato que la API. La primera línea es la cabecera (formato y versión) y la última el
+pie con el total de cada tipo, así que un fichero truncado se detecta al importarlo. Tareas,
+eventos y recordatorios son globales; conversaciones, mensajes (también los archivados) y
+trozos de borradores, sólo los del cliente. Los embeddings no se exportan.
+
+- Exportar: en Postgres con psycopg 3, cada tabla sale con `COPY (SELECT ... row_to_json ...)
+  TO STDOUT`: el servidor genera las líneas y se reenvían por bloques de 64KB, sin construir
+  un objeto por fila. Con otros drivers, lectura por lotes (yield_per). En Postgres todo va en
+  una transacción REPEATABLE READ: una instantánea coherente aunque haya escrituras a la vez.
+- Importar: todo o nada, en una sola transacción. Tareas, eventos, recordatorios y excepciones
+  de series son globales: conservan su id y los que ya existen se saltan (INSERT ... ON
+  CONFLICT DO NOTHING), así que importar varias exportaciones de la misma instancia no los
+  duplica. Lo del cliente se reasigna para no chocar con lo existente (tampoco al importar dos
+  veces el mismo fichero): los UUID de los mensajes con uuid5 sobre un espacio de nombres nuevo
+  en cada importación, así que los trozos se traducen sin tablas de correspondencias; las
+  conversaciones reciben un id nuevo. Mensajes y trozos se insertan por lotes de
+  TRANSFER_BATCH_SIZE, con `COPY ... FROM STDIN` en Postgres.
+"""
+import json
+import os
+import uuid
+import zlib
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+
+from sqlalchemy import DateTime, insert
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Connection
+from sqlmodel import Session, select
+
+from src.core.archive import load_archived_messages
+from src.core.database import get_engine
+from src.core.message_seq import advance_message_sequence
+from src.core.models import (
+    AIModel, ArchivedConversation, Conversation, Event, Message, MessageChunk, RecurrenceOverride, Reminder, Task,
+)
+from src.core.outbox import record_change
+from src.core.retention import ARCHIVING, DELETING
+from src.core.usage import add_usage, lock_watermark, usage_by_hour
+
+try:
+    import zstandard
+except ImportError:  # Dependencia opcional: sin ella sólo gzip
+    zstandard = None
+
+EXPORT_FORMAT = "jota-export"
+EXPORT_VERSION = 1
+# Filas por lote: lectura en la exportación e INSERT/COPY de mensajes en la importación
+TRANSFER_BATCH_SIZE = int(os.getenv("TRANSFER_BATCH_SIZE", "5000"))
+_STREAM_CHUNK = 64 * 1024
+# CSV con comillas y separador que row_to_json nunca emite (escapa los caracteres de control):
+# cada fila sale tal cual, sin comillas ni escapes añadidos
+_COPY_OPTIONS = "(FORMAT csv, QUOTE E'\\x01', DELIMITER E'\\x02')"
+
+# Entidades globales (no son de ningún cliente): se importan con su id, sin duplicar las que ya existen
+_GLOBAL_ENTITIES = {
+    "event": Event,
+    "task": Task,
+    "reminder": Reminder,
+    "recurrence_override": RecurrenceOverride,
+}
+_OUTBOX_TYPES = ("task", "event", "reminder")
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def _line(entity_type: str, data: dict) -> bytes:
+    record = {"type": entity_type, "data": data}
+    return (json.dumps(record, separators=(",", ":"), default=_json_default) + "\n").encode()
+
+
+# --- Exportación ---
+
+def _export_sections(client_id: str) -> list:
+    """(tipo, consulta, columnas de orden) de cada tabla, en orden de dependencias."""
+    conversations = (Conversation.client_id == client_id, Conversation.status != DELETING)
+    conversation_ids = select(Conversation.id).where(*conversations)
+    message_ids = select(Message.id).where(Message.conversation_id.in_(conversation_ids))
+    return [
+        ("event", Event.__table__.select(), ("id",)),
+        ("task", Task.__table__.select(), ("id",)),
+        ("reminder", Reminder.__table__.select(), ("id",)),
+        ("recurrence_override", RecurrenceOverride.__table__.select(), ("id",)),
+        ("conversation", Conversation.__table__.select().where(*conversations), ("id",)),
+        ("message", Message.__table__.select().where(Message.conversation_id.in_(conversation_ids)),
+         ("conversation_id", "seq")),
+        ("message_chunk", MessageChunk.__table__.select().where(MessageChunk.message_id.in_(message_ids)), ("id",)),
+    ]
+
+
+def _copy_lines(connection: Connection, entity_type: str, query, order: tuple) -> Iterator[bytes]:
+    """Postgres + psycopg 3: las líneas NDJSON las genera el servidor y llegan por COPY."""
+    inner = query.compile(dialect=connection.dialect, compile_kwargs={"literal_binds": True})
+    order_by = ", ".join(f"t.{column}" for column in order)
+    sql = (
+        f"""COPY (SELECT '{{"type":"{entity_type}","data":' || row_to_json(t)::text || '}}' """
+        f"FROM ({inner}) t ORDER BY {order_by}) TO STDOUT {_COPY_OPTIONS}"
+    )
+    with connection.connection.driver_connection.cursor() as cursor:
+        with cursor.copy(sql) as copy:
+            for data in copy:
+                yield bytes(data)
+
+
+def _select_lines(connection: Connection, entity_type: str, query, order: tuple) -> Iterator[bytes]:
+    query = query.order_by(*(query.selected_columns[column] for column in order))
+    result = connection.execution_options(yield_per=TRANSFER_BATCH_SIZE).execute(query)
+    for row in result.mappings():
+        yield _line(entity_type, dict(row))
+
+
+def _archived_lines(session: Session, client_id: str) -> Iterator[bytes]:
+    """Mensajes de las conversaciones archivadas, sacados de su blob (un blob en memoria a la vez)."""
+    blob_ids = session.exec(
+        select(ArchivedConversation.id)
+        .join(Conversation, Conversation.id == ArchivedConversation.conversation_id)
+        .where(Conversation.client_id == client_id, Conversation.status != DELETING)
+        .order_by(ArchivedConversation.conversation_id)
+    ).all()
+    for blob_id in blob_ids:
+        blob = session.get(ArchivedConversation, blob_id)
+        for row in load_archived_messages(blob):
+            yield _line("message", row)
+        session.expunge(blob)
+
+
+def export_client(client_id: str) -> Iterator[bytes]:
+    """Todos los datos del cliente en NDJSON, por bloques de ~64KB. Abre su propia sesión."""
+    counts: Dict[str, int] = {}
+    buffer = bytearray()
+    with Session(get_engine()) as session:
+        postgres = session.get_bind().dialect.name == "postgresql"
+        connection = session.connection(execution_options={"isolation_level": "REPEATABLE READ"} if postgres else None)
+        read_lines = _copy_lines if connection.dialect.driver == "psycopg" else _select_lines
+
+        buffer += _line("header", {
+            "format": EXPORT_FORMAT,
+            "version": EXPORT_VERSION,
+            "client_id": client_id,
+            "exported_at": datetime.utcnow(),
+        })
+        for entity_type, query, order in _export_sections(client_id):
+            sections = [read_lines(connection, entity_type, query, order)]
+            if entity_type == "message":
+                sections.append(_archived_lines(session, client_id))
+            counts[entity_type] = 0
+            for lines in sections:
+                for data in lines:
+                    counts[entity_type] += data.count(b"\n")
+                    buffer += data
+                    if len(buffer) >= _STREAM_CHUNK:
+                        yield bytes(buffer)
+                        buffer.clear()
+        buffer += _line("footer", {"counts": counts})
+        yield bytes(buffer)
+
+
+def compress_stream(chunks: Iterator[bytes], codec: str) -> Iterator[bytes]:
+    """Comprime al vuelo la exportación (zstd o gzip)."""
+    if codec == "zstd":
+        compressor = zstandard.ZstdCompressor(level=3).compressobj()
+    else:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        if data := compressor.compress(chunk):
+            yield data
+    yield compressor.flush()
+
+
+# --- Importación ---
+
+class LineDecoder:
+    """
+    Bytes recibidos -> líneas NDJSON completas. Detecta por los primeros bytes si el cuerpo
+    viene comprimido con zstd o gzip y lo descomprime en streaming.
+    """
+
+    def __init__(self):
+        self._head = b""
+        self._decompressor = None
+        self._started = False
+        self._partial = b""
+
+    def _start(self, head: bytes) -> None:
+        self._started = True
+        if head.startswith(b"\x28\xb5\x2f\xfd"):
+            if zstandard is None:
+                raise ValueError("zstd-compressed import but zstandard is not installed")
+            self._decompressor = zstandard.ZstdDecompressor().decompressobj()
+        elif head.startswith(b"\x1f\x8b"):
+            self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def feed(self, data: bytes) -> List[bytes]:
+        if not self._started:
+            self._head += data
+            if len(self._head) < 4:
+                return []
+            data, self._head = self._head, b""
+            self._start(data)
+        if self._decompressor is not None and data:
+            try:
+                data = self._decompressor.decompress(data)
+            except zlib.error as e:
+                raise ValueError(f"invalid gzip data: {e}") from e
+            except Exception as e:  # zstandard.ZstdError
+                raise ValueError(f"invalid zstd data: {e}") from e
+        lines = (self._partial + data).split(b"\n")
+        self._partial = lines.pop()
+        return lines
+
+    def close(self) -> List[bytes]:
+        lines = self.feed(b"") if self._started else []
+        if not self._started and self._head:
+            self._start(self._head)
+            lines = self.feed(self._head)
+        tail, self._partial = self._partial, b""
+        return lines + [tail] if tail.strip() else lines
+
+
+def _datetime_columns(table) -> tuple:
+    return tuple(column.name for column in table.columns if isinstance(column.type, DateTime))
+
+
+_MESSAGE_DATETIMES = _datetime_columns(Message.__table__)
+_CHUNK_DATETIMES = _datetime_columns(MessageChunk.__table__)
+
+
+def _parse_datetimes(row: dict, columns: tuple) -> dict:
+    for column in columns:
+        if isinstance(row.get(column), str):
+            row[column] = datetime.fromisoformat(row[column])
+    return row
+
+
+def _bulk_insert(connection: Connection, table, rows: List[dict]) -> None:
+    """Postgres + psycopg 3: COPY FROM STDIN. En el resto, un INSERT con executemany."""
+    columns = list(rows[0])
+    if connection.dialect.driver == "psycopg":
+        sql = f"COPY {table.name} ({', '.join(columns)}) FROM STDIN"
+        with connection.connection.driver_connection.cursor() as cursor:
+            with cursor.copy(sql) as copy:
+                for row in rows:
+                    copy.write_row([row[column] for column in columns])
+    else:
+        connection.execute(insert(table), rows)
+
+
+def _insert_if_missing(connection: Connection, table, row: dict) -> bool:
+    """INSERT ... ON CONFLICT DO NOTHING. False si la fila ya existía."""
+    dialect = postgresql if connection.dialect.name == "postgresql" else sqlite
+    statement = dialect.insert(table).values(row).on_conflict_do_nothing().returning(table.c.id)
+    return connection.execute(statement).first() is not None
+
+
+class ClientImport:
+    """
+    Importación en curso. Las líneas llegan por lotes (`feed`) según se reciben y se aplican
+    en una única transacción que confirma `finish`; cualquier error la deshace entera.
+    Los errores de contenido son ValueError("line N: ...").
+    """
+
+    def __init__(self, client_id: str):
+        self.client_id = client_id
+        self.session = Session(get_engine())
+        self.namespace = uuid.uuid4()
+        self.conversation_ids: Dict[int, int] = {}
+        self.counts: Dict[str, int] = {}
+        self.skipped: Dict[str, int] = {}
+        self.header: Optional[dict] = None
+        self.footer: Optional[dict] = None
+        self.line_number = 0
+        self._archived: List[Conversation] = []
+        self._messages: List[dict] = []
+        self._chunks: List[dict] = []
+        self._last_seq: Dict[int, int] = {}
+        self._models = set(self.session.exec(select(AIModel.id)).all())
+
+    def _remap(self, old_id: Optional[str]) -> Optional[str]:
+        return str(uuid.uuid5(self.namespace, old_id)) if old_id else None
+
+    def _model(self, ai_model_id: Optional[str]) -> Optional[str]:
+        """Los modelos de IA son de la instancia: si no existe aquí, la referencia se pierde."""
+        return ai_model_id if ai_model_id in self._models else None
+
+    def _conversation(self, old_id) -> int:
+        try:
+            return self.conversation_ids[old_id]
+        except KeyError:
+            raise ValueError(f"unknown conversation {old_id}") from None
+
+    def feed(self, lines: List[bytes]) -> None:
+        for raw in lines:
+            self.line_number += 1
+            if not raw.strip():
+                continue
+            try:
+                record = json.loads(raw)
+                self._apply(record["type"], record["data"])
+            except (ValueError, KeyError, TypeError) as e:
+                detail = f"missing field {e}" if isinstance(e, KeyError) else str(e)
+                raise ValueError(f"line {self.line_number}: {detail}") from e
+
+    def _apply(self, entity_type: str, data: dict) -> None:
+        if self.header is None:
+            if entity_type != "header" or data.get("format") != EXPORT_FORMAT:
+                raise ValueError("not an export file (missing header)")
+            if data.get("version") != EXPORT_VERSION:
+                raise ValueError(f"unsupported export version {data.get('version')}")
+            self.header = data
+            return
+        if self.footer is not None:
+            raise ValueError("data after the footer")
+        if entity_type == "footer":
+            self.footer = data
+            return
+
+        if entity_type in _GLOBAL_ENTITIES:
+            model = _GLOBAL_ENTITIES[entity_type]
+            entity = model.model_validate(data)
+            if not _insert_if_missing(self.session.connection(), model.__table__, entity.model_dump()):
+                self.skipped[entity_type] = self.skipped.get(entity_type, 0) + 1
+            elif entity_type in _OUTBOX_TYPES:
+                record_change(self.session, entity_type, entity, "insert")
+        elif entity_type == "conversation":
+            old_id = data.pop("id")
+            archived = data.get("status") in ("archived", ARCHIVING)
+            # Se crea activa con sus mensajes en la tabla caliente y al final pasa a "archiving"
+            data.update(client_id=self.client_id, status="active", ai_model_id=self._model(data.get("ai_model_id")))
+            conversation = Conversation.model_validate(data)
+            self.session.add(conversation)
+            self.session.flush()
+            self.conversation_ids[old_id] = conversation.id
+            if archived:
+                self._archived.append(conversation)
+        elif entity_type == "message":
+            conversation_id = self._conversation(data["conversation_id"])
+            # Blobs archivados anteriores a Message.seq: se numeran en el orden del fichero
+            seq = data.get("seq") or self._last_seq.get(conversation_id, 0) + 1
+            self._last_seq[conversation_id] = max(self._last_seq.get(conversation_id, 0), seq)
+            self._messages.append(_parse_datetimes({
+                "id": self._remap(data["id"]),
+                "created_at": data["created_at"],
+                "updated_at": data.get("updated_at") or data["created_at"],
+                "version": data.get("version") or 1,
+                "content": data["content"],
+                "role": data["role"],
+                "conversation_id": conversation_id,
+                "seq": seq,
+                "ai_model_id": self._model(data.get("ai_model_id")),
+                "status": data.get("status") or "final",
+            }, _MESSAGE_DATETIMES))
+        elif entity_type == "message_chunk":
+            self._chunks.append(_parse_datetimes({
+                "created_at": data["created_at"],
+                "updated_at": data.get("updated_at") or data["created_at"],
+                "version": data.get("version") or 1,
+                "message_id": self._remap(data["message_id"]),
+                "content": data["content"],
+            }, _CHUNK_DATETIMES))
+        else:
+            raise ValueError(f"unknown type {entity_type!r}")
+
+        self.counts[entity_type] = self.counts.get(entity_type, 0) + 1
+        if len(self._messages) + len(self._chunks) >= TRANSFER_BATCH_SIZE:
+            self._flush()
+
+    def _flush(self) -> None:
+        """Inserta los mensajes y trozos pendientes (en ese orden: los trozos apuntan a mensajes)."""
+        if not self._messages and not self._chunks:
+            return
+        self.session.flush()  # Conversaciones antes que sus mensajes
+        connection = self.session.connection()
+        for table, rows in ((Message.__table__, self._messages), (MessageChunk.__table__, self._chunks)):
+            if rows:
+                _bulk_insert(connection, table, rows)
+                rows.clear()
+
+    def finish(self) -> Dict[str, int]:
+        """
+        Comprueba el pie, vuelve a archivar lo que venía archivado y confirma. Devuelve los
+        totales importados (sin las entidades globales que ya existían, ver `skipped`).
+        """
+        if self.header is None:
+            raise ValueError("empty import")
+        if self.footer is None:
+            raise ValueError(f"truncated export: missing footer after line {self.line_number}")
+        expected = {entity_type: count for entity_type, count in self.footer.get("counts", {}).items() if count}
+        if expected != self.counts:
+            raise ValueError(f"imported counts {self.counts} do not match the footer {expected}")
+        self._flush()
+        connection = self.session.connection()
+        if self._last_seq and connection.dialect.name == "postgresql":
+            # Los seq vienen del fichero: la secuencia debe quedar por encima
+            advance_message_sequence(connection, at_least=max(self._last_seq.values()))
+        if self.conversation_ids:
+            # Lo anterior a la marca de agua ya no lo agregará el job de uso: se suma aquí
+            watermark = lock_watermark(self.session)
+            add_usage(self.session, usage_by_hour(
+                self.session, datetime.min, watermark.aggregated_until, self.conversation_ids.values()
+            ))
+        for conversation in self._archived:
+            # El job de archivado la compacta después, fuera de esta transacción
+            conversation.status = ARCHIVING
+            self.session.add(conversation)
+        self.session.commit()
+        imported = {entity_type: count - self.skipped.get(entity_type, 0) for entity_type, count in self.counts.items()}
+        return {entity_type: count for entity_type, count in imported.items() if count}
+
+    def close(self) -> None:
+        self.session.close()
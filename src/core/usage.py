@@ -0,0 +1,196 @@
+"""
+Uso agregado por cliente y modelo de IA: mensajes y caracteres por hora, día y mes (UsageRollup).
+
+Antes, "mensajes por modelo y día" era un full scan de `message` agrupado por ai_model_id.
+Ahora un job periódico agrega los mensajes nuevos de forma incremental, fuera del camino de
+escritura (sin contadores calientes que serialicen los INSERT de mensajes):
+- Marca de agua (UsageWatermark): cada pasada agrupa por hora los mensajes con created_at en
+  [marca, ahora - USAGE_SAFETY_MARGIN_SECONDS), con un rango sobre ix_message_created_at; suma
+  el resultado a las filas de hora, día y mes, y avanza la marca, en la misma transacción.
+  El margen cubre las escrituras que aún no han hecho commit (group commit, pool saturado).
+- La marca no pasa de un borrador en curso: su texto completo sólo existe al finalizarlo.
+  Un borrador abandonado deja de retenerla tras USAGE_DRAFT_GRACE_SECONDS y cuenta lo que tenga.
+- Varios workers: la fila de la marca se bloquea antes de leerla y sólo quien la tiene escribe
+  en UsageRollup, así que nada se cuenta dos veces.
+- Los mensajes que después se archivan o se borran siguen contando: es historial de uso.
+"""
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import bindparam, insert, update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select, func
+
+from src.core.database import get_engine
+from src.core.models import Conversation, Message, UsageRollup, UsageWatermark
+
+USAGE_ROLLUP_INTERVAL = float(os.getenv("USAGE_ROLLUP_INTERVAL", "60"))
+USAGE_SAFETY_MARGIN_SECONDS = float(os.getenv("USAGE_SAFETY_MARGIN_SECONDS", "30"))
+USAGE_DRAFT_GRACE_SECONDS = float(os.getenv("USAGE_DRAFT_GRACE_SECONDS", "3600"))
+# Tramo máximo de created_at por transacción (al ponerse al día con el histórico)
+USAGE_MAX_WINDOW_HOURS = float(os.getenv("USAGE_MAX_WINDOW_HOURS", "24"))
+
+GRANULARITIES = ("hour", "day", "month")
+_WATERMARK_ID = "message"
+_EPOCH = datetime(1970, 1, 1)
+
+# {(client_id, ai_model_id, hora): (mensajes, caracteres)}
+HourlyUsage = Dict[Tuple[str, Optional[str], datetime], Tuple[int, int]]
+
+
+def truncate(at: datetime, granularity: str) -> datetime:
+    """Inicio del periodo (UTC) que contiene `at`."""
+    at = at.replace(minute=0, second=0, microsecond=0)
+    if granularity in ("day", "month"):
+        at = at.replace(hour=0)
+    if granularity == "month":
+        at = at.replace(day=1)
+    return at
+
+
+def _hour(dialect_name: str):
+    if dialect_name == "postgresql":
+        return func.date_trunc("hour", Message.created_at)
+    return func.strftime("%Y-%m-%d %H:00:00", Message.created_at)
+
+
+def usage_by_hour(
+    session: Session, start: datetime, end: datetime, conversation_ids: Optional[Iterable[int]] = None
+) -> HourlyUsage:
+    """Uso de los mensajes con created_at en [start, end), agrupado en la base de datos."""
+    hour = _hour(session.get_bind().dialect.name).label("hour")
+    query = (
+        select(Conversation.client_id, Message.ai_model_id, hour, func.count(), func.sum(func.length(Message.content)))
+        .join(Conversation, Conversation.id == Message.conversation_id)
+        .where(Message.created_at >= start, Message.created_at < end)
+        .group_by(Conversation.client_id, Message.ai_model_id, hour)
+    )
+    if conversation_ids is not None:
+        query = query.where(Message.conversation_id.in_(list(conversation_ids)))
+    usage: HourlyUsage = {}
+    for client_id, ai_model_id, bucket, messages, characters in session.exec(query):
+        if isinstance(bucket, str):  # SQLite
+            bucket = datetime.fromisoformat(bucket)
+        usage[(client_id, ai_model_id, bucket)] = (messages, characters or 0)
+    return usage
+
+
+def lock_watermark(session: Session) -> UsageWatermark:
+    """
+    Fila de la marca de agua, bloqueada hasta el fin de la transacción. En la primera pasada se
+    crea en 1970: el histórico se agrega por tramos. Si otro worker la crea a la vez, IntegrityError.
+    """
+    # UPDATE sin cambios: bloquea la fila en Postgres y, en SQLite, abre ya la transacción de
+    # escritura (BEGIN IMMEDIATE); un SELECT ... FOR UPDATE no haría lo segundo
+    session.exec(
+        update(UsageWatermark)
+        .where(UsageWatermark.id == _WATERMARK_ID)
+        .values(aggregated_until=UsageWatermark.aggregated_until)
+    )
+    watermark = session.get(UsageWatermark, _WATERMARK_ID, populate_existing=True)
+    if watermark is None:
+        watermark = UsageWatermark(id=_WATERMARK_ID, aggregated_until=_EPOCH)
+        session.add(watermark)
+        session.flush()
+    return watermark
+
+
+def aggregated_until(session: Session) -> Optional[datetime]:
+    """Marca de agua actual: los mensajes con created_at posterior aún no cuentan."""
+    watermark = session.get(UsageWatermark, _WATERMARK_ID)
+    return watermark.aggregated_until if watermark else None
+
+
+def add_usage(session: Session, usage: HourlyUsage) -> None:
+    """
+    Suma uso por hora a las filas de hora, día y mes. Sólo con la marca de agua bloqueada
+    (lock_watermark): nadie más escribe en UsageRollup a la vez. Sin commit.
+    """
+    totals: Dict[tuple, list] = defaultdict(lambda: [0, 0])
+    for (client_id, ai_model_id, hour), (messages, characters) in usage.items():
+        for granularity in GRANULARITIES:
+            total = totals[(granularity, client_id, truncate(hour, granularity), ai_model_id or "")]
+            total[0] += messages
+            total[1] += characters
+    if not totals:
+        return
+
+    existing = set(session.exec(
+        select(UsageRollup.granularity, UsageRollup.client_id, UsageRollup.bucket_start, UsageRollup.ai_model_id)
+        .where(UsageRollup.bucket_start.in_({key[2] for key in totals}))
+    ).all())
+    updates, inserts = [], []
+    for key, (messages, characters) in totals.items():
+        granularity, client_id, bucket_start, ai_model_id = key
+        if key in existing:
+            updates.append({
+                "b_granularity": granularity, "b_client_id": client_id, "b_bucket_start": bucket_start,
+                "b_ai_model_id": ai_model_id, "b_messages": messages, "b_characters": characters,
+            })
+        else:
+            inserts.append({
+                "granularity": granularity, "client_id": client_id, "bucket_start": bucket_start,
+                "ai_model_id": ai_model_id, "messages": messages, "characters": characters,
+            })
+
+    connection = session.connection()
+    if updates:
+        connection.execute(
+            update(UsageRollup.__table__)
+            .where(
+                UsageRollup.granularity == bindparam("b_granularity"),
+                UsageRollup.client_id == bindparam("b_client_id"),
+                UsageRollup.bucket_start == bindparam("b_bucket_start"),
+                UsageRollup.ai_model_id == bindparam("b_ai_model_id"),
+            )
+            .values(
+                messages=UsageRollup.messages + bindparam("b_messages"),
+                characters=UsageRollup.characters + bindparam("b_characters"),
+            ),
+            updates,
+        )
+    if inserts:
+        connection.execute(insert(UsageRollup.__table__), inserts)
+
+
+def _aggregation_limit(session: Session, start: datetime) -> datetime:
+    """Hasta dónde se puede agregar ya: margen de seguridad y borradores en curso."""
+    now = datetime.utcnow()
+    limit = now - timedelta(seconds=USAGE_SAFETY_MARGIN_SECONDS)
+    oldest_draft = session.exec(
+        select(func.min(Message.created_at)).where(
+            Message.created_at >= max(start, now - timedelta(seconds=USAGE_DRAFT_GRACE_SECONDS)),
+            Message.status == "draft",
+        )
+    ).one()
+    return min(limit, oldest_draft) if oldest_draft else limit
+
+
+def aggregate_usage() -> int:
+    """Job periódico: agrega los mensajes nuevos desde la marca de agua. Devuelve cuántos contó."""
+    counted = 0
+    while True:
+        with Session(get_engine()) as session:
+            try:
+                watermark = lock_watermark(session)
+            except IntegrityError:
+                return counted  # Otro worker acaba de crear la marca: se sigue en la siguiente pasada
+            start = watermark.aggregated_until
+            limit = _aggregation_limit(session, start)
+            if limit <= start:
+                return counted
+            # Los huecos sin mensajes (el histórico en la primera pasada) se saltan de una vez
+            first = session.exec(
+                select(func.min(Message.created_at)).where(Message.created_at >= start, Message.created_at < limit)
+            ).one()
+            end = min(limit, first + timedelta(hours=USAGE_MAX_WINDOW_HOURS)) if first else limit
+            usage = usage_by_hour(session, start, end)
+            add_usage(session, usage)
+            watermark.aggregated_until = end
+            session.add(watermark)
+            session.commit()
+            counted += sum(messages for messages, _ in usage.values())
+            if end >= limit:
+                return counted
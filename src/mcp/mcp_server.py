@@ -0,0 +1,622 @@
+"""
+Cerebro Digital - Servidor MCP
+
+Expone tareas, eventos, recordatorios y chat como herramientas MCP para los agentes de IA,
+con acceso directo a la base de datos (mismos modelos de src/core) en lugar de pasar por la
+API HTTP: sin salto de red, sin codificar JSON dos veces y sin autenticar cada llamada.
+
+- Transportes: stdio (por defecto) o SSE (MCP_TRANSPORT=sse, puerto MCP_PORT).
+  Por SSE se exige `Authorization: Bearer <API_SECRET_KEY>`, como en la API.
+- Pool: el engine de src/core/database.py, dimensionado con DB_MAX_CONNECTIONS de ESTE
+  servicio; el threadpool de las herramientas se alinea con él (como en la API).
+- `batch`: varias operaciones en UNA transacción (todo o nada). Un argumento "$N.campo"
+  se sustituye por ese campo del resultado de la operación N (ej. el id recién creado).
+- Caché de lecturas por sesión MCP durante un turno del agente (MCP_READ_CACHE_TTL):
+  repetir una lectura no vuelve a la base de datos. Cualquier escritura desde este
+  servidor la vacía; los cambios hechos por la API se ven, como mucho, un TTL tarde.
+
+    python src/mcp/mcp_server.py                      # stdio
+    MCP_TRANSPORT=sse python src/mcp/mcp_server.py    # SSE en http://0.0.0.0:8001/sse
+"""
+import contextlib
+import inspect
+import os
+import sys
+import itertools
+import threading
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import anyio.to_thread
+from fastapi import HTTPException
+from mcp.server.mcpserver import Context, MCPServer
+from mcp.server.mcpserver.exceptions import ToolError
+from mcp_types import ToolAnnotations
+from pydantic import BaseModel, ConfigDict, ValidationError, validate_call
+from pydantic_core import to_jsonable_python
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+from src.core.activity import activity_tracker, flush_activity, CONVERSATION_ACTIVITY_FLUSH_SECONDS  # noqa: E402
+from src.core.archive import get_archive, load_archived_messages  # noqa: E402
+from src.core.database import init_db, get_engine, connections_per_worker  # noqa: E402
+from src.core.drafts import with_draft_content  # noqa: E402
+from src.core.jobs import start_periodic_job, stop_jobs  # noqa: E402
+from src.core.models import Conversation, Event, Message, Reminder, Task  # noqa: E402
+from src.core.outbox import record_change  # noqa: E402
+from src.core.recurrence import (  # noqa: E402
+    Occurrence, delete_overrides, events_in_window, refresh_recurrence_end, reminders_in_window
+)
+from src.core.retention import ARCHIVING, DELETING  # noqa: E402
+from src.api.utils import apply_optimistic_locking, update_entity_fields, increment_version, record_tombstone  # noqa: E402
+
+MCP_TRANSPORT = os.getenv("MCP_TRANSPORT", "stdio").lower()  # stdio | sse
+MCP_HOST = os.getenv("MCP_HOST", "0.0.0.0")
+MCP_PORT = int(os.getenv("MCP_PORT", "8001"))
+# Cliente por defecto de las herramientas de chat (id de Client); cada llamada puede indicar otro
+MCP_CLIENT_ID = os.getenv("MCP_CLIENT_ID")
+MCP_READ_CACHE_TTL = float(os.getenv("MCP_READ_CACHE_TTL", "10"))  # Segundos; 0 = sin caché
+MCP_READ_CACHE_SIZE = int(os.getenv("MCP_READ_CACHE_SIZE", "256"))  # Lecturas por sesión MCP
+MESSAGE_ROLES = ("user", "assistant", "system", "tool")
+
+
+# --- CACHÉ DE LECTURAS POR TURNO ---
+# Cada escritura hecha desde este servidor avanza la generación e invalida todas las cachés
+_write_generation = itertools.count(1)
+_current_generation = next(_write_generation)
+
+
+def invalidate_reads() -> None:
+    global _current_generation
+    _current_generation = next(_write_generation)
+
+
+class TurnReadCache:
+    """
+    Resultados de las herramientas de lectura de UNA conexión MCP (un agente), por argumentos.
+    Caducan a los `ttl` segundos (un turno del agente) y con cualquier escritura.
+    """
+
+    def __init__(self, ttl: float = MCP_READ_CACHE_TTL, max_entries: int = MCP_READ_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: Dict[Tuple, Tuple[int, float, Any]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Tuple):
+        if self.ttl <= 0:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != _current_generation or entry[1] < time.monotonic():
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[2]
+
+    def put(self, key: Tuple, value, generation: int) -> None:
+        """`generation`: la vigente ANTES de leer (si hubo una escritura mientras tanto, no se guarda)."""
+        if self.ttl <= 0 or generation != _current_generation:
+            return
+        with self._lock:
+            if key not in self._entries and len(self._entries) >= self.max_entries:
+                self._entries.pop(next(iter(self._entries)))  # La más antigua
+            self._entries[key] = (generation, time.monotonic() + self.ttl, value)
+
+
+def _connection_cache(ctx: Optional[Context]) -> Optional[TurnReadCache]:
+    """La caché vive en el contexto de lifespan, que el SDK crea por conexión."""
+    return ctx.request_context.lifespan_context.get("read_cache") if ctx is not None else None
+
+
+def _cache_key(name: str, arguments: Dict) -> Tuple:
+    return (name, repr(sorted(to_jsonable_python(arguments).items())))
+
+
+# --- REGISTRO DE OPERACIONES ---
+# nombre -> (función validada, sólo lectura). Cada operación recibe la sesión y NO hace commit:
+# lo hace quien la ejecuta (una herramienta suelta o `batch`), así se pueden componer.
+OPERATIONS: Dict[str, Tuple[Callable[..., Any], bool]] = {}
+
+
+@asynccontextmanager
+async def _lifespan(app: MCPServer):
+    # Las herramientas síncronas corren en el threadpool de anyio: como mucho un hilo por conexión
+    anyio.to_thread.current_default_thread_limiter().total_tokens = connections_per_worker()
+    yield {"read_cache": TurnReadCache()}
+
+
+server = MCPServer(
+    "cerebro-digital",
+    instructions=(
+        "Tareas, eventos, recordatorios y conversaciones de Cerebro Digital. "
+        "Usa `batch` para aplicar varios cambios relacionados en una sola transacción."
+    ),
+    lifespan=_lifespan,
+)
+
+
+def _tool_error(e: Exception) -> ToolError:
+    if isinstance(e, HTTPException):
+        return ToolError(f"{e.status_code}: {e.detail}")
+    if isinstance(e, ValidationError):
+        return ToolError(f"Invalid arguments: {e.errors(include_url=False, include_context=False)}")
+    if isinstance(e, IntegrityError):
+        return ToolError(f"Integrity error: {e.orig}")
+    return e if isinstance(e, ToolError) else ToolError(str(e))
+
+
+def _after_commit(session: Session, callback: Callable[[], None]) -> None:
+    """Acción a ejecutar sólo si la transacción se confirma (ej. anotar actividad)."""
+    session.info.setdefault("after_commit", []).append(callback)
+
+
+def _commit(session: Session) -> None:
+    session.commit()
+    for callback in session.info.pop("after_commit", []):
+        callback()
+    # Los datos han cambiado: ninguna lectura cacheada es fiable
+    invalidate_reads()
+
+
+def _call(ctx: Optional[Context], name: str, arguments: Dict) -> Any:
+    """Ejecuta una operación suelta en su propia transacción (o desde la caché del turno)."""
+    fn, read_only = OPERATIONS[name]
+    cache = _connection_cache(ctx) if read_only else None
+    generation = _current_generation
+    if cache is not None:
+        key = _cache_key(name, arguments)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+    try:
+        with Session(get_engine()) as session:
+            result = fn(session, **arguments)
+            if not read_only:
+                _commit(session)
+    except Exception as e:
+        raise _tool_error(e) from e
+    if cache is not None:
+        cache.put(key, result, generation)
+    return result
+
+
+def operation(read_only: bool = False):
+    """Registra una operación y la publica como herramienta MCP (sin el parámetro `session`)."""
+
+    def decorator(fn):
+        name = fn.__name__
+        validated = validate_call(fn, config=ConfigDict(arbitrary_types_allowed=True))
+        OPERATIONS[name] = (validated, read_only)
+
+        signature = inspect.signature(fn)
+        parameters = [p for p in signature.parameters.values() if p.name != "session"]
+        parameters.append(inspect.Parameter("ctx", inspect.Parameter.KEYWORD_ONLY, annotation=Context))
+
+        def tool(ctx: Context, **arguments):
+            return _call(ctx, name, arguments)
+
+        tool.__name__ = name
+        tool.__doc__ = fn.__doc__
+        tool.__signature__ = signature.replace(parameters=parameters)
+        tool.__annotations__ = {
+            **{p.name: p.annotation for p in parameters},
+            "return": signature.return_annotation,
+        }
+        server.add_tool(tool, name=name, annotations=ToolAnnotations(readOnlyHint=read_only))
+        return fn
+
+    return decorator
+
+
+def _dump(entity) -> dict:
+    """Entidad (u ocurrencia expandida de una serie) como JSON."""
+    if isinstance(entity, Occurrence):
+        series = entity.__dict__["_series"]
+        data = {name: getattr(entity, name) for name in type(series).model_fields}
+        data["recurrence_id"] = entity.recurrence_id
+    else:
+        data = entity.model_dump()
+    return to_jsonable_python(data)
+
+
+def _get(session: Session, model, entity_id: str, label: str):
+    entity = session.get(model, entity_id)
+    if not entity:
+        raise ToolError(f"404: {label} not found")
+    return entity
+
+
+def _create(session: Session, entity_type: str, entity) -> dict:
+    session.add(entity)
+    record_change(session, entity_type, entity, "insert")
+    session.flush()
+    return _dump(entity)
+
+
+def _update(session: Session, entity_type: str, entity, changes: dict, version: Optional[int]) -> dict:
+    """Misma semántica que el PATCH de la API: optimistic locking si se envía `version`."""
+    changes = dict(changes)
+    if version is not None:
+        changes["version"] = version
+    apply_optimistic_locking(entity, changes)
+    update_entity_fields(entity, changes)
+    if entity_type != "task":
+        try:
+            refresh_recurrence_end(entity)
+        except ValueError as e:
+            raise ToolError(f"400: Invalid rrule: {e}")
+    increment_version(entity)
+    session.add(entity)
+    record_change(session, entity_type, entity, "update")
+    session.flush()
+    return _dump(entity)
+
+
+def _delete(session: Session, entity_type: str, entity) -> dict:
+    session.delete(entity)
+    if entity_type != "task":
+        delete_overrides(session, entity_type, entity.id)
+    record_tombstone(session, entity_type, entity.id)
+    record_change(session, entity_type, entity, "delete")
+    return {"deleted": entity.id, "entity_type": entity_type}
+
+
+def _with_recurrence(entity):
+    try:
+        refresh_recurrence_end(entity)
+    except ValueError as e:
+        raise ToolError(f"400: Invalid rrule: {e}")
+    return entity
+
+
+# --- TAREAS ---
+@operation(read_only=True)
+def list_tasks(
+    session: Session,
+    status: Optional[str] = None,
+    priority: Optional[int] = None,
+    event_id: Optional[str] = None,
+    limit: int = 100,
+) -> List[dict]:
+    """Lista tareas, filtrando opcionalmente por estado (pending, doing, done), prioridad o evento."""
+    query = select(Task)
+    if status:
+        query = query.where(Task.status == status)
+    if priority:
+        query = query.where(Task.priority == priority)
+    if event_id:
+        query = query.where(Task.event_id == event_id)
+    return [_dump(task) for task in session.exec(query.order_by(Task.created_at).limit(limit))]
+
+
+@operation(read_only=True)
+def get_task(session: Session, task_id: str) -> dict:
+    """Obtiene una tarea por id."""
+    return _dump(_get(session, Task, task_id, "Task"))
+
+
+@operation()
+def create_task(
+    session: Session,
+    title: str,
+    status: str = "pending",
+    priority: int = 1,
+    event_id: Optional[str] = None,
+    timing_relative_to_event: Optional[str] = None,
+) -> dict:
+    """Crea una tarea (prioridad 1-5), opcionalmente vinculada a un evento (before, during, after)."""
+    return _create(session, "task", Task(
+        title=title, status=status, priority=priority,
+        event_id=event_id, timing_relative_to_event=timing_relative_to_event,
+    ))
+
+
+@operation()
+def update_task(session: Session, task_id: str, changes: dict, version: Optional[int] = None) -> dict:
+    """Modifica campos de una tarea. Con `version`, falla si otro la cambió antes (optimistic locking)."""
+    return _update(session, "task", _get(session, Task, task_id, "Task"), changes, version)
+
+
+@operation()
+def delete_task(session: Session, task_id: str) -> dict:
+    """Borra una tarea."""
+    return _delete(session, "task", _get(session, Task, task_id, "Task"))
+
+
+# --- EVENTOS ---
+@operation(read_only=True)
+def list_events(
+    session: Session,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    limit: int = 100,
+) -> List[dict]:
+    """
+    Lista eventos. Con `start`/`end` devuelve los que se solapan con la ventana,
+    con las series recurrentes expandidas en sus ocurrencias.
+    """
+    if start is not None or end is not None:
+        return [_dump(event) for event in events_in_window(session, select(Event), start, end)[:limit]]
+    return [_dump(event) for event in session.exec(select(Event).order_by(Event.start_at).limit(limit))]
+
+
+@operation(read_only=True)
+def get_event(session: Session, event_id: str) -> dict:
+    """Obtiene un evento por id."""
+    return _dump(_get(session, Event, event_id, "Event"))
+
+
+@operation()
+def create_event(
+    session: Session,
+    title: str,
+    start_at: datetime,
+    end_at: Optional[datetime] = None,
+    all_day: bool = False,
+    description: Optional[str] = None,
+    location: Optional[str] = None,
+    rrule: Optional[str] = None,
+) -> dict:
+    """Crea un evento, opcionalmente recurrente (`rrule` RFC 5545, ej. "FREQ=WEEKLY;BYDAY=MO")."""
+    return _create(session, "event", _with_recurrence(Event(
+        title=title, start_at=start_at, end_at=end_at, all_day=all_day,
+        description=description, location=location, rrule=rrule,
+    )))
+
+
+@operation()
+def update_event(session: Session, event_id: str, changes: dict, version: Optional[int] = None) -> dict:
+    """Modifica campos de un evento. Con `version`, falla si otro lo cambió antes (optimistic locking)."""
+    return _update(session, "event", _get(session, Event, event_id, "Event"), changes, version)
+
+
+@operation()
+def delete_event(session: Session, event_id: str) -> dict:
+    """Borra un evento (y las excepciones de sus ocurrencias)."""
+    return _delete(session, "event", _get(session, Event, event_id, "Event"))
+
+
+# --- RECORDATORIOS ---
+@operation(read_only=True)
+def list_reminders(
+    session: Session,
+    is_completed: Optional[bool] = None,
+    trigger_after: Optional[datetime] = None,
+    trigger_before: Optional[datetime] = None,
+    limit: int = 100,
+) -> List[dict]:
+    """Lista recordatorios. Con `trigger_after`/`trigger_before` las series se expanden en sus disparos."""
+    query = select(Reminder)
+    if is_completed is not None:
+        query = query.where(Reminder.is_completed == is_completed)
+    if trigger_after is not None or trigger_before is not None:
+        return [_dump(reminder) for reminder in reminders_in_window(session, query, trigger_after, trigger_before)[:limit]]
+    return [_dump(reminder) for reminder in session.exec(query.order_by(Reminder.trigger_at).limit(limit))]
+
+
+@operation(read_only=True)
+def get_reminder(session: Session, reminder_id: str) -> dict:
+    """Obtiene un recordatorio por id."""
+    return _dump(_get(session, Reminder, reminder_id, "Reminder"))
+
+
+@operation()
+def create_reminder(
+    session: Session,
+    message: str,
+    trigger_at: datetime,
+    task_id: Optional[str] = None,
+    event_id: Optional[str] = None,
+    rrule: Optional[str] = None,
+) -> dict:
+    """Crea un recordatorio, opcionalmente vinculado a una tarea o evento y recurrente (`rrule`)."""
+    return _create(session, "reminder", _with_recurrence(Reminder(
+        message=message, trigger_at=trigger_at, task_id=task_id, event_id=event_id, rrule=rrule,
+    )))
+
+
+@operation()
+def update_reminder(session: Session, reminder_id: str, changes: dict, version: Optional[int] = None) -> dict:
+    """Modifica campos de un recordatorio (ej. {"is_completed": true}). Con `version`, optimistic locking."""
+    return _update(session, "reminder", _get(session, Reminder, reminder_id, "Reminder"), changes, version)
+
+
+@operation()
+def delete_reminder(session: Session, reminder_id: str) -> dict:
+    """Borra un recordatorio."""
+    return _delete(session, "reminder", _get(session, Reminder, reminder_id, "Reminder"))
+
+
+# --- CHAT ---
+def _client_id(client_id: Optional[str]) -> str:
+    client_id = client_id or MCP_CLIENT_ID
+    if not client_id:
+        raise ToolError("400: client_id is required (or set MCP_CLIENT_ID)")
+    return client_id
+
+
+def _conversation(session: Session, conversation_id: int, client_id: Optional[str]) -> Conversation:
+    conversation = session.get(Conversation, conversation_id)
+    if not conversation or conversation.status == DELETING:
+        raise ToolError("404: Conversation not found")
+    if conversation.client_id != _client_id(client_id):
+        raise ToolError("403: Not authorized to access this conversation")
+    return conversation
+
+
+@operation(read_only=True)
+def list_conversations(session: Session, client_id: Optional[str] = None, limit: int = 20) -> List[dict]:
+    """Conversaciones activas de un cliente, de la más reciente a la más antigua."""
+    query = (
+        select(Conversation)
+        .where(Conversation.client_id == _client_id(client_id), Conversation.status == "active")
+        .order_by(Conversation.updated_at.desc())
+        .limit(limit)
+    )
+    return [_dump(conversation) for conversation in session.exec(query)]
+
+
+@operation(read_only=True)
+def get_messages(
+    session: Session,
+    conversation_id: int,
+    client_id: Optional[str] = None,
+    after_seq: Optional[int] = None,
+    limit: int = 50,
+) -> List[dict]:
+    """Mensajes de una conversación en orden (`seq`). Con `after_seq`, sólo los posteriores."""
+    conversation = _conversation(session, conversation_id, client_id)
+    statement = select(Message).where(Message.conversation_id == conversation_id)
+    if after_seq is not None:
+        statement = statement.where(Message.seq > after_seq)
+    hot = with_draft_content(session, session.exec(statement.order_by(Message.seq).limit(limit)).all())
+    messages = [_dump(message) for message in hot]
+
+    blob = get_archive(session, conversation_id) if conversation.status == "archived" else None
+    if blob is not None:
+        archived = [m for m in load_archived_messages(blob) if after_seq is None or (m.get("seq") or 0) > after_seq]
+        messages = sorted(archived + messages, key=lambda message: message.get("seq") or 0)[:limit]
+    return messages
+
+
+@operation()
+def add_message(
+    session: Session,
+    conversation_id: int,
+    role: str,
+    content: str,
+    client_id: Optional[str] = None,
+    ai_model_id: Optional[str] = None,
+) -> dict:
+    """Añade un mensaje (user, assistant, system, tool) a una conversación activa."""
+    if role not in MESSAGE_ROLES:
+        raise ToolError(f"400: role must be one of {', '.join(MESSAGE_ROLES)}")
+    conversation = _conversation(session, conversation_id, client_id)
+    if conversation.status in ("archived", ARCHIVING):
+        raise ToolError("409: Conversation is archived; set status to 'active' to continue it")
+    message = Message(conversation_id=conversation_id, role=role, content=content, ai_model_id=ai_model_id)
+    session.add(message)
+    session.flush()
+    session.refresh(message)
+    data = _dump(message)
+    # Sin tocar la fila de la conversación (ver src/core/activity.py)
+    _after_commit(session, lambda: activity_tracker.touch(conversation_id, message.created_at))
+    # En Postgres el seq se asigna al hacer commit (ver src/core/message_seq.py)
+    _after_commit(session, lambda: data.update(seq=message.seq))
+    return data
+
+
+# --- VARIAS OPERACIONES EN UNA TRANSACCIÓN ---
+class BatchOperation(BaseModel):
+    tool: str
+    arguments: Dict[str, Any] = {}
+
+
+def _resolve_references(value, results: List[Any]):
+    """Sustituye "$N.campo" por el campo del resultado N (recursivo en listas y dicts)."""
+    if isinstance(value, str) and value.startswith("$") and "." in value:
+        index, _, field = value[1:].partition(".")
+        if index.isdigit():
+            if int(index) >= len(results):
+                raise ToolError(f"400: Reference {value} points to an operation that has not run yet")
+            result = results[int(index)]
+            if not isinstance(result, dict) or field not in result:
+                raise ToolError(f"400: Reference {value} does not match any result field")
+            return result[field]
+    if isinstance(value, list):
+        return [_resolve_references(item, results) for item in value]
+    if isinstance(value, dict):
+        return {key: _resolve_references(item, results) for key, item in value.items()}
+    return value
+
+
+def _run_batch(cache: Optional[TurnReadCache], operations: List[BatchOperation]) -> List[Any]:
+    results: List[Any] = []
+    wrote = False
+    generation = _current_generation
+    with Session(get_engine()) as session:
+        for index, op in enumerate(operations):
+            if op.tool not in OPERATIONS:
+                raise ToolError(f"400: Operation {index}: unknown tool '{op.tool}'")
+            fn, read_only = OPERATIONS[op.tool]
+            try:
+                arguments = _resolve_references(op.arguments, results)
+                # Tras una escritura de este mismo lote, las lecturas deben verla: sin caché
+                key = _cache_key(op.tool, arguments) if cache is not None and read_only and not wrote else None
+                cached = cache.get(key) if key else None
+                if cached is not None:
+                    results.append(cached)
+                    continue
+                result = fn(session, **arguments)
+            except Exception as e:
+                error = _tool_error(e)
+                raise ToolError(f"Operation {index} ({op.tool}) failed, nothing was applied. {error}") from e
+            if key:
+                cache.put(key, result, generation)
+            wrote = wrote or not read_only
+            results.append(result)
+        if wrote:
+            try:
+                _commit(session)
+            except Exception as e:
+                raise _tool_error(e) from e
+    return results
+
+
+@server.tool(annotations=ToolAnnotations(readOnlyHint=False))
+def batch(operations: List[BatchOperation], ctx: Context) -> List[Any]:
+    """
+    Ejecuta varias herramientas en UNA transacción: o se aplican todas o ninguna.
+    Cada operación es {"tool": "<nombre>", "arguments": {...}}. Un argumento "$N.campo"
+    toma ese campo del resultado de la operación N, ej.:
+    [{"tool": "create_event", "arguments": {"title": "Demo", "start_at": "2026-03-02T10:00:00"}},
+     {"tool": "create_task", "arguments": {"title": "Preparar demo", "event_id": "$0.id", "timing_relative_to_event": "before"}}]
+    """
+    return _run_batch(_connection_cache(ctx), operations)
+
+
+# --- ARRANQUE ---
+def _require_api_secret(app):
+    """ASGI: por SSE, mismo Bearer que la API (API_SECRET_KEY)."""
+    expected = os.getenv("API_SECRET_KEY")
+
+    async def guarded(scope, receive, send):
+        if scope["type"] == "http":
+            authorization = dict(scope["headers"]).get(b"authorization", b"").decode()
+            scheme, _, token = authorization.partition(" ")
+            if not expected or scheme.lower() != "bearer" or token != expected:
+                await send({"type": "http.response.start", "status": 401, "headers": [(b"www-authenticate", b"Bearer")]})
+                await send({"type": "http.response.body", "body": b"Unauthorized"})
+                return
+        await app(scope, receive, send)
+
+    return guarded
+
+
+def main():
+    # Todo lo que se imprime antes de abrir el transporte va a stderr (stdout es el canal MCP)
+    with contextlib.redirect_stdout(sys.stderr):
+        init_db()
+        start_periodic_job("conversation-activity", CONVERSATION_ACTIVITY_FLUSH_SECONDS, flush_activity)
+    try:
+        if MCP_TRANSPORT == "sse":
+            import uvicorn
+            app = _require_api_secret(server.sse_app(host=MCP_HOST))
+            print(f"🧠 Servidor MCP (SSE) en http://{MCP_HOST}:{MCP_PORT}/sse", file=sys.stderr)
+            uvicorn.run(app, host=MCP_HOST, port=MCP_PORT, log_level="warning")
+        else:
+            server.run("stdio")
+    finally:
+        stop_jobs()
+        activity_tracker.flush()
+
+
+if __name__ == "__main__":
+    main()